@@ -0,0 +1,258 @@
+"""
+Validation and writes of lists of objects with bulk queries.
+"""
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import serializers
+
+from webshop_drf.utils import retry_on_slug_collision
+
+from ..bitmaps import update_attribute_index_many
+from ..cache import bump_catalog_version, bump_fragment_versions
+from .fields import PrefetchedPrimaryKeyRelatedField
+from .fragments import FragmentListSerializer
+
+SLUG_SIZE = 10
+
+
+def prefetch_references(serializer, data):
+    """
+    Load the objects referenced in data (a list of raw items)
+    by the PrefetchedPrimaryKeyRelatedFields of serializer
+    and its nested list serializers, one IN query per field.
+    Models with lookup methods on their manager (see ProductManager)
+    are loaded through them, objects in the identity map of the
+    request are not queried again.
+    """
+    for field in serializer.fields.values():
+        if field.read_only:
+            continue
+        values = [
+            item[field.field_name] for item in data
+            if isinstance(item, dict) and field.field_name in item
+        ]
+        if isinstance(field, serializers.ListSerializer):
+            if isinstance(field.child, serializers.Serializer):
+                nested = [x for value in values if isinstance(value, list) for x in value]
+                prefetch_references(field.child, nested)
+        elif isinstance(field, PrefetchedPrimaryKeyRelatedField):
+            queryset = field.get_queryset()
+            pks = set()
+            for value in values:
+                if isinstance(value, bool):
+                    continue
+                try:
+                    pks.add(queryset.model._meta.pk.to_python(value))
+                except (DjangoValidationError, TypeError, ValueError):
+                    continue
+            manager = queryset.model._default_manager
+            if not pks:
+                objects = []
+            elif hasattr(manager, 'get_many') and not queryset.query.has_filters():
+                objects = manager.get_many(pks).values()
+            else:
+                objects = queryset.filter(pk__in=pks)
+            field.prefetched = {str(obj.pk): obj for obj in objects}
+
+
+def get_connected_values(instance, attributes):
+    """
+    Return the validated connected attributes of instance
+    as {(instance pk, connection pk): value pk}
+    """
+    return {
+        (instance.pk, attr['connection'].pk): attr['value'].pk
+        for attr in attributes
+    }
+
+
+def write_connected(model, field, desired, owners=()):
+    """
+    Write the connected attribute rows of model,
+    desired is {(owner pk, connection pk): value pk}
+    and field is the foreign key of model to the owner.
+    The stored rows of the owners are matched by their connection,
+    unchanged ones are kept, changed ones are updated and the rest
+    are deleted, with one query each. New rows are inserted with one query.
+    The changes are applied to the attribute index (field is 'product'
+    or 'variant', see AttributeBitmapIndex).
+    """
+    desired = dict(desired)
+    stale = []
+    changed = []
+    # Bulk writes send no signals, their changes of the attribute index
+    index_changes = []
+    if owners:
+        for row in model.objects.filter(**{f'{field}__in': owners}):
+            owner_id = getattr(row, f'{field}_id')
+            value_id = desired.pop((owner_id, row.connection_id), None)
+            if value_id is None:
+                stale.append(row.pk)
+            elif value_id != row.value_id:
+                index_changes.append((f'remove_{field}_value', (owner_id, row.value_id)))
+                index_changes.append((f'add_{field}_value', (owner_id, value_id)))
+                row.value_id = value_id
+                changed.append(row)
+    if stale:
+        model.objects.filter(pk__in=stale).delete()
+    index_changes.extend(
+        (f'add_{field}_value', (owner_id, value_id))
+        for (owner_id, _connection_id), value_id in desired.items()
+    )
+    update_attribute_index_many(index_changes)
+    model.objects.bulk_update(changed, ['value'])
+    model.objects.bulk_create([
+        model(**{f'{field}_id': owner_id}, connection_id=connection_id, value_id=value_id)
+        for (owner_id, connection_id), value_id in desired.items()
+    ])
+
+
+class PrefetchReferencesMixin:
+    """
+    Serializer mixin which loads the objects referenced by
+    a single object in bulk before validating it, so its
+    PrefetchedPrimaryKeyRelatedFields (nested ones included)
+    do not run one query per reference.
+    Items of a BulkListSerializer are loaded by the list.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, dict) and not isinstance(getattr(self, 'parent', None), BulkListSerializer):
+            prefetch_references(self, [data])
+        return super().to_internal_value(data)
+
+
+class BulkListSerializer(FragmentListSerializer):
+    """
+    ListSerializer which validates a list of objects with their
+    references loaded in bulk and creates or updates them with
+    bulk queries in one transaction.
+
+    Updated items are matched to the instances by their 'id'.
+    The child serializer builds the (unsaved) instances with
+    build(validated_data) and assign(instance, validated_data).
+    The connected attribute rows of connected_source are diffed
+    against the stored ones on update.
+    """
+    connected_model = None
+    # foreign key of connected_model to the instance
+    connected_field = None
+    connected_source = 'attributes'
+    update_fields = []
+
+    default_error_messages = {
+        'not_found': _('No object with given ID can be found.'),
+        'repeated': _('Object is repeated in the list.'),
+    }
+
+    def get_child_instances(self, data):
+        """
+        Return the instance of each item, None for new items
+        """
+        if self.instance is None:
+            return [None] * len(data)
+        instances = {str(obj.pk): obj for obj in self.instance}
+        return [
+            instances.get(str(item.get('id'))) if isinstance(item, dict) else None
+            for item in data
+        ]
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not data:
+            return super().to_internal_value(data)
+
+        prefetch_references(self.child, data)
+        instances = self.get_child_instances(data)
+
+        ret = []
+        errors = []
+        seen = set()
+        for item, instance in zip(data, instances):
+            self.child.instance = instance
+            try:
+                if self.instance is not None:
+                    if instance is None:
+                        raise serializers.ValidationError({'id': [self.error_messages['not_found']]})
+                    if instance.pk in seen:
+                        raise serializers.ValidationError({'id': [self.error_messages['repeated']]})
+                    seen.add(instance.pk)
+                validated = self.child.run_validation(item)
+            except serializers.ValidationError as exc:
+                errors.append(exc.detail)
+            else:
+                ret.append(validated)
+                errors.append({})
+        self.child.instance = None
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        self.child_instances = instances
+        return ret
+
+    def create(self, validated_data):
+        instances = [self.child.build(item) for item in validated_data]
+        with transaction.atomic():
+            self.insert(instances)
+            self.save_connected(instances, validated_data)
+        self.invalidate(instances)
+        return instances
+
+    def update(self, instance, validated_data):
+        instances = self.child_instances
+        now = timezone.now()
+        for obj, item in zip(instances, validated_data):
+            self.child.assign(obj, item)
+            obj.modified = now
+        model = self.child.Meta.model
+        with transaction.atomic():
+            model.objects.bulk_update(instances, self.update_fields + ['modified'])
+            self.save_connected(instances, validated_data)
+        self.invalidate(instances)
+        return instances
+
+    def insert(self, instances):
+        """
+        Insert the instances with one query and set their pk,
+        slugs are set here as bulk_create skips Model.save
+        """
+        model = self.child.Meta.model
+        retry_on_slug_collision(instances, lambda: model.objects.bulk_create(instances), SLUG_SIZE)
+        if any(obj.pk is None for obj in instances):
+            # The database can not return the inserted ids
+            pks = dict(model.objects
+                       .filter(slug__in=[obj.slug for obj in instances])
+                       .values_list('slug', 'pk'))
+            for obj in instances:
+                obj.pk = pks[obj.slug]
+                obj._state.adding = False
+
+    def save_connected(self, instances, validated_data):
+        """
+        Create the connected rows of new instances,
+        update, create or delete the changed ones of updated instances.
+        Instances without connected data keep their rows.
+        """
+        desired = {}
+        owners = []
+        for obj, item in zip(instances, validated_data):
+            if not item.get(self.connected_source):
+                continue
+            owners.append(obj.pk)
+            desired.update(get_connected_values(obj, item[self.connected_source]))
+        if not owners:
+            return
+
+        write_connected(self.connected_model, self.connected_field, desired,
+                        owners if self.instance is not None else ())
+
+    def invalidate(self, instances):
+        """
+        Invalidate cached data of the written instances,
+        bulk queries do not send model signals.
+        Subclasses extend it for data derived from their model.
+        """
+        bump_catalog_version()
+        bump_fragment_versions(self.child.Meta.model, [obj.pk for obj in instances])
@@ -1,16 +1,112 @@
+from functools import lru_cache
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import get_script_prefix, get_urlconf
+from django.urls import reverse as django_reverse
 from rest_framework import serializers
 from rest_framework.reverse import reverse
 
+PK_PLACEHOLDER = '0pk0placeholder0'
 
-class AttributeHIField(serializers.HyperlinkedIdentityField):
 
-    def get_url(self, obj, view_name, request, format):
-        kwargs = {'pk': obj.attribute_id, }
-        return reverse(view_name, kwargs=kwargs, request=request, format=format)
+@lru_cache(maxsize=None)
+def get_url_pattern(view_name, format, script_prefix, urlconf):
+    """
+    Resolve a detail route once and return
+    the parts of its path before and after the pk
+    """
+    kwargs = {'pk': PK_PLACEHOLDER}
+    if format is not None:
+        kwargs['format'] = format
+    url = django_reverse(view_name, kwargs=kwargs, urlconf=urlconf)
+    head, tail = url.split(PK_PLACEHOLDER)
+    return head, tail
+
+
+@receiver(setting_changed)
+def clear_url_pattern_cache(setting, **kwargs):
+    if setting == 'ROOT_URLCONF':
+        get_url_pattern.cache_clear()
+
+
+def build_url(view_name, pk, request=None, format=None):
+    """
+    Same as rest_framework.reverse.reverse(view_name, kwargs={'pk': pk})
+    but the route is resolved only once per process
+    """
+    if getattr(request, 'versioning_scheme', None) is not None:
+        return reverse(view_name, kwargs={'pk': pk}, request=request, format=format)
 
+    head, tail = get_url_pattern(view_name, format, get_script_prefix(), get_urlconf())
+    url = f'{head}{pk}{tail}'
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
 
-class ConnectedAttributeHIField(serializers.HyperlinkedIdentityField):
+
+class CachedURLMixin:
+    """
+    Hyperlinked field mixin which builds URLs with build_url
+    from the pk returned by get_url_pk.
+    url_pk_column is the same pk as a .values() lookup.
+    """
+    url_pk_column = 'pk'
+
+    def get_url_pk(self, obj):
+        return obj.pk
 
     def get_url(self, obj, view_name, request, format):
-        kwargs = {'pk': obj.connection.attribute.id, }
-        return reverse(view_name, kwargs=kwargs, request=request, format=format)
+        if self.lookup_field != 'pk' or self.lookup_url_kwarg != 'pk':
+            return super().get_url(obj, view_name, request, format)
+
+        pk = self.get_url_pk(obj)
+        # Unsaved objects will not yet have a valid URL.
+        if pk in (None, ''):
+            return None
+        return build_url(view_name, pk, request=request, format=format)
+
+
+class CachedHyperlinkedIdentityField(CachedURLMixin, serializers.HyperlinkedIdentityField):
+    pass
+
+
+class CachedHyperlinkedRelatedField(CachedURLMixin, serializers.HyperlinkedRelatedField):
+    pass
+
+
+class AttributeHIField(CachedURLMixin, serializers.HyperlinkedIdentityField):
+    url_pk_column = 'attribute'
+
+    def get_url_pk(self, obj):
+        return obj.attribute_id
+
+
+class ConnectedAttributeHIField(CachedURLMixin, serializers.HyperlinkedIdentityField):
+    # Lookups needed by get_url_pk, used for eager loading
+    select_related = ('connection',)
+    url_pk_column = 'connection__attribute'
+
+    def get_url_pk(self, obj):
+        return obj.connection.attribute_id
+
+
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField which first looks up its objects in the
+    ones loaded in bulk (see bulk.prefetch_references),
+    so validating a list or a nested list does not run
+    one query per item
+    """
+
+    def __init__(self, **kwargs):
+        # {str(pk): object}
+        self.prefetched = None
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if self.prefetched is not None and not isinstance(data, bool):
+            obj = self.prefetched.get(str(data))
+            if obj is not None:
+                return obj
+        return super().to_internal_value(data)
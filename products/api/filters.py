@@ -0,0 +1,257 @@
+"""
+Query parameter filters and ordering of the catalog endpoints.
+
+The filters are plain column comparisons which match the composite
+indexes of the models (see the Meta.indexes of Product and
+ProductVariant), so a filtered and ordered page is one index range scan.
+"""
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Func, OuterRef, Q, Subquery
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from ..bitmaps import Bitset, get_attribute_index
+from ..models import AttributeValue, ProductTemplate
+
+TRUE_VALUES = ('1', 'true', 'yes')
+FALSE_VALUES = ('0', 'false', 'no')
+
+
+def parse_decimal(name, value):
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        number = None
+    if number is None or not number.is_finite():
+        raise ValidationError({name: [_("A valid number is required.")]})
+    return number
+
+
+def parse_int(name, value, minimum=0, maximum=None):
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValidationError({name: [_("A valid integer is required.")]})
+    if number < minimum:
+        raise ValidationError({name: [_(f"Must be at least {minimum}.")]})
+    if maximum is not None and number > maximum:
+        raise ValidationError({name: [_(f"Must be at most {maximum}.")]})
+    return number
+
+
+def parse_bool(name, value):
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValidationError({name: [_("Must be a valid boolean.")]})
+
+
+def parse_attributes(name, values):
+    """
+    Parse `slug:value` items into {attribute slug: [values]}
+    """
+    attributes = OrderedDict()
+    for item in values:
+        slug, sep, value = item.partition(':')
+        if not sep or not slug or not value:
+            raise ValidationError({name: [_(f"Attribute filter({item}) is not in the form slug:value.")]})
+        attributes.setdefault(slug, []).append(value)
+    return attributes
+
+
+def get_template(value):
+    """
+    Return the ProductTemplate with the given id or slug, or None
+    """
+    lookup = {'id': int(value)} if value.isdecimal() else {'slug': value}
+    return ProductTemplate.objects.filter(**lookup).first()
+
+
+class CatalogFilterBackend(BaseFilterBackend):
+    """
+    Filter backend for `?min_price=`, `?max_price=`, `?active=`
+    and `?template=` (id or slug) on the view's filter_fields:
+    {'price': lookup of the price amount, 'active': ..., 'template': ...}.
+    Filters whose lookup is not set are ignored.
+
+    `?attr=<attribute slug>:<value>` (repeatable) keeps the objects
+    connected to the attribute value through any of the view's
+    attribute_filter_fields: [(field, connected model, column)],
+    eg. ('id', ConnectedProductAttribute, 'product_id'). Values of the
+    same attribute are alternatives, different attributes all have to match.
+    Each attribute is one indexed subquery per connected model, views
+    of products with attribute_index = True intersect the bitsets of
+    the AttributeBitmapIndex instead and filter by the matching ids
+    when there are at most max_index_ids of them.
+    """
+    max_index_ids = 500
+
+    def get_filters(self, request, view):
+        fields = getattr(view, 'filter_fields', {})
+        params = request.query_params
+        filters = {}
+
+        price = fields.get('price')
+        if price:
+            if params.get('min_price'):
+                filters[f'{price}__gte'] = parse_decimal('min_price', params['min_price'])
+            if params.get('max_price'):
+                filters[f'{price}__lte'] = parse_decimal('max_price', params['max_price'])
+
+        active = fields.get('active')
+        if active and params.get('active'):
+            filters[active] = parse_bool('active', params['active'])
+
+        template = fields.get('template')
+        if template and params.get('template'):
+            value = params['template']
+            if value.isdecimal():
+                filters[f'{template}_id'] = int(value)
+            else:
+                filters[f'{template}__slug'] = value
+
+        return filters
+
+    def get_attribute_filters(self, request, view):
+        fields = getattr(view, 'attribute_filter_fields', ())
+        values = request.query_params.getlist('attr')
+        if not fields or not values:
+            return []
+
+        attributes = parse_attributes('attr', values)
+        if getattr(view, 'attribute_index', False):
+            # The list filters the queryset more than once per request
+            if not hasattr(request, '_attribute_value_ids'):
+                request._attribute_value_ids = get_value_ids(attributes)
+            bits = get_attribute_index().match(request._attribute_value_ids)
+            if len(bits) <= self.max_index_ids:
+                return [Q(pk__in=bits.ids())]
+
+        filters = []
+        for slug, names in attributes.items():
+            value_ids = AttributeValue.objects.filter(attribute__slug=slug, value__in=names).values('id')
+            condition = Q()
+            for field, model, column in fields:
+                condition |= Q(**{f'{field}__in': model.objects.filter(value_id__in=value_ids).values(column)})
+            filters.append(condition)
+        return filters
+
+    def filter_queryset(self, request, queryset, view):
+        filters = self.get_filters(request, view)
+        if filters:
+            queryset = queryset.filter(**filters)
+        for condition in self.get_attribute_filters(request, view):
+            queryset = queryset.filter(condition)
+        return queryset
+
+
+def get_value_ids(attributes):
+    """
+    Return the ids of the AttributeValues of each attribute
+    of {attribute slug: [values]} as a list, with one query
+    """
+    condition = Q()
+    for slug, values in attributes.items():
+        condition |= Q(attribute__slug=slug, value__in=values)
+    groups = OrderedDict((slug, []) for slug in attributes)
+    for slug, value_id in AttributeValue.objects.filter(condition).values_list('attribute__slug', 'id'):
+        groups[slug].append(value_id)
+    return list(groups.values())
+
+
+def get_facets(template, queryset, lookups, index=None, max_index_ids=None):
+    """
+    Return the facet counts of the objects of queryset for every
+    value of the template's product and variant attributes as
+    {attribute slug: [{'id', 'name', 'value', 'count'}]}.
+
+    With an AttributeBitmapIndex (queryset has to be of products) the
+    ids of queryset are loaded and the counts are popcounts in memory,
+    when there are at most max_index_ids of them (if given),
+    otherwise they are counted in the same query with a subquery per
+    value, lookups are the paths from AttributeValue to the counted
+    model and the count of a value is the number of distinct objects
+    reached through any of them.
+    """
+    values = (AttributeValue.objects
+              .filter(Q(attribute__attribute_product__product_template=template)
+                      | Q(attribute__attribute_variant__product_template=template))
+              .distinct()
+              .order_by('attribute_id', 'id')
+              .values('id', 'name', 'value', 'attribute__slug'))
+
+    ids = None
+    if index is not None:
+        ids = queryset.order_by().values_list('pk', flat=True)
+        if max_index_ids is not None:
+            ids = list(ids[:max_index_ids + 1])
+            if len(ids) > max_index_ids:
+                ids = None
+
+    if ids is not None:
+        bits = Bitset.from_ids(ids)
+        values = list(values)
+        counts = index.count([row['id'] for row in values], bits)
+        for row in values:
+            row['count'] = counts[row['id']]
+    else:
+        values = values.annotate(count=get_count_subquery(queryset, lookups))
+
+    facets = OrderedDict()
+    for row in values:
+        facets.setdefault(row['attribute__slug'], []).append(OrderedDict([
+            ('id', row['id']),
+            ('name', row['name']),
+            ('value', row['value']),
+            ('count', row['count']),
+        ]))
+    return facets
+
+
+def get_count_subquery(queryset, lookups):
+    """
+    Count the distinct objects of queryset reached from the outer
+    AttributeValue through any of lookups, an object reached through
+    more than one of them is counted once
+    """
+    condition = Q()
+    for lookup in lookups:
+        reached = AttributeValue.objects.filter(pk=OuterRef(OuterRef('pk'))).values(lookup)
+        condition |= Q(pk__in=reached)
+    count = Func('pk', function='COUNT', template='%(function)s(DISTINCT %(expressions)s)')
+    return Subquery(queryset.order_by().filter(condition).annotate(count=count).values('count'))
+
+
+def get_requested_ordering(request, view):
+    """
+    Return the ordering requested with `?ordering=` as a tuple of
+    model fields ending with the pk, None when it is not given.
+    The names a view accepts are the keys of its ordering_fields,
+    prefixed with '-' for descending order.
+    """
+    param = getattr(view, 'ordering_param', 'ordering')
+    value = request.query_params.get(param) if request is not None else None
+    if not value:
+        return None
+
+    fields = getattr(view, 'ordering_fields', {})
+    ordering = []
+    for name in value.split(','):
+        name = name.strip()
+        descending = name.startswith('-')
+        field = fields.get(name.lstrip('-'))
+        if field is None:
+            raise ValidationError({param: [
+                _(f"Ordering({name}) is not one of the permitted values: {', '.join(fields)}")
+            ]})
+        ordering.append(f'-{field}' if descending else field)
+
+    if not any(f.lstrip('-') in ('id', 'pk') for f in ordering):
+        # Keep pages stable, the last field has to be unique
+        ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+    return tuple(ordering)
@@ -0,0 +1,133 @@
+"""
+Per-instance cache of serialized representations (fragments).
+
+A fragment is keyed by the model, the pk, the instance's `modified`
+timestamp (if it has one), its fragment version counter (bumped by
+the model signals when the instance or its nested rows change)
+and the signature of the representation (fields, host and format).
+Representations with expanded fields are not cached, they hold data
+of other instances whose changes do not bump the version.
+"""
+import hashlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import models
+from rest_framework import serializers
+
+from ..cache import get_cache, get_fragment_versions
+
+
+def fragments_enabled():
+    return bool(getattr(settings, 'CATALOG_CACHE_TIMEOUT', 0))
+
+
+def has_fragments(serializer):
+    return not getattr(serializer, 'expanded_fields', None)
+
+
+def get_shape(serializer):
+    """
+    Names and types of the fields of a serializer with the fields of
+    the nested serializers, so an expanded field differs from the
+    hyperlink of the same name
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        return f'[{get_shape(serializer.child)}]'
+    parts = []
+    for name, field in serializer.fields.items():
+        if isinstance(field, serializers.BaseSerializer):
+            parts.append(f'{name}:{get_shape(field)}')
+        else:
+            parts.append(f'{name}:{field.__class__.__name__}')
+    return '{' + ','.join(parts) + '}'
+
+
+def get_signature(serializer, request=None, format=None):
+    """
+    Identify the shape of a representation
+    """
+    parts = [
+        f'{serializer.__class__.__module__}.{serializer.__class__.__name__}',
+        get_shape(serializer),
+        request.build_absolute_uri('/') if request is not None else '',
+        format or '',
+    ]
+    return hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def to_plain(data):
+    """
+    Plain copy of a representation which can be cached,
+    hyperlinks would pickle their model instance as well
+    """
+    if isinstance(data, dict):
+        return OrderedDict((k, to_plain(v)) for k, v in data.items())
+    if isinstance(data, list):
+        return [to_plain(x) for x in data]
+    if isinstance(data, str):
+        return str(data)
+    return data
+
+
+def get_item_value(item, name):
+    if isinstance(item, dict):
+        return item[name]
+    return getattr(item, name)
+
+
+def render_with_fragments(model, items, render, signature):
+    """
+    Return the representations of items (model instances or
+    .values() rows) from the fragment cache, only the missing
+    ones are rendered with render(items) and stored.
+    """
+    if not fragments_enabled() or not items:
+        return render(items)
+
+    pk_name = model._meta.pk.attname
+    has_modified = any(f.name == 'modified' for f in model._meta.concrete_fields)
+    pks = [get_item_value(item, pk_name) for item in items]
+    versions = get_fragment_versions(model, pks)
+
+    keys = []
+    for item, pk in zip(items, pks):
+        modified = get_item_value(item, 'modified').timestamp() if has_modified else ''
+        keys.append(
+            f'catalog:fragment:{model._meta.label_lower}:{pk}:{modified}:{versions[pk]}:{signature}'
+        )
+
+    cache = get_cache()
+    cached = cache.get_many(keys)
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    if missing:
+        rendered = render([items[i] for i in missing])
+        fresh = {keys[i]: to_plain(data) for i, data in zip(missing, rendered)}
+        cache.set_many(fresh, settings.CATALOG_CACHE_TIMEOUT)
+        cached.update(fresh)
+    return [cached[key] for key in keys]
+
+
+class FragmentListSerializer(serializers.ListSerializer):
+    """
+    ListSerializer which reads and writes the fragment cache
+    of its child for every instance,
+    set as Meta.list_serializer_class of the child
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        items = list(iterable)
+        if not has_fragments(self.child):
+            return [self.child.to_representation(item) for item in items]
+        signature = get_signature(
+            self.child,
+            request=self.context.get('request'),
+            format=self.context.get('format'),
+        )
+        return render_with_fragments(
+            self.child.Meta.model,
+            items,
+            lambda missing: [self.child.to_representation(item) for item in missing],
+            signature
+        )
@@ -0,0 +1,698 @@
+import hashlib
+import sys
+from datetime import datetime
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Count, Max, Prefetch
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.timezone import utc
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import SAFE_METHODS, BasePermission
+from rest_framework.relations import ManyRelatedField, RelatedField
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from ..bitmaps import get_attribute_index
+from ..cache import get_cache, get_catalog_version, get_fragment_versions
+from ..exchange import get_rate_table, get_rates_version
+from ..search import search_products
+from .filters import get_facets, get_template, parse_int
+from .fragments import FragmentListSerializer, get_signature, has_fragments, render_with_fragments
+from .pagination import get_ordering
+from .renderers import NDJSONRenderer, dumps
+from .utils import get_relation_path
+from .values import compile_plan
+
+
+def get_eager_loading(serializer, prefix=''):
+    """
+    Collect select_related lookups and prefetches
+    needed by the declared fields of the (model) serializer.
+
+    - nested many=True serializers become a Prefetch whose
+      queryset is planned from the child serializer
+    - nested single serializers are select_related and
+      their own needs are added with the lookup as prefix
+    - dotted sources (eg. 'attribute.name') are select_related
+    - fields can declare extra lookups with a `select_related` attribute
+    """
+    model = serializer.Meta.model
+    select_related = set()
+    prefetch_related = []
+
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+
+        select_related.update(prefix + x for x in getattr(field, 'select_related', ()))
+        if field.source == '*':
+            continue
+
+        if isinstance(field, serializers.ListSerializer):
+            child = field.child
+            child_queryset = child.Meta.model._default_manager.all()
+            prefetch_related.append(Prefetch(
+                prefix + field.source,
+                queryset=setup_eager_loading(child, child_queryset)
+            ))
+            continue
+
+        if isinstance(field, ManyRelatedField):
+            prefetch_related.append(prefix + field.source)
+            continue
+
+        if isinstance(field, serializers.ModelSerializer):
+            path = get_relation_path(model, field.source_attrs)
+            if path:
+                select_related.add(prefix + path)
+                child_select, child_prefetch = get_eager_loading(
+                    field, prefix=f'{prefix}{path}__'
+                )
+                select_related.update(child_select)
+                prefetch_related.extend(child_prefetch)
+            continue
+
+        attrs = field.source_attrs
+        if not (isinstance(field, RelatedField) and not field.use_pk_only_optimization()):
+            # Last attribute is read from the loaded object itself
+            attrs = attrs[:-1]
+        path = get_relation_path(model, attrs)
+        if path:
+            select_related.add(prefix + path)
+
+    return select_related, prefetch_related
+
+
+def setup_eager_loading(serializer, queryset):
+    """
+    Add select_related/prefetch_related chains to the queryset
+    based on the declared fields of the (model) serializer.
+    """
+    select_related, prefetch_related = get_eager_loading(serializer)
+    if select_related:
+        queryset = queryset.select_related(*sorted(select_related))
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
+
+
+class EagerLoadingMixin:
+    """
+    Viewset mixin which plans the queryset's
+    select_related/prefetch_related chains
+    from the shape of the viewset's serializer.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return setup_eager_loading(self.get_serializer(), queryset)
+
+
+class DynamicFieldsMixin:
+    """
+    Serializer mixin for sparse fieldsets and on-demand expansion.
+
+    Top level serializers of GET requests read the
+    `?fields=id,name` and `?expand=product_template` query parameters,
+    nested serializers can be given `fields` and `expand` as arguments.
+
+    Expandable fields are declared in Meta.expandable_fields as
+    {name: (serializer class name, keyword arguments)}, the expanded
+    serializer replaces the field (eg. a hyperlink) with the same name.
+    Fields which are not requested are not serialized,
+    and thus not planned by setup_eager_loading either.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    def __init__(self, *args, **kwargs):
+        self._requested_fields = kwargs.pop('fields', None)
+        self._requested_expand = kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        only, expand = self.get_requested_fields()
+
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        for name in self.expanded_fields:
+            klass, kwargs = expandable[name]
+            if isinstance(klass, str):
+                klass = getattr(sys.modules[self.__class__.__module__], klass)
+            fields[name] = klass(read_only=True, **kwargs)
+
+        if only:
+            only = set(only) | set(expand)
+            fields = type(fields)((k, v) for k, v in fields.items() if k in only)
+        return fields
+
+    @property
+    def expanded_fields(self):
+        """
+        Names of the requested fields which are expanded
+        """
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        return [name for name in self.get_requested_fields()[1] if name in expandable]
+
+    def get_requested_fields(self):
+        """
+        Return (fields, expand) as lists, fields is empty
+        when every field should be serialized.
+        """
+        if self._requested_fields is not None or self._requested_expand is not None:
+            return list(self._requested_fields or []), list(self._requested_expand or [])
+
+        request = self.context.get('request')
+        if not self.is_root() or request is None or request.method not in SAFE_METHODS:
+            return [], []
+
+        return (
+            self.split_param(request.query_params.get(self.fields_query_param)),
+            self.split_param(request.query_params.get(self.expand_query_param)),
+        )
+
+    def is_root(self):
+        parent = getattr(self, 'parent', None)
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    @staticmethod
+    def split_param(value):
+        if not value:
+            return []
+        return [x.strip() for x in value.split(',') if x.strip()]
+
+
+class ValuesRepresentationMixin:
+    """
+    Viewset mixin which serves GET list and retrieve from .values() rows
+    through a ValuesPlan of the serializer, with the same output.
+    Falls back to the serializer when the plan can not be compiled
+    or object level permissions have to check model instances.
+    """
+    values_representation = True
+
+    def get_values_plan(self):
+        if not self.values_representation or self.request.method not in ('GET', 'HEAD'):
+            return None
+        for permission in self.get_permissions():
+            if type(permission).has_object_permission is not BasePermission.has_object_permission:
+                return None
+        return compile_plan(self.get_serializer())
+
+    def render_values(self, plan, rows):
+        serializer = plan.serializer
+        render = partial(plan.render, request=self.request, format=self.format_kwarg)
+        list_serializer_class = getattr(serializer.Meta, 'list_serializer_class', None)
+        if (list_serializer_class and issubclass(list_serializer_class, FragmentListSerializer)
+                and has_fragments(serializer)):
+            signature = get_signature(serializer, request=self.request, format=self.format_kwarg)
+            return render_with_fragments(plan.model, list(rows), render, signature)
+        return render(rows)
+
+    def list(self, request, *args, **kwargs):
+        plan = self.get_values_plan()
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = plan.values(
+            self.filter_queryset(self.get_queryset()),
+            extra_columns=[f.lstrip('-') for f in get_ordering(self)]
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.render_values(plan, page))
+        return Response(self.render_values(plan, queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        plan = self.get_values_plan()
+        if plan is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        queryset = plan.values(self.filter_queryset(self.get_queryset()))
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return Response(self.render_values(plan, [row])[0])
+
+
+class FacetMixin:
+    """
+    Viewset mixin which adds the facet counts of the filtered list
+    to paginated list responses filtered by `?template=`:
+    {'facets': {attribute slug: [{'id', 'name', 'value', 'count'}]}}
+    for every value of the template's attributes (see get_facets),
+    counted with one query over facet_lookups, or from the
+    AttributeBitmapIndex when the view has attribute_index = True
+    and the list has at most facet_max_index_ids objects.
+    """
+    facet_lookups = ()
+    attribute_index = False
+    facet_max_index_ids = 10000
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        value = request.query_params.get('template')
+        if not self.facet_lookups or not value or not isinstance(response.data, dict):
+            return response
+
+        template = get_template(value)
+        if template is not None:
+            queryset = self.filter_queryset(self.get_queryset())
+            index = get_attribute_index() if self.attribute_index else None
+            response.data['facets'] = get_facets(template, queryset, self.facet_lookups,
+                                                 index, self.facet_max_index_ids)
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Viewset mixin which adds strong ETag and Last-Modified headers
+    to GET list and retrieve responses and answers conditional
+    requests with 304 without loading or serializing any object.
+
+    The version of a resource is computed in one aggregate query
+    over conditional_fields: the greatest timestamp and the row count
+    of each (so deleted rows change the ETag as well).
+    Related rows without timestamps (eg. connected attributes) are
+    covered by the fragment version of the instance, which their
+    signals bump with the time of the change (see cache).
+
+    Lists and expanded representations have no Last-Modified header:
+    they hold rows of other instances and deleting one of their rows
+    does not move the greatest timestamp, so If-Modified-Since would
+    be answered with a stale 304. Their ETag holds the catalog version.
+    """
+    conditional_fields = ()
+
+    def get_version(self, queryset, detail=False):
+        """
+        Return (aggregates, last modified) of the queryset
+        or (None, None) if it is empty, last modified is None
+        when the representation can not tell it
+        """
+        aggregates = {}
+        for i, field in enumerate(self.conditional_fields):
+            relation = field.rpartition('__')[0] or 'pk'
+            aggregates[f'max_{i}'] = Max(field)
+            aggregates[f'count_{i}'] = Count(relation, distinct=True)
+        if detail:
+            aggregates['pk'] = Max('pk')
+        version = (queryset
+                   .select_related(None)
+                   .prefetch_related(None)
+                   .order_by()
+                   .aggregate(**aggregates))
+        timestamps = [x for k, x in sorted(version.items()) if k.startswith('max_') and x]
+        if not timestamps:
+            return None, None
+
+        if not detail or getattr(self.get_serializer(), 'expanded_fields', None):
+            version['catalog'] = get_catalog_version()
+            return version, None
+        nested = get_fragment_versions(queryset.model, [version['pk']])[version['pk']]
+        version['nested'] = nested
+        return version, max(timestamps + [datetime.fromtimestamp(nested / 1000000, tz=utc)])
+
+    def get_etag(self, version):
+        request = self.request
+        key = '|'.join([
+            request.build_absolute_uri(),
+            str(request.accepted_media_type),
+            repr(sorted(version.items())),
+        ])
+        return '"%s"' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def conditional_response(self, queryset, handler, request, *args, detail=False, **kwargs):
+        version, last_modified = self.get_version(queryset, detail=detail)
+        if version is None:
+            return handler(request, *args, **kwargs)
+
+        etag = self.get_etag(version)
+        last_modified = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if not self.conditional_fields:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.conditional_response(queryset, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.conditional_fields:
+            return super().retrieve(request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset())
+        # Lookup values of the wrong type are not found (as in get_object_or_404)
+        try:
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (TypeError, ValueError, DjangoValidationError):
+            raise Http404
+        return self.conditional_response(queryset, super().retrieve, request, *args, detail=True, **kwargs)
+
+
+class CacheResponseMixin:
+    """
+    Viewset mixin which caches rendered GET list and retrieve responses,
+    keyed on the URL (with query string), the negotiated media type
+    and the catalog version, which is bumped by the catalog models'
+    signals. Cached ETags are answered with 304 without any query.
+    The browsable API is not cached. The cached_headers of the
+    response are stored and replayed with its content.
+    """
+    cached_headers = ('ETag', 'Last-Modified', 'Vary', 'Allow')
+
+    def get_cache_key(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        if not getattr(settings, 'CATALOG_CACHE_TIMEOUT', 0):
+            return None
+        if request.accepted_renderer.format == 'api':
+            return None
+        key = '|'.join([request.build_absolute_uri(), str(request.accepted_media_type)])
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return f'catalog:response:{get_catalog_version()}:{digest}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        self.response_cache_key = self.get_cache_key(request)
+        if self.response_cache_key is None:
+            return handler(request, *args, **kwargs)
+
+        cached = get_cache().get(self.response_cache_key)
+        if cached is None:
+            return handler(request, *args, **kwargs)
+
+        # Nothing to store again
+        self.response_cache_key = None
+        content, content_type, headers = cached
+        last_modified = headers.get('Last-Modified')
+        response = get_conditional_response(
+            request,
+            etag=headers.get('ETag'),
+            last_modified=last_modified and parse_http_date_safe(last_modified),
+        )
+        if response is None:
+            response = HttpResponse(content, content_type=content_type)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(self, 'response_cache_key', None)
+        if key and isinstance(response, Response) and response.status_code == 200:
+            response.render()
+            headers = {h: response[h] for h in self.cached_headers if h in response}
+            get_cache().set(
+                key,
+                (response.content, response['Content-Type'], headers),
+                settings.CATALOG_CACHE_TIMEOUT
+            )
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+
+class CurrencyMixin:
+    """
+    Viewset mixin which converts the prices of GET responses (list,
+    retrieve and the actions, export included) to the currency given
+    with `?currency=` (one of settings.CURRENCIES) with the
+    process-local rate table (see products.exchange). Every
+    (amount, currency) pair of currency_fields is converted in one pass
+    over the rendered data, nested representations included, with one
+    rate lookup per currency. Prices in a currency without a rate are
+    left as they are.
+
+    The version of the rates is added to the response cache key and
+    the ETag, so it has to come before CacheResponseMixin and
+    ConditionalGetMixin in the bases of the view.
+    """
+    currency_param = 'currency'
+    currency_fields = (
+        ('price_amount', 'price_currency'),
+        ('min_price_amount', 'min_price_currency'),
+        ('max_price_amount', 'max_price_currency'),
+    )
+    amount_field = serializers.DecimalField(max_digits=19, decimal_places=4)
+    display_currency = None
+
+    def get_currency(self):
+        """
+        Return the requested currency or None
+        """
+        request = self.request
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        currency = request.query_params.get(self.currency_param)
+        if not currency:
+            return None
+        currency = currency.strip().upper()
+        if currency not in settings.CURRENCIES:
+            raise ValidationError({self.currency_param: [
+                _(f"Currency({currency}) is not one of the permitted values: {', '.join(settings.CURRENCIES)}")
+            ]})
+        return currency
+
+    def get_rates(self, currency):
+        table = get_rate_table()
+        if not table.has_currency(currency):
+            raise ValidationError({self.currency_param: [
+                _(f"No exchange rate is available for {currency}.")
+            ]})
+        return table
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Checked before the handler runs, so every action answers 400
+        self.display_currency = self.get_currency()
+        if self.display_currency:
+            self.rate_table = self.get_rates(self.display_currency)
+
+    def get_cache_key(self, request):
+        key = super().get_cache_key(request)
+        if key and self.display_currency:
+            key = f'{key}:{get_rates_version()}'
+        return key
+
+    def get_etag(self, version):
+        if self.display_currency:
+            version = dict(version, exchange_rates=get_rates_version())
+        return super().get_etag(version)
+
+    def convert_prices(self, data):
+        currency = self.display_currency
+        table = self.rate_table
+        rates = {}
+        stack = [data]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, list):
+                stack.extend(item)
+                continue
+            for amount_key, currency_key in self.currency_fields:
+                source = item.get(currency_key)
+                amount = item.get(amount_key)
+                if not source or source == currency or amount is None:
+                    continue
+                if source not in rates:
+                    rates[source] = table.get_rate(source, currency)
+                if rates[source] is not None:
+                    item[amount_key] = self.amount_field.to_representation(Decimal(str(amount)) * rates[source])
+                    item[currency_key] = currency
+            stack.extend(value for value in item.values() if isinstance(value, (list, dict)))
+        return data
+
+    def get_export_chunks(self):
+        chunks = super().get_export_chunks()
+        if not self.display_currency:
+            return chunks
+        return (self.convert_prices(chunk) for chunk in chunks)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Converted before CacheResponseMixin stores the response,
+        # cached and 304 responses are not Responses
+        if self.display_currency and isinstance(response, Response) and response.status_code == 200:
+            self.convert_prices(response.data)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ExportMixin:
+    """
+    Viewset mixin with an `export` action which streams every
+    (filtered) object as NDJSON, or as one JSON array with ?format=json.
+
+    Rows are read in keyset chunks of the primary key, each chunk
+    is one indexed range scan plus the queries of its nested rows,
+    so memory stays flat and the first chunk is sent right away.
+    Chunks are not read in one transaction, rows changed during
+    the export show up with their state at the time of their chunk.
+    The queryset is filtered and planned before the response starts,
+    so invalid parameters are answered with 400 and not mid-stream.
+    """
+    export_chunk_size = 500
+
+    def get_export_chunks(self):
+        """
+        Return an iterator over the chunks of rendered objects
+        """
+        queryset = self.filter_queryset(self.get_queryset()).order_by('pk')
+        plan = self.get_values_plan()
+        if plan is not None:
+            queryset = plan.values(queryset)
+        # Links point to the detail endpoints, not to the export format
+        context = dict(self.get_serializer_context(), format=None)
+        return self.iter_export_chunks(queryset, plan, context)
+
+    def iter_export_chunks(self, queryset, plan, context):
+        last = None
+        while True:
+            chunk = queryset if last is None else queryset.filter(pk__gt=last)
+            chunk = list(chunk[:self.export_chunk_size])
+            if not chunk:
+                return
+            if plan is not None:
+                last = chunk[-1][plan.pk]
+                yield plan.render(chunk, request=self.request)
+            else:
+                last = chunk[-1].pk
+                yield self.get_serializer_class()(chunk, many=True, context=context).data
+            if len(chunk) < self.export_chunk_size:
+                return
+
+    def stream_ndjson(self, chunks):
+        for chunk in chunks:
+            yield ''.join(dumps(item) + '\n' for item in chunk)
+
+    def stream_json(self, chunks):
+        yield '['
+        separator = ''
+        for chunk in chunks:
+            for item in chunk:
+                yield separator + dumps(item)
+                separator = ','
+        yield ']'
+
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, JSONRenderer])
+    def export(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        chunks = self.get_export_chunks()
+        if renderer.format == 'json':
+            content = self.stream_json(chunks)
+        else:
+            content = self.stream_ndjson(chunks)
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        return StreamingHttpResponse(content, content_type=content_type)
+
+
+class SearchMixin:
+    """
+    Viewset mixin with a `search` action which returns the products
+    best matching the words of ?q= (see products.search), each with
+    its `rank` and a `snippet` of the matching text (escaped HTML,
+    matches in <b>).
+    ?limit= and ?offset= page the results.
+
+    Runs the search query plus the queries of a list page of the hits.
+    """
+    search_limit = 20
+    search_max_limit = 100
+
+    @action(detail=False, methods=['get'])
+    def search(self, request, *args, **kwargs):
+        params = request.query_params
+        text = params.get('q', '').strip()
+        if not text:
+            raise ValidationError({'q': [_("This field is required.")]})
+        limit = parse_int('limit', params.get('limit', self.search_limit), 1, self.search_max_limit)
+        offset = parse_int('offset', params.get('offset', 0))
+
+        hits = search_products(text, limit, offset)
+        objects = self.get_queryset().in_bulk([id for id, _rank, _snippet in hits])
+        hits = [hit for hit in hits if hit[0] in objects]
+        serializer = self.get_serializer([objects[id] for id, _rank, _snippet in hits], many=True)
+
+        results = []
+        for item, (_id, rank, snippet) in zip(serializer.data, hits):
+            item = dict(item)
+            item['rank'] = rank
+            item['snippet'] = snippet
+            results.append(item)
+        return Response({'results': results})
+
+
+class BulkWriteMixin:
+    """
+    Viewset mixin with a `bulk` list route which creates (POST),
+    updates (PUT) or partially updates (PATCH) a JSON list of objects
+    in one transaction. The serializer's list_serializer_class has to
+    be a BulkListSerializer, updated objects are matched by their 'id'.
+    """
+    bulk_max_size = 1000
+    # Related objects the serializer's validation reads from the instances
+    bulk_select_related = ()
+
+    def get_bulk_instances(self, data):
+        ids = {
+            int(item['id']) for item in data
+            if isinstance(item, dict) and isinstance(item.get('id'), (int, str))
+            and not isinstance(item['id'], bool) and str(item['id']).isdecimal()
+        }
+        queryset = (self.filter_queryset(self.get_queryset())
+                    .select_related(*self.bulk_select_related)
+                    .filter(pk__in=ids))
+        instances = list(queryset)
+        for obj in instances:
+            self.check_object_permissions(self.request, obj)
+        return instances
+
+    @action(detail=False, methods=['post', 'put', 'patch'])
+    def bulk(self, request, *args, **kwargs):
+        data = request.data
+        if not isinstance(data, list):
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ['Expected a list of items.']})
+        if len(data) > self.bulk_max_size:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                f'Ensure this list has no more than {self.bulk_max_size} items.'
+            ]})
+
+        if request.method == 'POST':
+            serializer = self.get_serializer(data=data, many=True)
+        else:
+            serializer = self.get_serializer(
+                self.get_bulk_instances(data),
+                data=data,
+                many=True,
+                partial=request.method == 'PATCH'
+            )
+        serializer.is_valid(raise_exception=True)
+        instances = serializer.save()
+
+        # Read the written objects back with the eager loaded queryset
+        written = self.get_queryset().in_bulk([obj.pk for obj in instances])
+        serializer = self.get_serializer([written[obj.pk] for obj in instances], many=True)
+        code = status.HTTP_201_CREATED if request.method == 'POST' else status.HTTP_200_OK
+        return Response(serializer.data, status=code)
@@ -0,0 +1,179 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import date, time
+
+from django.db.models import Q
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .filters import get_requested_ordering
+
+
+def get_ordering(view):
+    """
+    Ordering of a view used for stable pages and as keyset,
+    the one requested with ?ordering= (see filters) or the view's default.
+    The last field has to be unique (eg. 'id').
+    """
+    if getattr(view, 'ordering_fields', None):
+        requested = get_requested_ordering(getattr(view, 'request', None), view)
+        if requested:
+            return requested
+    return tuple(getattr(view, 'ordering', None) or ('id',))
+
+
+def keyset_filter(fields, values):
+    """
+    Build a filter which selects the rows after the given position.
+    fields: list of (name, descending)
+
+    (a, b) > (x, y) is built as: a >= x AND (a > x OR b > y)
+    so the leading column can be used as an index range.
+    """
+    (name, descending), value = fields[0], values[0]
+    op = 'lt' if descending else 'gt'
+    if len(fields) == 1:
+        return Q(**{f'{name}__{op}': value})
+    return Q(**{f'{name}__{op}e': value}) & (
+        Q(**{f'{name}__{op}': value}) | keyset_filter(fields[1:], values[1:])
+    )
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination on the view's ordering fields.
+
+    The cursor stores the ordering values of the last (or first)
+    row of the page, so every page is a single indexed range scan
+    without COUNT(*) and OFFSET.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = get_ordering(view)
+        self.fields = [(f.lstrip('-'), f.startswith('-')) for f in self.ordering]
+        self.model = queryset.model
+
+        position, reverse = self.decode_cursor(request)
+
+        fields = self.fields
+        if reverse:
+            fields = [(name, not descending) for name, descending in fields]
+        queryset = queryset.order_by(
+            *[f'-{name}' if descending else name for name, descending in fields]
+        )
+        if position is not None:
+            queryset = queryset.filter(keyset_filter(fields, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.page = results
+        if reverse:
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, obj, reverse):
+        position = []
+        for name, _descending in self.fields:
+            # Rows can be model instances or .values() dicts
+            if isinstance(obj, dict):
+                value = obj[name]
+            else:
+                value = getattr(obj, self.model._meta.get_field(name).attname)
+                # MoneyFields return Money, their column is the amount
+                value = getattr(value, 'amount', value)
+            if isinstance(value, (date, time)):
+                value = value.isoformat()
+            elif value is not None:
+                value = str(value)
+            position.append(value)
+        data = json.dumps({'p': position, 'r': int(reverse)})
+        encoded = urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        """
+        Return (position, reverse) of the cursor,
+        position is None for the first page
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position = [
+                self.model._meta.get_field(name).to_python(value)
+                for (name, _descending), value in zip(self.fields, data['p'])
+            ]
+            if len(position) != len(self.fields):
+                raise ValueError
+            reverse = bool(data.get('r', False))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def get_schema_fields(self, view):
+        return []
+
+
+class CatalogPagination(PageNumberPagination):
+    """
+    Page number pagination which switches to keyset pagination
+    when the client opts in by sending the cursor parameter
+    (`?cursor=` for the first page).
+    Pages are ordered by the view's ordering in both modes.
+    """
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not queryset.ordered:
+            queryset = queryset.order_by(*get_ordering(view))
+
+        self.keyset = None
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,29 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+
+def dumps(data):
+    return json.dumps(
+        data,
+        cls=encoders.JSONEncoder,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(',', ':')
+    )
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline delimited JSON, one object per line
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        items = data if isinstance(data, list) else [data]
+        return ''.join(dumps(item) + '\n' for item in items).encode('utf-8')
@@ -2,12 +2,38 @@ from decimal import Decimal
 from pprint import pprint
 
 from django.conf import settings
+from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 from djmoney.money import Money
 from rest_framework import serializers
 
+from ..autocomplete import bump_autocomplete_index
+from ..bitmaps import update_attribute_index_many
+from ..cache import bump_fragment_versions
 from ..models import *
-from .fields import AttributeHIField, ConnectedAttributeHIField
+from ..prices import refresh_price_ranges
+from ..search import reindex_later, reindex_values_later
+from ..signatures import get_conflicts, get_signature, refresh_signatures
+from .bulk import (BulkListSerializer, PrefetchReferencesMixin,
+                   get_connected_values, write_connected)
+from .fields import (AttributeHIField, CachedHyperlinkedIdentityField,
+                     CachedHyperlinkedRelatedField, ConnectedAttributeHIField,
+                     PrefetchedPrimaryKeyRelatedField)
+from .fragments import FragmentListSerializer
+from .mixins import DynamicFieldsMixin
+
+# Fields of a product when it is expanded into another resource
+PRODUCT_SUMMARY_FIELDS = ['id', 'name', 'slug', 'url', 'active',
+                          'min_price_amount', 'min_price_currency']
+
+
+class CachedURLModelSerializer(serializers.HyperlinkedModelSerializer):
+    """
+    HyperlinkedModelSerializer which builds its hyperlinks
+    with the cached URL builder
+    """
+    serializer_url_field = CachedHyperlinkedIdentityField
+    serializer_related_field = CachedHyperlinkedRelatedField
 
 
 class AttributeValueSerializer(serializers.ModelSerializer):
@@ -19,7 +45,7 @@ class AttributeValueSerializer(serializers.ModelSerializer):
         ordering = ['-id']
 
 
-class AttributeSerializer(serializers.HyperlinkedModelSerializer):
+class AttributeSerializer(CachedURLModelSerializer):
     values = AttributeValueSerializer(
         many=True,
         required=False
@@ -30,6 +56,7 @@ class AttributeSerializer(serializers.HyperlinkedModelSerializer):
         fields = ['id', 'name', 'slug', 'url', 'values']
         read_only_fields = ['slug']
         ordering = ['-id']
+        list_serializer_class = FragmentListSerializer
 
     def create(self, validated_data):
         """
@@ -37,17 +64,21 @@ class AttributeSerializer(serializers.HyperlinkedModelSerializer):
         associated with it
         """
 
-        # Create the Attribute instance
-        attribute = Attribute.objects.create(
-            name=validated_data['name']
-        )
+        with transaction.atomic():
+            # Create the Attribute instance
+            attribute = Attribute.objects.create(
+                name=validated_data['name']
+            )
 
-        # Create each AttributeValue instance
-        for item in validated_data.get('values', []):
-            AttributeValue.objects.create(
-                name=item['name'],
-                value=item['value'],
-                attribute=attribute)
+            # Create the AttributeValue instances with one query
+            AttributeValue.objects.bulk_create([
+                AttributeValue(
+                    name=item['name'],
+                    value=item['value'],
+                    attribute=attribute)
+                for item in validated_data.get('values', [])
+            ])
+            bump_autocomplete_index()
 
         return attribute
 
@@ -58,32 +89,54 @@ class AttributeSerializer(serializers.HyperlinkedModelSerializer):
         unwanted AttributeValue(s).
         """
 
-        # Update the Attribute instance
-        instance.name = validated_data.get('name', instance.name)
-        instance.save()
-
-        # If there is no supplied values then do nothing with it
-        if validated_data.get('values'):
-            # Delete any AttributeValue not included in the request
-            value_ids = [item.get('id') for item in validated_data['values']]
-            for value in instance.values.all():
-                if value.id not in value_ids:
-                    value.delete()
-
-            # Create or update AttributeValue instances that are in the request
-            for item in validated_data['values']:
-                value = AttributeValue(
-                    id=item.get('id'),
-                    name=item['name'],
-                    value=item['value'],
-                    attribute=instance)
-                value.save()
+        with transaction.atomic():
+            # Update the Attribute instance,
+            # its signals invalidate the cached values as well
+            instance.name = validated_data.get('name', instance.name)
+            instance.save()
+
+            # If there is no supplied values then do nothing with it
+            if validated_data.get('values'):
+                self.update_values(instance, validated_data['values'])
 
         return instance
 
+    def update_values(self, instance, values):
+        """
+        Apply the difference of the stored and the requested values
+        with one delete, one update and one insert query.
+        Ids which do not belong to the attribute are created as new values.
+        """
+        existing = {value.id: value for value in instance.values.all()}
+
+        changed = []
+        new = []
+        for item in values:
+            value = existing.pop(item.get('id'), None)
+            if value is None:
+                new.append(AttributeValue(
+                    name=item['name'],
+                    value=item['value'],
+                    attribute=instance))
+            elif (value.name, value.value) != (item['name'], item['value']):
+                value.name = item['name']
+                value.value = item['value']
+                changed.append(value)
+
+        # Delete any AttributeValue not included in the request
+        if existing:
+            AttributeValue.objects.filter(id__in=existing).delete()
+        AttributeValue.objects.bulk_update(changed, ['name', 'value'])
+        AttributeValue.objects.bulk_create(new)
+        # Bulk writes send no signals
+        if changed or new:
+            bump_autocomplete_index()
+        if changed:
+            reindex_values_later([value.id for value in changed])
+
 
 class AttributeProductSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
+    id = PrefetchedPrimaryKeyRelatedField(
         queryset=AttributeProduct.objects.all(),
         required=False
     )
@@ -103,7 +156,7 @@ class AttributeProductSerializer(serializers.ModelSerializer):
 
 
 class AttributeVariantSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
+    id = PrefetchedPrimaryKeyRelatedField(
         queryset=AttributeVariant.objects.all(),
         required=False
     )
@@ -122,7 +175,7 @@ class AttributeVariantSerializer(serializers.ModelSerializer):
         fields = ['id', 'attribute_id', 'title', 'url']
 
 
-class ProductTemplateSerializer(serializers.HyperlinkedModelSerializer):
+class ProductTemplateSerializer(PrefetchReferencesMixin, DynamicFieldsMixin, CachedURLModelSerializer):
     product_attributes = AttributeProductSerializer(
         source='attribute_product',
         many=True,
@@ -139,6 +192,15 @@ class ProductTemplateSerializer(serializers.HyperlinkedModelSerializer):
         fields = ['id', 'name', 'slug', 'url',
                   'product_attributes', 'variant_attributes', 'slug']
         ordering = ['-id']
+        expandable_fields = {
+            'products': ('ProductSerializer', {'many': True, 'fields': PRODUCT_SUMMARY_FIELDS}),
+        }
+
+    # (source of the nested field, model of its associations)
+    attribute_models = [
+        ('attribute_product', AttributeProduct),
+        ('attribute_variant', AttributeVariant),
+    ]
 
     def create(self, validated_data):
         """
@@ -148,27 +210,19 @@ class ProductTemplateSerializer(serializers.HyperlinkedModelSerializer):
         ProductTemplate itself
         """
 
-        # Create the Attribute instance
-        # Creates an instance regardless errors happen later
-        template = ProductTemplate.objects.create(
-            name=validated_data['name']
-        )
-
-        # Create each AttributeProduct instance
-        if validated_data.get('attribute_product'):
-            for item in validated_data['attribute_product']:
-                AttributeProduct.objects.create(
-                    attribute=Attribute(item['attribute']['id']),
-                    product_template=template
-                )
+        with transaction.atomic():
+            # Create the ProductTemplate instance
+            template = ProductTemplate.objects.create(
+                name=validated_data['name']
+            )
 
-        # Create each AttributeProduct instance
-        if validated_data.get('attribute_variant'):
-            for item in validated_data['attribute_variant']:
-                AttributeVariant.objects.create(
-                    attribute=Attribute(item['attribute']['id']),
-                    product_template=template
-                )
+            # Create the AttributeProduct and AttributeVariant instances
+            # with one query each
+            for field_name, attr_model in self.attribute_models:
+                attr_model.objects.bulk_create([
+                    attr_model(attribute_id=attribute_id, product_template=template)
+                    for attribute_id in self.get_attribute_ids(validated_data.get(field_name))
+                ])
 
         return template
 
@@ -181,72 +235,84 @@ class ProductTemplateSerializer(serializers.HyperlinkedModelSerializer):
         unwanted connections.
         """
 
-        # Update the Attribute instance
-        instance.name = validated_data.get('name', instance.name)
-        instance.save()
-
-        # Update AttributeProduct
-        self.update_attributes(instance, validated_data,
-                               field_name="attribute_product",
-                               attr_model=AttributeProduct,
-                               attr_all=instance.attribute_product.all())
+        with transaction.atomic():
+            # Update the ProductTemplate instance
+            instance.name = validated_data.get('name', instance.name)
+            instance.save()
 
-        # Update AttributeVariant
-        self.update_attributes(instance, validated_data,
-                               field_name="attribute_variant",
-                               attr_model=AttributeVariant,
-                               attr_all=instance.attribute_variant.all())
+            # Update AttributeProduct and AttributeVariant
+            for field_name, attr_model in self.attribute_models:
+                self.update_attributes(instance, validated_data,
+                                       field_name=field_name,
+                                       attr_model=attr_model,
+                                       attr_all=getattr(instance, field_name).all())
 
         return instance
 
     def update_attributes(self, instance, validated_data, field_name, attr_model, attr_all):
+        """
+        Apply the difference of the stored and the requested
+        associations with one delete and one insert query.
+        Associations are matched by their attribute,
+        the ones which are kept are not written.
+        """
         if validated_data.get(field_name) is not None:
             # 1. create a list of ids out of passed data
-            ids = [item['attribute']['id'] for item in validated_data[field_name]]
+            ids = self.get_attribute_ids(validated_data[field_name])
 
             # 2. delete any association
             # which is not included in passed data
-            for item in attr_all:
-                if item.attribute_id not in ids:
-                    item.delete()
-
-            # 3. create or update all association
-            for item in validated_data[field_name]:
-                if item.get('id'):
-                    attr = attr_model(
-                        id=item.get('id').id,
-                        product_template=instance,
-                        attribute=Attribute(item['attribute']['id'])
-                    )
-                else:
-                    attr = attr_model(
-                        product_template=instance,
-                        attribute=Attribute(item['attribute']['id'])
-                    )
-                attr.save()
+            existing = {item.attribute_id: item.id for item in attr_all}
+            stale = [pk for attribute_id, pk in existing.items() if attribute_id not in ids]
+            if stale:
+                attr_model.objects.filter(id__in=stale).delete()
+
+            # 3. create the missing associations
+            attr_model.objects.bulk_create([
+                attr_model(attribute_id=attribute_id, product_template=instance)
+                for attribute_id in ids if attribute_id not in existing
+            ])
 
         return instance
 
-    def validate_product_attributes(self, data):
-        self.check_if_valid_attribute(data)
-        return data
+    def get_attribute_ids(self, data):
+        """
+        Return the attribute ids of the passed associations in order,
+        without repeats
+        """
+        return list(dict.fromkeys(item['attribute']['id'] for item in data or []))
 
-    def validate_variant_attributes(self, data):
+    def validate(self, data):
         self.check_if_valid_attribute(data)
         return data
 
     def check_if_valid_attribute(self, data):
-        for item in data:
-            if item.get('attribute'):
-                if not Attribute.objects.filter(
-                    id=item['attribute']['id']
-                ).exists():
-                    raise serializers.ValidationError(
-                        _("No attribute with given ID can be found")
-                    )
+        """
+        Check the attributes of every passed association
+        exist, with one query
+        """
+        requested = {
+            name: set(self.get_attribute_ids(data.get(self.fields[name].source)))
+            for name in ('product_attributes', 'variant_attributes')
+            if name in self.fields
+        }
+        ids = set().union(*requested.values())
+        if not ids:
+            return
+
+        found = set(Attribute.objects.filter(id__in=ids).values_list('id', flat=True))
+        errors = {
+            name: [_("No attribute with given ID can be found")]
+            for name, attribute_ids in requested.items()
+            if attribute_ids - found
+        }
+        if errors:
+            raise serializers.ValidationError(errors)
 
 
 class ConnectedProductAttributeSerializer(serializers.ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+
     url = ConnectedAttributeHIField(
         view_name='attribute-detail',
         read_only=True,
@@ -258,6 +324,8 @@ class ConnectedProductAttributeSerializer(serializers.ModelSerializer):
 
 
 class ConnectedVariantAttributeSerializer(serializers.ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+
     url = ConnectedAttributeHIField(
         view_name='attribute-detail',
         read_only=True,
@@ -268,12 +336,58 @@ class ConnectedVariantAttributeSerializer(serializers.ModelSerializer):
         fields = ['id', 'connection', 'value', 'url']
 
 
-class ProductVariantSerializer(serializers.HyperlinkedModelSerializer):
+class ProductVariantListSerializer(BulkListSerializer):
+    connected_model = ConnectedVariantAttribute
+    connected_field = 'variant'
+    update_fields = ['name', 'active', 'price', 'price_currency']
+
+    def validate(self, attrs):
+        """
+        Check that no two variants of a product have the same
+        attribute values, with one query for the whole list
+        """
+        instances = getattr(self, 'child_instances', None) or [None] * len(attrs)
+        combinations = {}
+        resigned = set()
+        for i, (item, instance) in enumerate(zip(attrs, instances)):
+            if not item.get('attributes'):
+                continue
+            product_id = instance.product_id if instance else item['product']['id'].pk
+            key = (product_id, get_signature(attr['value'].pk for attr in item['attributes']))
+            if key in combinations:
+                raise serializers.ValidationError(_(f"Variant({i}) has the same attribute values as Variant({combinations[key]})."))
+            combinations[key] = i
+            if instance is not None:
+                resigned.add(instance.pk)
+
+        conflicts = get_conflicts(combinations, ignore=resigned)
+        if conflicts:
+            i = min(combinations[key] for key in conflicts)
+            raise serializers.ValidationError(_(f"Variant({i}) has the same attribute values as another variant of the product."))
+        return attrs
+
+    def save_connected(self, instances, validated_data):
+        super().save_connected(instances, validated_data)
+        changed = [obj for obj, item in zip(instances, validated_data) if item.get('attributes')]
+        refresh_signatures([obj.pk for obj in changed], changed)
+
+    def invalidate(self, instances):
+        super().invalidate(instances)
+        bump_fragment_versions(Product, {obj.product_id for obj in instances})
+        refresh_price_ranges({obj.product_id for obj in instances})
+        if self.instance is None:
+            # Variants keep their product on update
+            update_attribute_index_many(('set_variant_product', (obj.pk, obj.product_id)) for obj in instances)
+        reindex_later({obj.product_id for obj in instances})
+        bump_autocomplete_index()
+
+
+class ProductVariantSerializer(PrefetchReferencesMixin, DynamicFieldsMixin, CachedURLModelSerializer):
     id = serializers.IntegerField(
         required=False
     )
 
-    product_id = serializers.PrimaryKeyRelatedField(
+    product_id = PrefetchedPrimaryKeyRelatedField(
         queryset=Product.objects.all(),
         source='product.id',
         write_only=True,
@@ -304,11 +418,14 @@ class ProductVariantSerializer(serializers.HyperlinkedModelSerializer):
                   'product', 'product_id', 'variant_attributes']
         read_only_fields = ['created', 'modified', 'product', 'slug']
         ordering = ['-id']
+        expandable_fields = {
+            'product': ('ProductSerializer', {'fields': PRODUCT_SUMMARY_FIELDS}),
+        }
+        list_serializer_class = ProductVariantListSerializer
 
-    def create(self, validated_data):
+    def build(self, validated_data):
         """
-        Create a product Variant instance and
-        its connectedVarianttAttribute
+        Return a new unsaved product Variant instance
         """
         variant = ProductVariant(
             name=validated_data['name'],
@@ -320,23 +437,30 @@ class ProductVariantSerializer(serializers.HyperlinkedModelSerializer):
                 amount=validated_data['price'].get('amount', Decimal(0.0)),
                 currency=validated_data.get('price_currency', settings.DEFAULT_CURRENCY),
             )
-        variant.save()
-
-        # Create each ConnectedVariantAttribute instance associated with it
-        for item in validated_data.get('attributes', []):
-            ConnectedVariantAttribute.objects.create(
-                variant=variant,
-                connection=item['connection'],
-                value=item['value']
-            )
-
         return variant
 
-    def update(self, instance, validated_data):
+    def create(self, validated_data):
         """
-        Update a product Variant instance and
+        Create a product Variant instance and
         its connectedVarianttAttribute
         """
+        variant = self.build(validated_data)
+
+        with transaction.atomic():
+            variant.save()
+
+            # Create the ConnectedVariantAttribute instances with one query
+            write_connected(ConnectedVariantAttribute, 'variant',
+                            get_connected_values(variant, validated_data.get('attributes', [])))
+            if validated_data.get('attributes'):
+                refresh_signatures([variant.pk], [variant])
+
+        return variant
+
+    def assign(self, instance, validated_data):
+        """
+        Set the fields of a product Variant instance without saving it
+        """
         instance.name = validated_data.get('name', instance.name)
         instance.active = validated_data.get('active', instance.active)
 
@@ -352,28 +476,23 @@ class ProductVariantSerializer(serializers.HyperlinkedModelSerializer):
                     currency=validated_data['price_currency'],
                 )
 
-        instance.save()
+    def update(self, instance, validated_data):
+        """
+        Update a product Variant instance and
+        its connectedVarianttAttribute
+        """
+        self.assign(instance, validated_data)
 
-        if validated_data.get('attributes'):
-            # ConnectedVariantAttribute
-            # 1. create a list of ids out of passed data
-            attributes_ids = [item.get('id') for item in validated_data['attributes']]
+        with transaction.atomic():
+            # Its signals invalidate the cached connected attributes as well
+            instance.save()
 
-            # 2. delete any association
-            # which is not included in passed data
-            for attribute in instance.attributes.all():
-                if attribute.id not in attributes_ids:
-                    attribute.delete()
-
-            # 3. create or update all association
-            for item in validated_data['attributes']:
-                attribute = ConnectedVariantAttribute(
-                    id=item.get('id'),
-                    variant=instance,
-                    connection=item['connection'],
-                    value=item['value']
-                )
-                attribute.save()
+            if validated_data.get('attributes'):
+                # Diff ConnectedVariantAttribute by connection
+                write_connected(ConnectedVariantAttribute, 'variant',
+                                get_connected_values(instance, validated_data['attributes']),
+                                owners=[instance.pk])
+                refresh_signatures([instance.pk], [instance])
 
         return instance
 
@@ -381,17 +500,36 @@ class ProductVariantSerializer(serializers.HyperlinkedModelSerializer):
         if not data.get('product'):
             self.validate_product_id(data=None)
 
+        if not data.get('attributes'):
+            return data
+
         if self.instance:
-            pt_id = self.instance.product.product_template
+            # Variants keep their product on update, it is loaded
+            # with the instance by the bulk views (bulk_select_related)
+            pt_id = self.instance.product.product_template_id
         else:
-            pt_id = data['product']['id'].product_template
-
-        # check correctness of ConnectedVariantAttribute
-        for attr in data.get('attributes', []):
-            if pt_id != attr['connection'].product_template:
+            pt_id = data['product']['id'].product_template_id
+
+        # check correctness of ConnectedVariantAttribute,
+        # the connections and values are loaded in bulk
+        connections = set()
+        for attr in data['attributes']:
+            if attr['connection'].pk in connections:
+                raise serializers.ValidationError(_("Connection is repeated."))
+            connections.add(attr['connection'].pk)
+            if pt_id != attr['connection'].product_template_id:
                 raise serializers.ValidationError(_("ProductTemplate is not same."))
-            if attr['value'].attribute != attr['connection'].attribute:
+            if attr['value'].attribute_id != attr['connection'].attribute_id:
                 raise serializers.ValidationError(_("Attribute is not same."))
+
+        # Items of a list are checked together by the list
+        if not isinstance(getattr(self, 'parent', None), BulkListSerializer):
+            # Variants keep their product on update
+            product_id = self.instance.product_id if self.instance else data['product']['id'].pk
+            signature = get_signature(attr['value'].pk for attr in data['attributes'])
+            ignore = [self.instance.pk] if self.instance else []
+            if get_conflicts([(product_id, signature)], ignore):
+                raise serializers.ValidationError(_("Another variant of the product has the same attribute values."))
         return data
 
     def validate_price_currency(self, data):
@@ -418,11 +556,27 @@ class ProductVariantSerializer(serializers.HyperlinkedModelSerializer):
         return data
 
 
-class ProductSerializer(serializers.HyperlinkedModelSerializer):
+class ProductListSerializer(BulkListSerializer):
+    connected_model = ConnectedProductAttribute
+    connected_field = 'product'
+    update_fields = ['name', 'description', 'active', 'min_price', 'min_price_currency']
+
+    def invalidate(self, instances):
+        if self.instance is not None:
+            # Written ranges of products with active variants are replaced
+            refresh_price_ranges([obj.pk for obj in instances], instances=instances)
+        super().invalidate(instances)
+        for obj in instances:
+            Product.objects.remember(obj)
+        reindex_later([obj.pk for obj in instances])
+        bump_autocomplete_index()
+
+
+class ProductSerializer(PrefetchReferencesMixin, DynamicFieldsMixin, CachedURLModelSerializer):
     name = serializers.CharField(
         required=False
     )
-    product_template_id = serializers.PrimaryKeyRelatedField(
+    product_template_id = PrefetchedPrimaryKeyRelatedField(
         queryset=ProductTemplate.objects.all(),
         source='product_template.id'
     )
@@ -437,6 +591,7 @@ class ProductSerializer(serializers.HyperlinkedModelSerializer):
         required=False
     )
 
+    # Written ranges are kept by products without active variants only
     min_price_currency = serializers.CharField(
         required=False,
         allow_blank=True
@@ -449,26 +604,38 @@ class ProductSerializer(serializers.HyperlinkedModelSerializer):
         default=0,
         allow_null=True,
     )
+    # Maintained from the prices of the active variants
+    max_price_currency = serializers.CharField(
+        read_only=True
+    )
+    max_price_amount = serializers.DecimalField(
+        source='max_price.amount',
+        max_digits=19,
+        decimal_places=4,
+        read_only=True,
+    )
 
     class Meta:
         model = Product
         fields = ['id', 'name', 'slug',
                   'product_template', 'description',
-                  'min_price_amount', 'min_price_currency', 'active',
+                  'min_price_amount', 'min_price_currency',
+                  'max_price_amount', 'max_price_currency', 'active',
                   'created', 'modified', 'url',
                   'product_attributes',
                   'product_variants',
                   'product_template_id']
         read_only_fields = ['created', 'modified', 'product_template', 'slug']
         ordering = ['-id']
+        expandable_fields = {
+            'product_template': ('ProductTemplateSerializer', {}),
+        }
+        list_serializer_class = ProductListSerializer
 
-    def create(self, validated_data):
+    def build(self, validated_data):
         """
-        Create the Product instance and
-        its connectedProductAttribute
+        Return a new unsaved Product instance
         """
-
-        # Create the Attribute instance
         product = Product(
             name=validated_data['name'],
             product_template=validated_data['product_template']['id'],
@@ -480,15 +647,24 @@ class ProductSerializer(serializers.HyperlinkedModelSerializer):
                 amount=validated_data['min_price'].get('amount', Decimal(0.0)),
                 currency=validated_data.get('min_price_currency', settings.DEFAULT_CURRENCY),
             )
-        product.save()
-
-        # Create each ConnectedProductAttribute instance associated with it
-        for item in validated_data.get('attributes', []):
-            ConnectedProductAttribute.objects.create(
-                product=product,
-                connection=item['connection'],
-                value=item['value']
-            )
+        return product
+
+    def create(self, validated_data):
+        """
+        Create the Product instance and
+        its connectedProductAttribute
+        """
+
+        # Create the Product instance
+        product = self.build(validated_data)
+
+        with transaction.atomic():
+            product.save()
+
+            # Create the ConnectedProductAttribute instances with one query
+            write_connected(ConnectedProductAttribute, 'product',
+                            get_connected_values(product, validated_data.get('attributes', [])))
+
         # # Fully working, commented for make structure easier
         # # by allowing variants created only at one location
         # # Create each Variant instance associated with it
@@ -508,15 +684,11 @@ class ProductSerializer(serializers.HyperlinkedModelSerializer):
 
         return product
 
-    def update(self, instance, validated_data):
+    def assign(self, instance, validated_data):
         """
-        Update the Attribute instance and update/create
-        AttributeValue(s) associated with it and delete
-        unwanted AttributeValue(s).
+        Set the fields of the Product instance without saving it.
         Product Template cannot be changed.
         """
-
-        # Update the Product instance
         instance.name = validated_data.get('name', instance.name)
         instance.description = validated_data.get('description', instance.description)
         instance.active = validated_data.get('active', instance.active)
@@ -531,28 +703,31 @@ class ProductSerializer(serializers.HyperlinkedModelSerializer):
                     amount=instance.min_price.amount,
                     currency=validated_data['min_price_currency'],
                 )
-        instance.save()
 
-        if validated_data.get('attributes'):
-            # ConnectedProductAttribute
-            # 1. create a list of ids out of passed data
-            attributes_ids = [item.get('id') for item in validated_data['attributes']]
+    def update(self, instance, validated_data):
+        """
+        Update the Attribute instance and update/create
+        AttributeValue(s) associated with it and delete
+        unwanted AttributeValue(s).
+        Product Template cannot be changed.
+        """
 
-            # 2. delete any association
-            # which is not included in passed data
-            for attribute in instance.attributes.all():
-                if attribute.id not in attributes_ids:
-                    attribute.delete()
-
-            # 3. create or update all association
-            for item in validated_data['attributes']:
-                attribute = ConnectedProductAttribute(
-                    id=item.get('id'),
-                    product=instance,
-                    connection=item['connection'],
-                    value=item['value']
-                )
-                attribute.save()
+        # Update the Product instance
+        self.assign(instance, validated_data)
+
+        with transaction.atomic():
+            # Its signals invalidate the cached connected attributes as well
+            instance.save()
+
+            if validated_data.get('attributes'):
+                # Diff ConnectedProductAttribute by connection
+                write_connected(ConnectedProductAttribute, 'product',
+                                get_connected_values(instance, validated_data['attributes']),
+                                owners=[instance.pk])
+
+            if 'min_price' in validated_data or 'min_price_currency' in validated_data:
+                # The range of a product with active variants is maintained from them
+                refresh_price_ranges([instance.pk], instances=[instance])
 
         # # Fully working, see above at create
         # # ProductVariant
@@ -593,12 +768,23 @@ class ProductSerializer(serializers.HyperlinkedModelSerializer):
         if not data.get('name'):
             self.validate_name(data=None)
 
-        # check correctness of ConnectedProductAttribute
+        if data.get('product_template'):
+            pt_id = data['product_template']['id'].pk
+        else:
+            pt_id = self.instance.product_template_id
+
+        # check correctness of ConnectedProductAttribute,
+        # the connections and values are loaded in bulk
+        connections = set()
         for attr in data.get('attributes', []):
-            if data['product_template']['id'] != attr['connection'].product_template:
+            if attr['connection'].pk in connections:
+                raise serializers.ValidationError(_("Connection is repeated."))
+            connections.add(attr['connection'].pk)
+            if pt_id != attr['connection'].product_template_id:
                 raise serializers.ValidationError(_("ProductTemplate is not same."))
-            if attr['value'].attribute != attr['connection'].attribute:
+            if attr['value'].attribute_id != attr['connection'].attribute_id:
                 raise serializers.ValidationError(_("Attribute is not same."))
+
         return data
 
     def validate_min_price_currency(self, data):
@@ -1,3 +1,1104 @@
-"""
-There is nothing to test in api views yet
-"""
+import json
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from djmoney.contrib.exchange.models import ExchangeBackend, Rate, get_default_backend_name
+from djmoney.money import Money
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from products.bitmaps import get_attribute_index
+from products.cache import get_cache, incr_counter
+from products.exchange import VERSION_KEY as RATES_VERSION_KEY
+from products.models import *
+from products.search import rebuild_search_index
+from products.signatures import get_signature
+from products.api.views import ProductVariantViewSet, ProductViewSet
+
+
+class CatalogDataMixin:
+    """
+    Creates a product template with product and variant
+    attributes and a given number of products with variants
+    """
+
+    def setup_catalog(self, products=10, variants=3):
+        self.pt = ProductTemplate.objects.create(name="Beer")
+        self.attr_brand = Attribute.objects.create(name="Brand")
+        self.attr_size = Attribute.objects.create(name="Bottle Size")
+        self.brand = AttributeValue.objects.create(
+            attribute=self.attr_brand,
+            name="Modelo",
+            value="Modelo"
+        )
+        self.size = AttributeValue.objects.create(
+            attribute=self.attr_size,
+            name="330 ml",
+            value="330 ml"
+        )
+        self.ap = AttributeProduct.objects.create(
+            attribute=self.attr_brand,
+            product_template=self.pt
+        )
+        self.av = AttributeVariant.objects.create(
+            attribute=self.attr_size,
+            product_template=self.pt
+        )
+        self.add_products(products, variants)
+
+    def add_products(self, products, variants=3):
+        for i in range(products):
+            p = Product.objects.create(
+                name=f"Product {i}",
+                product_template=self.pt,
+                min_price=Money(100 + i, 'HUF')
+            )
+            ConnectedProductAttribute.objects.create(
+                product=p,
+                connection=self.ap,
+                value=self.brand
+            )
+            for j in range(variants):
+                v = ProductVariant.objects.create(
+                    name=f"Product {i} - {j}",
+                    product=p,
+                    price=Money(100 + i + j, 'HUF')
+                )
+                ConnectedVariantAttribute.objects.create(
+                    variant=v,
+                    connection=self.av,
+                    value=self.size
+                )
+
+
+class QueryBudgetTest(CatalogDataMixin, APITestCase):
+    """
+    List endpoints run a fixed number of queries
+    regardless of how many rows are on the page
+    """
+
+    def setUp(self):
+        self.setup_catalog(products=2)
+
+    def check_budget(self, url_name, budget):
+        """
+        Budgets are checked with cold caches
+        """
+        url = reverse(url_name)
+        get_cache().clear()
+        with self.assertNumQueries(budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Fill up a full page, the budget must not change
+        self.add_products(10)
+        get_cache().clear()
+        with self.assertNumQueries(budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_product_list_budget(self):
+        self.check_budget('product-list', 6)
+
+    def test_product_variant_list_budget(self):
+        self.check_budget('productvariant-list', 4)
+
+    def test_attribute_list_budget(self):
+        self.check_budget('attribute-list', 3)
+
+    def test_product_template_list_budget(self):
+        self.check_budget('producttemplate-list', 4)
+
+    def test_product_detail_budget(self):
+        p = Product.objects.first()
+        url = reverse('product-detail', kwargs={'pk': p.id})
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['product_variants']), 3)
+
+
+class KeysetPaginationTest(CatalogDataMixin, APITestCase):
+    """
+    Keyset pagination is opt-in with the cursor parameter
+    """
+
+    def setUp(self):
+        self.setup_catalog(products=25, variants=1)
+
+    def walk(self, url_name, expected_ids):
+        url = reverse(url_name) + '?cursor='
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(item['id'] for item in response.data['results'])
+            last = response
+            url = response.data['next']
+        self.assertEqual(ids, list(expected_ids))
+        return last
+
+    def test_product_walk(self):
+        expected = Product.objects.order_by('modified', 'id').values_list('id', flat=True)
+        self.walk('product-list', expected)
+
+    def test_product_variant_walk(self):
+        expected = ProductVariant.objects.order_by('modified', 'id').values_list('id', flat=True)
+        self.walk('productvariant-list', expected)
+
+    def test_attribute_walk(self):
+        expected = Attribute.objects.order_by('id').values_list('id', flat=True)
+        self.walk('attribute-list', expected)
+
+    def test_previous(self):
+        """
+        Going back from the last page returns the previous page
+        """
+        last = self.walk(
+            'product-list',
+            Product.objects.order_by('modified', 'id').values_list('id', flat=True)
+        )
+        response = self.client.get(last.data['previous'])
+        expected = list(
+            Product.objects.order_by('modified', 'id').values_list('id', flat=True)[10:20]
+        )
+        self.assertEqual([item['id'] for item in response.data['results']], expected)
+        self.assertIsNotNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_deep_page_budget(self):
+        """
+        Deep pages run the same queries as the first one, without count
+        """
+        response = self.client.get(reverse('product-list') + '?cursor=')
+        with self.assertNumQueries(5):
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('product-list') + '?cursor=invalid')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_number_default(self):
+        """
+        Without the cursor parameter page number pagination is used
+        """
+        response = self.client.get(reverse('product-list'))
+        self.assertEqual(response.data['count'], 25)
+        expected = list(
+            Product.objects.order_by('modified', 'id').values_list('id', flat=True)[:10]
+        )
+        self.assertEqual([item['id'] for item in response.data['results']], expected)
+
+
+class SparseFieldsetTest(CatalogDataMixin, APITestCase):
+    """
+    ?fields= and ?expand= query parameters
+    """
+
+    def setUp(self):
+        self.setup_catalog(products=3)
+
+    def test_product_fields(self):
+        url = reverse('product-list') + '?fields=id,name,slug,min_price_amount'
+        # version + count + products, nothing nested is queried
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(
+            list(response.data['results'][0].keys()),
+            ['id', 'name', 'slug', 'min_price_amount']
+        )
+
+    def test_product_fields_unknown(self):
+        url = reverse('product-list') + '?fields=id,unknown'
+        response = self.client.get(url)
+        self.assertEqual(list(response.data['results'][0].keys()), ['id'])
+
+    def test_product_fields_nested(self):
+        url = reverse('product-list') + '?fields=id,product_variants'
+        # version + count + products + variants + variant attributes
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        item = response.data['results'][0]
+        self.assertEqual(list(item.keys()), ['id', 'product_variants'])
+        self.assertEqual(len(item['product_variants']), 3)
+
+    def test_product_expand_template(self):
+        url = reverse('product-list') + '?fields=id&expand=product_template'
+        # version + count + products with template
+        # + template attributes (product, variant)
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        template = response.data['results'][0]['product_template']
+        self.assertEqual(template['id'], self.pt.id)
+        self.assertEqual(len(template['product_attributes']), 1)
+        self.assertEqual(len(template['variant_attributes']), 1)
+
+    def test_product_expand_full(self):
+        """
+        Expansion without fields keeps every other field
+        """
+        url = reverse('product-list') + '?expand=product_template'
+        response = self.client.get(url)
+        item = response.data['results'][0]
+        self.assertEqual(item['product_template']['name'], self.pt.name)
+        self.assertIn('product_variants', item)
+
+    def test_variant_expand_product(self):
+        url = reverse('productvariant-list') + '?fields=id,name&expand=product'
+        # version + count + variants with product
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        product = response.data['results'][0]['product']
+        self.assertEqual(
+            sorted(product.keys()),
+            sorted(['id', 'name', 'slug', 'url', 'active',
+                    'min_price_amount', 'min_price_currency'])
+        )
+
+    def test_template_expand_products(self):
+        url = reverse('producttemplate-detail', kwargs={'pk': self.pt.id})
+        response = self.client.get(url + '?fields=id,name&expand=products')
+        self.assertEqual(list(response.data.keys()), ['id', 'name', 'products'])
+        self.assertEqual(len(response.data['products']), 3)
+
+    def test_fields_ignored_on_write(self):
+        """
+        Sparse fieldsets apply to reads only
+        """
+        url = reverse('product-list') + '?fields=id'
+        response = self.client.post(url, {
+            'name': 'New product',
+            'product_template_id': self.pt.id,
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['name'], 'New product')
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ConditionalGetTest(CatalogDataMixin, APITestCase):
+    """
+    ETag and Last-Modified on product and variant resources
+    """
+
+    def setUp(self):
+        self.setup_catalog(products=3)
+        self.product = Product.objects.first()
+        self.variant = self.product.variants.first()
+
+    def check_not_modified(self, url, last_modified=True):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual('Last-Modified' in response, last_modified)
+
+        # Only the version query runs
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        return etag
+
+    def test_product_detail(self):
+        url = reverse('product-detail', kwargs={'pk': self.product.id})
+        etag = self.check_not_modified(url)
+
+        # Changing a variant changes the product's version
+        self.variant.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_product_detail_variant_deleted(self):
+        url = reverse('product-detail', kwargs={'pk': self.product.id})
+        etag = self.check_not_modified(url)
+        self.product.variants.order_by('-modified').last().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_product_detail_connected_attribute(self):
+        """
+        Connected attributes have no timestamp,
+        their changes move the fragment version of the product
+        """
+        url = reverse('product-detail', kwargs={'pk': self.product.id})
+        yesterday = timezone.now() - timedelta(days=1)
+        Product.objects.filter(pk=self.product.pk).update(modified=yesterday)
+        ProductVariant.objects.filter(product=self.product).update(modified=yesterday)
+        get_cache().clear()
+        with mock.patch('products.cache.new_version', return_value=int(yesterday.timestamp() * 1000000)):
+            etag = self.check_not_modified(url)
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(last_modified, http_date(yesterday.timestamp()))
+
+        value = AttributeValue.objects.create(attribute=self.attr_brand, name="Corona", value="Corona")
+        cpa = self.product.attributes.get()
+        cpa.value = value
+        cpa.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['Last-Modified'], last_modified)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Deleting the value deletes the connected attribute
+        etag = response['ETag']
+        value.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['product_attributes'], [])
+
+    def test_product_detail_expanded(self):
+        url = reverse('product-detail', kwargs={'pk': self.product.id}) + '?expand=product_template'
+        etag = self.check_not_modified(url, last_modified=False)
+        self.pt.name = "Renamed"
+        self.pt.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['product_template']['name'], "Renamed")
+
+    def test_product_list(self):
+        url = reverse('product-list')
+        etag = self.check_not_modified(url, last_modified=False)
+        self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_product_list_query_string(self):
+        """
+        Different representations have different ETags
+        """
+        etag = self.check_not_modified(reverse('product-list'), last_modified=False)
+        response = self.client.get(
+            reverse('product-list') + '?fields=id',
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_variant_detail(self):
+        url = reverse('productvariant-detail', kwargs={'pk': self.variant.id})
+        self.check_not_modified(url)
+
+    def test_variant_list(self):
+        self.check_not_modified(reverse('productvariant-list'), last_modified=False)
+
+    def test_list_row_deleted(self):
+        """
+        Deleted rows do not move the greatest timestamp of a list,
+        the list is only validated by its ETag
+        """
+        url = reverse('product-list')
+        self.client.get(url)
+        Product.objects.exclude(pk=self.product.pk).order_by('modified').first().delete()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time()))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_if_modified_since(self):
+        url = reverse('productvariant-detail', kwargs={'pk': self.variant.id})
+        response = self.client.get(url)
+        response = self.client.get(
+            url,
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_not_found(self):
+        url = reverse('product-detail', kwargs={'pk': 1000})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn('ETag', response)
+
+    def test_invalid_pk(self):
+        response = self.client.get(reverse('product-detail', kwargs={'pk': 'abc'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ResponseCacheTest(CatalogDataMixin, APITestCase):
+    """
+    Signal invalidated response cache of catalog endpoints
+    """
+
+    def setUp(self):
+        get_cache().clear()
+        self.setup_catalog(products=2)
+        self.url = reverse('product-list')
+
+    def test_cached(self):
+        response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+        self.assertEqual(cached.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], response['Content-Type'])
+        self.assertEqual(cached['ETag'], response['ETag'])
+        for header in ('Vary', 'Allow'):
+            self.assertEqual(cached[header], response[header])
+
+    def test_cached_not_modified(self):
+        response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_query_string(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url + '?fields=id')
+        self.assertEqual(list(response.json()['results'][0].keys()), ['id'])
+
+    def test_format(self):
+        self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_ACCEPT='text/html')
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+    def assert_invalidated(self, change, url=None):
+        url = url or self.url
+        before = self.client.get(url).content
+        change()
+        response = self.client.get(url)
+        self.assertNotEqual(response.content, before)
+
+    def test_invalidate_product(self):
+        p = Product.objects.first()
+
+        def change():
+            p.name = "Renamed"
+            p.save()
+        self.assert_invalidated(change)
+
+    def test_invalidate_variant_delete(self):
+        self.assert_invalidated(lambda: ProductVariant.objects.first().delete())
+
+    def test_invalidate_connected_attribute(self):
+        value = AttributeValue.objects.create(
+            attribute=self.attr_size,
+            name="500 ml",
+            value="500 ml"
+        )
+
+        def change():
+            cva = ConnectedVariantAttribute.objects.first()
+            cva.value = value
+            cva.save()
+        self.assert_invalidated(change)
+
+    def test_invalidate_attribute(self):
+        url = reverse('attribute-list')
+
+        def change():
+            self.attr_size.name = "Size"
+            self.attr_size.save()
+        self.assert_invalidated(change, url=url)
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as path:
+            caches = {'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': path,
+            }}
+            with override_settings(CACHES=caches):
+                response = self.client.get(self.url)
+                with self.assertNumQueries(0):
+                    cached = self.client.get(self.url)
+                self.assertEqual(cached.content, response.content)
+
+                p = Product.objects.first()
+                p.name = "Renamed"
+                p.save()
+                self.assertNotEqual(self.client.get(self.url).content, response.content)
+
+
+class ExportTest(CatalogDataMixin, APITestCase):
+    """
+    Streaming export of every product
+    """
+
+    def setUp(self):
+        self.setup_catalog(products=5)
+        self.url = reverse('product-export')
+
+    def get_lines(self, response):
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return [json.loads(line) for line in content.splitlines()]
+
+    def get_details(self):
+        return [
+            self.client.get(reverse('product-detail', kwargs={'pk': p.pk})).json()
+            for p in Product.objects.order_by('pk')
+        ]
+
+    def test_ndjson(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(self.get_lines(response), self.get_details())
+
+    def test_json(self):
+        response = self.client.get(self.url + '?format=json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        content = b''.join(response.streaming_content)
+        self.assertEqual(json.loads(content.decode('utf-8')), self.get_details())
+
+    def test_empty(self):
+        Product.objects.all().delete()
+        response = self.client.get(self.url + '?format=json')
+        self.assertEqual(b''.join(response.streaming_content), b'[]')
+
+    def test_serializer_fallback(self):
+        expected = self.get_lines(self.client.get(self.url))
+        with mock.patch.object(ProductViewSet, 'values_representation', False):
+            response = self.client.get(self.url)
+            self.assertEqual(self.get_lines(response), expected)
+
+    def test_chunks(self):
+        """
+        products + product attributes + variants + variant attributes per chunk
+        """
+        with mock.patch.object(ProductViewSet, 'export_chunk_size', 2):
+            response = self.client.get(self.url)
+            with self.assertNumQueries(3 * 4):
+                lines = self.get_lines(response)
+        self.assertEqual(len(lines), 5)
+
+    def test_invalid_filter(self):
+        response = self.client.get(self.url + '?min_price=abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(response.streaming)
+
+    def test_unknown_format(self):
+        response = self.client.get(self.url + '?format=xml')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BulkWriteTest(CatalogDataMixin, APITestCase):
+    """
+    List payloads on the bulk/ routes of products and variants
+    """
+
+    def setUp(self):
+        self.setup_catalog(products=1, variants=0)
+        self.product = Product.objects.get()
+        self.url = reverse('productvariant-bulk')
+        self.other_size = AttributeValue.objects.create(
+            attribute=self.attr_size,
+            name="500 ml",
+            value="500 ml"
+        )
+
+    def sizes(self, count, start=0):
+        """
+        Variants of a product need different attribute values
+        """
+        return [
+            AttributeValue.objects.get_or_create(attribute=self.attr_size, name=f"{i} cl", value=f"{i} cl")[0]
+            for i in range(start, start + count)
+        ]
+
+    def variants(self, count, **kwargs):
+        sizes = self.sizes(count)
+        return [
+            dict({
+                'name': f"Variant {i}",
+                'product_id': self.product.id,
+                'price_amount': 100 + i,
+                'price_currency': 'EUR',
+                'variant_attributes': [{'connection': self.av.id, 'value': sizes[i].id}],
+            }, **kwargs)
+            for i in range(count)
+        ]
+
+    def count_queries(self, method, url, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300, response.data)
+        return len(queries)
+
+    def test_create_variants(self):
+        response = self.client.post(self.url, self.variants(3), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([x['name'] for x in response.data], ["Variant 0", "Variant 1", "Variant 2"])
+        self.assertEqual(self.product.variants.count(), 3)
+        v = ProductVariant.objects.get(name="Variant 2")
+        self.assertEqual(v.price, Money(102, 'EUR'))
+        self.assertEqual(len(v.slug), 10)
+        self.assertEqual(v.attributes.get().value.name, "2 cl")
+
+    def test_create_queries(self):
+        """
+        Validation and writes do not run queries per item
+        """
+        few = self.count_queries('post', self.url, self.variants(2))
+        many = self.count_queries('post', self.url, self.variants(30))
+        self.assertEqual(few, many)
+
+    def test_create_invalid(self):
+        variants = self.variants(3)
+        variants[1]['variant_attributes'][0]['value'] = self.brand.id
+        variants[2]['product_id'] = 1000
+        response = self.client.post(self.url, variants, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('non_field_errors', response.data[1])
+        self.assertIn('product_id', response.data[2])
+        self.assertFalse(ProductVariant.objects.exists())
+
+    def test_not_a_list(self):
+        response = self.client.post(self.url, self.variants(1)[0], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with mock.patch.object(ProductVariantViewSet, 'bulk_max_size', 2):
+            response = self.client.post(self.url, self.variants(3), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update_variants(self):
+        self.client.post(self.url, self.variants(3), format='json')
+        ids = list(ProductVariant.objects.order_by('id').values_list('id', flat=True))
+        response = self.client.patch(self.url, [
+            {'id': ids[0], 'name': "Renamed"},
+            {'id': ids[1], 'variant_attributes': [{'connection': self.av.id, 'value': self.other_size.id}]},
+            {'id': ids[2], 'price_amount': 5},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['name'], "Renamed")
+        self.assertEqual(ProductVariant.objects.get(id=ids[1]).attributes.get().value, self.other_size)
+        self.assertEqual(ProductVariant.objects.get(id=ids[2]).price, Money(5, 'EUR'))
+        self.assertEqual(ConnectedVariantAttribute.objects.count(), 3)
+
+    def test_update_queries(self):
+        self.client.post(self.url, self.variants(32), format='json')
+        ids = list(ProductVariant.objects.order_by('id').values_list('id', flat=True))
+
+        def payload(ids, start):
+            return [
+                {'id': pk, 'name': "Renamed", 'variant_attributes': [
+                    {'connection': self.av.id, 'value': size.id}
+                ]}
+                for pk, size in zip(ids, self.sizes(len(ids), start))
+            ]
+        few = self.count_queries('put', self.url, payload(ids[:2], 100))
+        many = self.count_queries('put', self.url, payload(ids[2:], 200))
+        self.assertEqual(few, many)
+
+    def test_update_invalid(self):
+        self.client.post(self.url, self.variants(1), format='json')
+        pk = ProductVariant.objects.get().pk
+        response = self.client.patch(self.url, [
+            {'id': pk, 'name': "Renamed"},
+            {'id': pk, 'name': "Again"},
+            {'id': 1000, 'name': "Missing"},
+            {'name': "No id"},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        for error in response.data[1:]:
+            self.assertIn('id', error)
+        self.assertEqual(ProductVariant.objects.get().name, "Variant 0")
+
+    def test_repeated_attribute_values(self):
+        """
+        Variants of a product can not have the same attribute values
+        """
+        variants = self.variants(2)
+        variants[1]['variant_attributes'] = variants[0]['variant_attributes']
+        response = self.client.post(self.url, variants, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Variant(1)", str(response.data))
+
+        self.client.post(self.url, self.variants(2), format='json')
+        response = self.client.post(self.url, self.variants(1), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Swapping the values of two variants is allowed
+        ids = list(ProductVariant.objects.order_by('id').values_list('id', flat=True))
+        sizes = self.sizes(2)
+        response = self.client.patch(self.url, [
+            {'id': ids[0], 'variant_attributes': [{'connection': self.av.id, 'value': sizes[1].id}]},
+            {'id': ids[1], 'variant_attributes': [{'connection': self.av.id, 'value': sizes[0].id}]},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(ProductVariant.objects.get(id=ids[0]).attribute_signature, get_signature([sizes[1].id]))
+
+    def test_products(self):
+        url = reverse('product-bulk')
+        response = self.client.post(url, [
+            {
+                'name': f"Bulk {i}",
+                'product_template_id': self.pt.id,
+                'product_attributes': [{'connection': self.ap.id, 'value': self.brand.id}],
+            }
+            for i in range(2)
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        created = Product.objects.filter(name__startswith="Bulk")
+        self.assertEqual(ConnectedProductAttribute.objects.filter(product__in=created).count(), 2)
+
+        response = self.client.patch(url, [
+            {'id': p.id, 'description': "Bulk description"} for p in created
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(created.filter(description="Bulk description").count(), 2)
+
+    def test_invalidates_cache(self):
+        list_url = reverse('product-list')
+        self.client.get(list_url)
+        self.client.post(self.url, self.variants(2), format='json')
+        response = self.client.get(list_url)
+        self.assertEqual(len(response.data['results'][0]['product_variants']), 2)
+
+
+class FilterOrderingTest(CatalogDataMixin, APITestCase):
+    """
+    Lists are filtered by price, active and template
+    and ordered with ?ordering=
+    """
+
+    def setUp(self):
+        self.setup_catalog(products=12, variants=2)
+        Product.objects.filter(name__in=["Product 0", "Product 1"]).update(active=True)
+        other = ProductTemplate.objects.create(name="Wine", slug="wine")
+        self.wine = Product.objects.create(name="Wine", product_template=other, min_price=Money(500, 'HUF'))
+
+    def get_ids(self, url_name, query):
+        response = self.client.get(reverse(url_name) + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return [item['id'] for item in response.data['results']]
+
+    def test_price(self):
+        ids = self.get_ids('product-list', '?min_price=103&max_price=105.5')
+        expected = Product.objects.filter(min_price__gte=103, min_price__lte=105.5).order_by('modified', 'id')
+        self.assertEqual(ids, [p.id for p in expected])
+        self.assertEqual(len(ids), 3)
+
+        ids = self.get_ids('productvariant-list', '?max_price=101')
+        self.assertEqual(len(ids), 3)
+
+    def test_active(self):
+        ids = self.get_ids('product-list', '?active=true')
+        self.assertEqual(
+            sorted(ids),
+            sorted(Product.objects.filter(active=True).values_list('id', flat=True))
+        )
+        self.assertEqual(len(self.get_ids('productvariant-list', '?active=0')), 10)
+
+    def test_template(self):
+        self.assertEqual(self.get_ids('product-list', f'?template={self.wine.product_template_id}'), [self.wine.id])
+        self.assertEqual(self.get_ids('product-list', '?template=wine'), [self.wine.id])
+        self.assertEqual(self.get_ids('productvariant-list', '?template=wine'), [])
+        # Digits int() does not take are a slug
+        self.assertEqual(self.get_ids('product-list', '?template=\u00b2'), [])
+
+    def test_ordering(self):
+        ids = self.get_ids('product-list', '?ordering=-price')
+        expected = Product.objects.order_by('-min_price', '-id').values_list('id', flat=True)[:10]
+        self.assertEqual(ids, list(expected))
+
+        ids = self.get_ids('productvariant-list', '?ordering=name')
+        expected = ProductVariant.objects.order_by('name', 'id').values_list('id', flat=True)[:10]
+        self.assertEqual(ids, list(expected))
+
+    def test_ordering_cursor(self):
+        """
+        Keyset pages follow the requested ordering
+        """
+        url = reverse('product-list') + '?ordering=price&cursor='
+        ids = []
+        while url:
+            response = self.client.get(url)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        expected = Product.objects.order_by('min_price', 'id').values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+    def test_invalid(self):
+        for query in ('?min_price=cheap', '?active=maybe', '?ordering=slug'):
+            response = self.client.get(reverse('product-list') + query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+
+class AttributeFacetTest(CatalogDataMixin, APITestCase):
+    """
+    Lists are filtered by attribute values with ?attr=
+    and count the values of the template's attributes
+    """
+
+    def setUp(self):
+        self.setup_catalog(products=4, variants=2)
+        self.corona = AttributeValue.objects.create(
+            attribute=self.attr_brand,
+            name="Corona",
+            value="Corona"
+        )
+        self.p = Product.objects.get(name="Product 0")
+        ConnectedProductAttribute.objects.filter(product=self.p).update(value=self.corona)
+        # The attribute index is rebuilt at the new version
+        get_cache().clear()
+
+    def get(self, url_name, query):
+        response = self.client.get(reverse(url_name) + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response
+
+    def get_ids(self, url_name, query):
+        return sorted(item['id'] for item in self.get(url_name, query).data['results'])
+
+    def test_filter(self):
+        brand = self.attr_brand.slug
+        self.assertEqual(self.get_ids('product-list', f'?attr={brand}:Corona'), [self.p.id])
+        self.assertEqual(len(self.get_ids('product-list', f'?attr={brand}:Corona&attr={brand}:Modelo')), 4)
+        self.assertEqual(
+            self.get_ids('productvariant-list', f'?attr={brand}:Corona'),
+            sorted(self.p.variants.values_list('id', flat=True))
+        )
+
+        # Variant attributes filter the products as well
+        size = self.attr_size.slug
+        self.assertEqual(self.get_ids('product-list', f'?attr={brand}:Corona&attr={size}:330 ml'), [self.p.id])
+        self.assertEqual(self.get_ids('product-list', f'?attr={size}:500 ml'), [])
+
+    def test_filter_invalid(self):
+        response = self.client.get(reverse('product-list') + '?attr=brand')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_facets(self):
+        response = self.get('product-list', f'?template={self.pt.id}')
+        facets = response.data['facets']
+        self.assertEqual(
+            [(x['value'], x['count']) for x in facets[self.attr_brand.slug]],
+            [("Modelo", 3), ("Corona", 1)]
+        )
+        self.assertEqual([x['count'] for x in facets[self.attr_size.slug]], [4])
+
+        # Counts follow the other filters
+        response = self.get('productvariant-list', f'?template={self.pt.slug}&attr={self.attr_brand.slug}:Corona')
+        facets = response.data['facets']
+        self.assertEqual([x['count'] for x in facets[self.attr_brand.slug]], [0, 2])
+        self.assertEqual([x['count'] for x in facets[self.attr_size.slug]], [2])
+
+    def test_facets_overlap(self):
+        """
+        Products with a value on the product and on a variant
+        are counted once
+        """
+        av = AttributeVariant.objects.create(attribute=self.attr_brand, product_template=self.pt)
+        for variant in ProductVariant.objects.exclude(product=self.p):
+            ConnectedVariantAttribute.objects.create(variant=variant, connection=av, value=self.brand)
+        get_cache().clear()
+
+        for url_name, counts in (('product-list', [3, 1]), ('productvariant-list', [6, 2])):
+            response = self.get(url_name, f'?template={self.pt.id}')
+            facets = response.data['facets']
+            self.assertEqual([x['count'] for x in facets[self.attr_brand.slug]], counts)
+
+        # Counted from the attribute index and with the SQL fallback
+        with mock.patch.object(ProductViewSet, 'attribute_index', False):
+            response = self.get('product-list', f'?template={self.pt.id}')
+        self.assertEqual([x['count'] for x in response.data['facets'][self.attr_brand.slug]], [3, 1])
+
+    def test_facets_queries(self):
+        url = reverse('product-list') + f'?template={self.pt.id}'
+        get_attribute_index()
+        # list budget + template + attribute values + product ids
+        with self.assertNumQueries(9):
+            response = self.client.get(url)
+        self.assertIn('facets', response.data)
+
+        url = reverse('productvariant-list') + f'?template={self.pt.id}'
+        # list budget + template + facet counts
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertIn('facets', response.data)
+
+    def test_facets_fallback(self):
+        """
+        Long lists are counted in the database
+        instead of loading their ids
+        """
+        url = reverse('product-list') + f'?template={self.pt.id}'
+        expected = self.client.get(url).data['facets']
+        get_cache().clear()
+        get_attribute_index()
+        with mock.patch.object(ProductViewSet, 'facet_max_index_ids', 2):
+            # list budget + template + facet counts + product ids over the limit
+            with self.assertNumQueries(9):
+                response = self.client.get(url)
+        self.assertEqual(response.data['facets'], expected)
+
+    def test_filter_fallback(self):
+        """
+        Many matching products are filtered with subqueries
+        """
+        brand = self.attr_brand.slug
+        with mock.patch('products.api.filters.CatalogFilterBackend.max_index_ids', 1):
+            ids = self.get_ids('product-list', f'?attr={brand}:Modelo')
+        self.assertEqual(len(ids), 3)
+        self.assertNotIn(self.p.id, ids)
+
+        self.assertNotIn('facets', self.get('product-list', '').data)
+
+
+class SearchTest(CatalogDataMixin, APITestCase):
+    """
+    Products are searched with search/?q=
+    """
+
+    def setUp(self):
+        self.setup_catalog(products=3, variants=1)
+        Product.objects.filter(name="Product 1").update(description="Pale lager")
+        rebuild_search_index()
+
+    def test_search(self):
+        url = reverse('product-search')
+        response = self.client.get(url, {'q': 'lager'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([item['name'] for item in results], ["Product 1"])
+        self.assertIn("<b>lager</b>", results[0]['snippet'])
+        self.assertGreater(results[0]['rank'], 0)
+
+        response = self.client.get(url, {'q': 'product', 'limit': 2})
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_search_invalid(self):
+        url = reverse('product-search')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'q': 'product', 'limit': 1000})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AutocompleteTest(CatalogDataMixin, APITestCase):
+    """
+    Names are suggested with autocomplete/?q=
+    """
+
+    def setUp(self):
+        self.setup_catalog(products=3, variants=1)
+        get_cache().clear()
+
+    def test_autocomplete(self):
+        url = reverse('autocomplete-list')
+        response = self.client.get(url, {'q': 'mod'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [{'type': 'value', 'id': self.brand.id, 'name': "Modelo"}])
+
+        response = self.client.get(url, {'q': 'product', 'limit': 2, 'type': 'product'})
+        self.assertEqual(len(response.data['results']), 2)
+
+        # The index is built once per process
+        with self.assertNumQueries(0):
+            self.client.get(url, {'q': 'be'})
+
+    def test_autocomplete_invalid(self):
+        url = reverse('autocomplete-list')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'q': 'a', 'type': 'variant'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class VariantResolveTest(CatalogDataMixin, APITestCase):
+    """
+    The variant of a product is found by its attribute values
+    """
+
+    def setUp(self):
+        self.setup_catalog(products=1, variants=1)
+        self.product = Product.objects.get()
+        self.variant = self.product.variants.get()
+
+    def test_resolve(self):
+        url = reverse('product-resolve', kwargs={'pk': self.product.id})
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'value': self.size.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], self.variant.id)
+        self.assertEqual(response.data['price_amount'], "100.0000")
+
+        response = self.client.get(url, {'value': [self.size.id, self.brand.id]})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CurrencyTest(CatalogDataMixin, APITestCase):
+    """
+    Prices are shown in the currency of ?currency=
+    """
+
+    def setUp(self):
+        get_cache().clear()
+        self.setup_catalog(products=2, variants=2)
+        backend = ExchangeBackend.objects.create(name=get_default_backend_name(), base_currency='USD')
+        self.huf = Rate.objects.create(backend=backend, currency='HUF', value=400)
+        Rate.objects.create(backend=backend, currency='EUR', value='0.8')
+        self.url = reverse('product-list')
+
+    def test_convert(self):
+        response = self.client.get(self.url, {'currency': 'eur', 'ordering': 'name'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        product = response.data['results'][0]
+        self.assertEqual(product['min_price_amount'], "0.2000")
+        self.assertEqual(product['min_price_currency'], "EUR")
+        self.assertEqual(product['max_price_amount'], "0.2020")
+        self.assertEqual(sorted(v['price_amount'] for v in product['product_variants']), ["0.2000", "0.2020"])
+
+        variant = ProductVariant.objects.get(name="Product 0 - 1")
+        url = reverse('productvariant-detail', kwargs={'pk': variant.id})
+        response = self.client.get(url, {'currency': 'USD'})
+        self.assertEqual(response.data['price_amount'], "0.2525")
+        self.assertEqual(response.data['price_currency'], "USD")
+
+    @override_settings(CATALOG_CACHE_TIMEOUT=0)
+    def test_queries(self):
+        """
+        The rates are loaded once, pages are converted without queries
+        """
+        self.client.get(self.url, {'currency': 'EUR'})
+        with CaptureQueriesContext(connection) as plain:
+            self.client.get(self.url)
+        with self.assertNumQueries(len(plain)):
+            self.client.get(self.url, {'currency': 'EUR'})
+
+    def test_rates_changed(self):
+        response = self.client.get(self.url, {'currency': 'EUR'})
+        self.huf.value = 200
+        self.huf.save()
+        # As the signal does when the transaction commits
+        incr_counter(RATES_VERSION_KEY)
+
+        changed = self.client.get(self.url, {'currency': 'EUR'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual(changed.json()['results'][0]['min_price_currency'], "EUR")
+        self.assertNotEqual(changed.content, response.content)
+
+    def test_actions(self):
+        product = Product.objects.get(name="Product 0")
+        url = reverse('product-resolve', kwargs={'pk': product.id})
+        response = self.client.get(url, {'value': self.size.id, 'currency': 'EUR'})
+        self.assertEqual((response.data['price_amount'], response.data['price_currency']), ("0.2000", "EUR"))
+
+        response = self.client.get(reverse('product-export'), {'currency': 'EUR'})
+        content = b''.join(response.streaming_content).decode('utf-8')
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual({line['min_price_currency'] for line in lines}, {"EUR"})
+
+        rebuild_search_index()
+        response = self.client.get(reverse('product-search'), {'q': 'product', 'currency': 'EUR'})
+        self.assertEqual({item['min_price_currency'] for item in response.data['results']}, {"EUR"})
+
+        response = self.client.get(reverse('product-export'), {'currency': 'XYZ'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid(self):
+        self.assertEqual(self.client.get(self.url, {'currency': 'XYZ'}).status_code, status.HTTP_400_BAD_REQUEST)
+        # No rate for GBP
+        self.assertEqual(self.client.get(self.url, {'currency': 'GBP'}).status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,60 @@
+from django.urls import reverse
+from rest_framework.request import Request
+from rest_framework.reverse import reverse as drf_reverse
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from products.models import *
+from products.api.fields import build_url
+from products.api.serializers import *
+
+
+class BuildURLTest(APITestCase):
+
+    def setUp(self):
+        factory = APIRequestFactory()
+        self.request = Request(factory.get('/'))
+
+    def test_relative(self):
+        self.assertEqual(
+            build_url('attribute-detail', 12),
+            reverse('attribute-detail', kwargs={'pk': 12})
+        )
+
+    def test_absolute(self):
+        self.assertEqual(
+            build_url('product-detail', 7, request=self.request),
+            drf_reverse('product-detail', kwargs={'pk': 7}, request=self.request)
+        )
+
+    def test_format(self):
+        self.assertEqual(
+            build_url('product-detail', 7, request=self.request, format='json'),
+            drf_reverse('product-detail', kwargs={'pk': 7},
+                        request=self.request, format='json')
+        )
+
+
+class ConnectedAttributeHIFieldTest(APITestCase):
+
+    def setUp(self):
+        pt = ProductTemplate.objects.create(name="Beer")
+        attr = Attribute.objects.create(name="Brand")
+        value = AttributeValue.objects.create(attribute=attr, name="Modelo", value="Modelo")
+        product = Product.objects.create(name="Modelo Especial", product_template=pt)
+        ConnectedProductAttribute.objects.create(
+            product=product,
+            connection=AttributeProduct.objects.create(attribute=attr, product_template=pt),
+            value=value
+        )
+        self.attr = attr
+        self.context = {'request': Request(APIRequestFactory().get('/'))}
+
+    def test_url(self):
+        cpa = ConnectedProductAttribute.objects.select_related('connection').first()
+        with self.assertNumQueries(0):
+            data = ConnectedProductAttributeSerializer(cpa, context=self.context).data
+        self.assertEqual(
+            data['url'],
+            drf_reverse('attribute-detail', kwargs={'pk': self.attr.id},
+                        request=self.context['request'])
+        )
@@ -0,0 +1,120 @@
+from unittest import mock
+
+from django.urls import reverse
+from djmoney.money import Money
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from products.cache import bump_catalog_version, get_cache
+from products.models import *
+from products.api.serializers import *
+
+from .test_api_views import CatalogDataMixin
+
+
+class FragmentCacheTest(CatalogDataMixin, APITestCase):
+    """
+    Per instance fragment cache of product, variant and attribute representations
+    """
+
+    def setUp(self):
+        get_cache().clear()
+        self.setup_catalog(products=3)
+        self.url = reverse('product-list')
+        self.context = {'request': Request(APIRequestFactory().get('/'))}
+
+    def get(self, url=None):
+        # Skip the response cache, keep the fragments
+        bump_catalog_version()
+        return self.client.get(url or self.url)
+
+    def test_list_from_fragments(self):
+        response = self.get()
+        # version + count + products, every fragment is cached
+        with self.assertNumQueries(3):
+            cached = self.get()
+        self.assertEqual(cached.content, response.content)
+
+    def test_only_stale_rendered(self):
+        self.get()
+        p = Product.objects.first()
+        p.name = "Renamed"
+        p.save()
+        # nested rows are loaded only for the stale product
+        with self.assertNumQueries(6):
+            response = self.get()
+        names = [item['name'] for item in response.json()['results']]
+        self.assertIn("Renamed", names)
+
+    def test_variant_change(self):
+        self.get()
+        v = ProductVariant.objects.first()
+        v.price = Money(999, 'HUF')
+        v.save()
+        product = self.get().json()['results']
+        variants = [x for item in product for x in item['product_variants'] if x['id'] == v.id]
+        self.assertEqual(variants[0]['price_amount'], '999.0000')
+
+    def test_connected_attribute_change(self):
+        self.get()
+        value = AttributeValue.objects.create(
+            attribute=self.attr_size,
+            name="500 ml",
+            value="500 ml"
+        )
+        cva = ConnectedVariantAttribute.objects.first()
+        cva.value = value
+        cva.save()
+        results = self.get().json()['results']
+        values = [
+            attr['value']
+            for item in results
+            for variant in item['product_variants']
+            for attr in variant['variant_attributes']
+        ]
+        self.assertIn(value.id, values)
+
+    def test_attribute_value_change(self):
+        url = reverse('attribute-list')
+        self.get(url)
+        self.size.name = "0.33 l"
+        self.size.save()
+        results = self.get(url).json()['results']
+        names = [v['name'] for item in results for v in item['values']]
+        self.assertIn("0.33 l", names)
+
+    def test_sparse_fields(self):
+        """
+        Different shapes do not share fragments
+        """
+        self.get()
+        response = self.get(self.url + '?fields=id,name')
+        self.assertEqual(list(response.json()['results'][0].keys()), ['id', 'name'])
+
+    def test_expanded_fields(self):
+        """
+        Expanded fields do not share fragments with the hyperlinks
+        of the same name and follow the changes of the expanded instance
+        """
+        self.get()
+        url = self.url + '?expand=product_template'
+        template = self.get(url).json()['results'][0]['product_template']
+        self.assertEqual(template['name'], self.pt.name)
+
+        self.pt.name = "Renamed"
+        self.pt.save()
+        template = self.get(url).json()['results'][0]['product_template']
+        self.assertEqual(template['name'], "Renamed")
+
+    def test_serializer(self):
+        products = Product.objects.all()
+        data = JSONRenderer().render(
+            ProductSerializer(products, many=True, context=self.context).data
+        )
+        with mock.patch.object(ProductSerializer, 'to_representation') as to_representation:
+            cached = JSONRenderer().render(
+                ProductSerializer(products, many=True, context=self.context).data
+            )
+        to_representation.assert_not_called()
+        self.assertEqual(cached, data)
@@ -1,8 +1,11 @@
 from pprint import pprint
 from copy import deepcopy
 from decimal import Decimal, Context
+from unittest import mock
 
 from django.conf import settings
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from djmoney.money import Money
 from rest_framework.response import Response
@@ -11,6 +14,7 @@ from rest_framework.request import Request
 from rest_framework.test import APIRequestFactory, APITestCase
 
 from products.models import *
+from webshop_drf.utils import assign_slugs
 from products.api.serializers import *
 
 
@@ -109,6 +113,39 @@ class AttributeSerializerUpdateTest(APITestCase):
         self.data['values'].append({"name": "52", "value": "52"})
         self.check_update_validity(data=self.data, original_id=False)
 
+    def test_attribute_update_values_queries(self):
+        """Test attribute update runs the same queries for any number of values"""
+
+        def update(count):
+            values = [
+                {"id": item['id'], "name": item['name'] + "!", "value": item['value']}
+                for item in AttributeSerializer(self.attr, context=self.serializer_context).data['values']
+            ][1:]
+            values += [{"name": f"{i}", "value": f"{i}"} for i in range(count)]
+            serializer = AttributeSerializer(
+                self.attr,
+                context=self.serializer_context,
+                data={"name": "Shoe Size", "values": values}
+            )
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            with CaptureQueriesContext(connection) as queries:
+                serializer.save()
+            return len(queries)
+
+        few = update(2)
+        many = update(50)
+        self.assertEqual(few, many)
+        self.assertEqual(self.attr.values.count(), 52)
+
+    def test_attribute_update_values_foreign_id(self):
+        """Test ids of other attributes' values are added as new values"""
+
+        foreign = AttributeValue.objects.get(name="v1")
+        self.data['values'].append({"id": foreign.id, "name": "52", "value": "52"})
+        self.check_update_validity(data=self.data, original_id=False)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.name, "v1")
+
     def check_update_validity(self, data, original_id=True):
         """
         Check given data is valid and has right values
@@ -332,6 +369,47 @@ class ProductTemplateSerializerUpdateTest(APITestCase):
         self.data['variant_attributes'].append({"attribute_id": 1})
         self.check_update_variant_validity(data=self.data, original_id=False)
 
+    def test_template_update_attr_invalid(self):
+        """
+        Test ProductTemplate update
+        invalid attribute ids are reported per field
+        """
+
+        self.data['variant_attributes'].append({"attribute_id": 100})
+        serializer = ProductTemplateSerializer(self.pt, data=self.data)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('variant_attributes', serializer.errors)
+        self.assertNotIn('product_attributes', serializer.errors)
+
+    def test_template_update_attr_queries(self):
+        """
+        Test ProductTemplate update runs the same queries
+        for any number of attributes
+        """
+
+        def update(count):
+            attributes = [Attribute(name=f"{i}") for i in range(count)]
+            # bulk_create skips save(), which generates the slugs
+            assign_slugs(attributes, Attribute.slug_size)
+            Attribute.objects.bulk_create(attributes)
+            ids = Attribute.objects.order_by('-id').values_list('id', flat=True)[:count]
+            data = {
+                "name": "Beer",
+                "product_attributes": [{"attribute_id": i} for i in ids],
+                "variant_attributes": [{"attribute_id": i} for i in ids],
+            }
+            serializer = ProductTemplateSerializer(self.pt, data=data)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(serializer.is_valid(), serializer.errors)
+                serializer.save()
+            return len(queries)
+
+        few = update(2)
+        many = update(50)
+        self.assertEqual(few, many)
+        self.assertEqual(self.pt.attribute_product.count(), 50)
+        self.assertEqual(self.pt.attribute_variant.count(), 50)
+
     def check_update_product_validity(self, data, original_id=True):
         """
         Check given data is valid and has right values
@@ -852,6 +930,66 @@ class ProductSerializerCreateTest(APITestCase):
         serializer = ProductSerializer(data=self.data)
         self.assertFalse(serializer.is_valid())
 
+    def test_product_create_attribute_repeated_connection(self):
+        """
+        Test Product create with
+        product attribute given but
+        connection repeated with the same value
+        """
+        self.setup_attributes()
+        self.data.update({
+            "product_attributes": [
+                {
+                    "connection": 1,
+                    "value": 2,
+                },
+                {
+                    "connection": 1,
+                    "value": 2,
+                }]
+        })
+
+        serializer = ProductSerializer(data=self.data)
+        self.assertFalse(serializer.is_valid())
+
+    def test_product_create_attribute_rollback(self):
+        """
+        Test Product create leaves no product behind
+        when its attributes can not be written
+        """
+        self.setup_attributes()
+        self.data.update({
+            "product_attributes": [
+                {
+                    "connection": 1,
+                    "value": 2,
+                }]
+        })
+
+        serializer = ProductSerializer(data=self.data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with mock.patch('products.api.serializers.write_connected', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                serializer.save()
+        self.assertEqual(Product.objects.count(), 0)
+
+    def test_product_create_attribute_validation_queries(self):
+        """
+        Test Product validation loads the connections and values
+        with the same queries for any number of attributes
+        """
+        self.setup_attributes()
+
+        def validate(attributes):
+            serializer = ProductSerializer(data=dict(self.data, product_attributes=attributes))
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(serializer.is_valid(), serializer.errors)
+            return len(queries)
+
+        one = validate([{"connection": 1, "value": 2}])
+        two = validate([{"connection": 1, "value": 2}, {"connection": 2, "value": 3}])
+        self.assertEqual(one, two)
+
 
 class ProductSerializerUpdateTest(APITestCase):
 
@@ -1061,6 +1199,20 @@ class ProductSerializerUpdateTest(APITestCase):
             self.data['min_price_currency']
         )
 
+    def test_product_update_minprice_with_variants(self):
+        """
+        Test Product update,
+        the range of a product with active variants is kept
+        """
+        ProductVariant.objects.create(name="Can", product=self.p, price=Money(3, 'USD'), active=True)
+        self.data['min_price_amount'] = 10.19
+
+        serializer = self.product_update(self.data)
+
+        self.assertEqual(serializer.instance.min_price, Money(3, 'USD'))
+        self.p.refresh_from_db()
+        self.assertEqual(self.p.min_price, Money(3, 'USD'))
+
     def test_product_update_minprice_negative(self):
         """
         Test Product update,
@@ -1247,6 +1399,22 @@ class ProductSerializerUpdateTest(APITestCase):
 
         self.check_attributes_validity(self.data)
 
+    def test_product_update_attr_change_value(self):
+        """
+        Test Product update,
+        product attribute value change keeps the row
+        """
+
+        self.setup_attributes()
+        cpa = ConnectedProductAttribute.objects.filter(product=self.p).order_by('id').first()
+        value = AttributeValue.objects.filter(attribute=cpa.value.attribute).exclude(id=cpa.value_id).get()
+        self.data['product_attributes'][0]['value'] = value.id
+
+        self.product_update(self.data)
+        cpa_new = ConnectedProductAttribute.objects.get(product=self.p, connection=cpa.connection)
+        self.assertEqual(cpa_new.id, cpa.id)
+        self.assertEqual(cpa_new.value, value)
+
     def check_attributes_validity(self, data, original_id=True):
         """
         Check given data is valid and has right values
@@ -1656,6 +1824,22 @@ class ProductVariantSerializerUpdateTest(APITestCase):
 
         self.variant_update(self.data, fail=True)
 
+    def test_variant_foreign_template_attributes(self):
+        """
+        Test variant update,
+        product_id of another template does not
+        allow the connections of that template
+        """
+        wine = ProductTemplate.objects.create(name="Wine")
+        other = Product.objects.create(name="Tokaji", product_template=wine)
+        attr = Attribute.objects.create(name="Vintage")
+        value = AttributeValue.objects.create(attribute=attr, name="2017", value="2017")
+        connection = AttributeVariant.objects.create(attribute=attr, product_template=wine)
+        self.data['product_id'] = other.id
+        self.data['variant_attributes'] = [{'connection': connection.id, 'value': value.id}]
+
+        self.variant_update(self.data, fail=True)
+
     def test_variant_change_price(self):
         """
         Test variant update,
@@ -0,0 +1,135 @@
+from unittest import mock
+
+from django.test import override_settings
+from django.urls import reverse
+from djmoney.money import Money
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from products.models import *
+from products.api.pagination import CatalogPagination
+from products.api.serializers import *
+from products.api.values import compile_plan
+from products.api.views import *
+
+from .test_api_views import CatalogDataMixin
+
+VIEWSETS = {
+    'product': ProductViewSet,
+    'productvariant': ProductVariantViewSet,
+    'producttemplate': ProductTemplateViewSet,
+    'attribute': AttributeViewSet,
+}
+
+
+class ValuesPlanTest(APITestCase):
+
+    def setUp(self):
+        self.context = {'request': Request(APIRequestFactory().get('/'))}
+
+    def test_compile(self):
+        """
+        Every catalog serializer can be served from .values() rows
+        """
+        for serializer_class in (ProductSerializer, ProductVariantSerializer,
+                                 ProductTemplateSerializer, AttributeSerializer):
+            serializer = serializer_class(context=self.context)
+            self.assertIsNotNone(compile_plan(serializer), serializer_class)
+
+    def test_compile_unsupported(self):
+        """
+        Expanded (single nested) serializers fall back to the serializer
+        """
+        serializer = ProductSerializer(context=self.context, expand=['product_template'])
+        self.assertIsNone(compile_plan(serializer))
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ValuesParityTest(CatalogDataMixin, APITestCase):
+    """
+    The values representation is byte-identical to the serializers' one
+    """
+
+    def setUp(self):
+        self.setup_catalog(products=4)
+        # Rows with edge values
+        p = Product.objects.create(
+            name="No variants",
+            description="Ünicode description",
+            product_template=self.pt,
+            min_price=Money('12.3456', 'EUR'),
+            active=True
+        )
+        ProductVariant.objects.create(
+            name="Only variant",
+            product=Product.objects.create(name="Other", product_template=self.pt),
+            price=Money('0.5', 'GBP'),
+            active=True
+        )
+        ProductTemplate.objects.create(name="Empty template")
+        Attribute.objects.create(name="No values")
+
+    def get_both(self, url):
+        """
+        Return the content of the response with and without values representation
+        """
+        name = url.split('/')[3].rstrip('s')
+        viewset = VIEWSETS[name]
+        fast = self.client.get(url)
+        with mock.patch.object(viewset, 'values_representation', False):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, slow.status_code)
+        return fast.content, slow.content
+
+    def check_parity(self, url):
+        fast, slow = self.get_both(url)
+        self.assertEqual(fast, slow)
+
+    def test_list(self):
+        for name in VIEWSETS:
+            with self.subTest(name):
+                self.check_parity(reverse(f'{name}-list'))
+
+    def test_detail(self):
+        objects = {
+            'product': Product.objects.last(),
+            'productvariant': ProductVariant.objects.first(),
+            'producttemplate': self.pt,
+            'attribute': self.attr_size,
+        }
+        for name, obj in objects.items():
+            with self.subTest(name):
+                self.check_parity(reverse(f'{name}-detail', kwargs={'pk': obj.pk}))
+
+    def test_detail_not_found(self):
+        self.check_parity(reverse('product-detail', kwargs={'pk': 1000}))
+
+    @mock.patch.object(CatalogPagination, 'page_size', 2)
+    def test_pages(self):
+        for name in VIEWSETS:
+            with self.subTest(name):
+                self.check_parity(reverse(f'{name}-list') + '?page=2')
+
+    def test_keyset_pages(self):
+        url = reverse('product-list') + '?cursor='
+        while url:
+            fast, slow = self.get_both(url)
+            self.assertEqual(fast, slow)
+            url = self.client.get(url).data['next']
+
+    def test_fields(self):
+        self.check_parity(reverse('product-list') + '?fields=id,name,slug,min_price_amount')
+        self.check_parity(reverse('productvariant-list') + '?fields=id,product,variant_attributes')
+
+    def test_format_suffix(self):
+        self.check_parity(reverse('product-list') + '?format=json')
+        url = reverse('product-detail', kwargs={'pk': Product.objects.first().pk, 'format': 'json'})
+        self.check_parity(url)
+
+    def test_product_list_budget(self):
+        """
+        version + count + products + product attributes
+        + variants + variant attributes
+        """
+        with self.assertNumQueries(6):
+            self.client.get(reverse('product-list'))
@@ -6,6 +6,7 @@ from . import views
 # Create a router and register our viewsets with it.
 router = DefaultRouter()
 router.register(r'attributes', views.AttributeViewSet)
+router.register(r'autocomplete', views.AutocompleteViewSet, basename='autocomplete')
 router.register(r'products', views.ProductViewSet)
 router.register(r'producttemplates', views.ProductTemplateViewSet)
 router.register(r'productvariants', views.ProductVariantViewSet)
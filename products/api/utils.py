@@ -0,0 +1,20 @@
+from django.core.exceptions import FieldDoesNotExist
+
+
+def get_relation_path(model, attrs):
+    """
+    Walk the given attribute names along forward
+    foreign keys of the model and return the
+    longest path which can be select_related
+    """
+    path = []
+    for attr in attrs:
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            break
+        if not (field.is_relation and (field.many_to_one or field.one_to_one)):
+            break
+        path.append(attr)
+        model = field.related_model
+    return '__'.join(path)
@@ -0,0 +1,165 @@
+"""
+Read-only representation built from .values() rows.
+
+A ValuesPlan is compiled from a (model) serializer and produces
+the same representation as serializer.data without creating model
+instances or walking the serializer field machinery per row.
+Serializers with fields the plan does not know about
+can not be compiled, those are served by the serializer itself.
+"""
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from djmoney.models.fields import MoneyField
+from rest_framework import serializers
+from rest_framework.relations import HyperlinkedRelatedField, PrimaryKeyRelatedField
+
+from .fields import CachedURLMixin, build_url
+from .utils import get_relation_path
+
+
+class UnsupportedField(Exception):
+    pass
+
+
+class ValuesPlan:
+    """
+    Columns to load and how to turn them into a representation
+    """
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+        self.model = serializer.Meta.model
+        self.pk = self.model._meta.pk.attname
+        self.columns = [self.pk]
+        if any(f.name == 'modified' for f in self.model._meta.concrete_fields):
+            # Needed by the fragment cache
+            self.columns.append('modified')
+        # (field name, kind, column, field)
+        self.fields = []
+        # field name: (foreign key column of the child, child plan)
+        self.nested = {}
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            self.add_field(name, field)
+
+    def add_column(self, column):
+        if column not in self.columns:
+            self.columns.append(column)
+        return column
+
+    def add_field(self, name, field):
+        if isinstance(field, serializers.ListSerializer):
+            child = field.child
+            if not isinstance(child, serializers.ModelSerializer) or '.' in field.source:
+                raise UnsupportedField(name)
+            relation = self.model._meta.get_field(field.source)
+            if not relation.one_to_many:
+                raise UnsupportedField(name)
+            plan = ValuesPlan(child)
+            fk = plan.add_column(relation.field.attname)
+            self.nested[name] = (fk, plan)
+            self.fields.append((name, 'nested', None, field))
+
+        elif isinstance(field, serializers.BaseSerializer):
+            raise UnsupportedField(name)
+
+        elif isinstance(field, HyperlinkedRelatedField):
+            if not isinstance(field, CachedURLMixin) or field.lookup_field != 'pk':
+                raise UnsupportedField(name)
+            if field.source == '*':
+                column = field.url_pk_column
+            else:
+                column = '__'.join(field.source_attrs)
+            self.fields.append((name, 'url', self.add_column(column), field))
+
+        elif isinstance(field, PrimaryKeyRelatedField):
+            if field.pk_field is not None:
+                raise UnsupportedField(name)
+            column = '__'.join(field.source_attrs)
+            self.fields.append((name, 'raw', self.add_column(column), field))
+
+        elif isinstance(field, serializers.RelatedField) or field.source == '*':
+            raise UnsupportedField(name)
+
+        else:
+            self.fields.append((name, 'value', self.add_column(self.get_column(field)), field))
+
+    def get_column(self, field):
+        attrs = field.source_attrs
+        try:
+            model_field = self.model._meta.get_field(attrs[0])
+        except FieldDoesNotExist:
+            raise UnsupportedField(field.field_name)
+        if not model_field.concrete or model_field.many_to_many:
+            raise UnsupportedField(field.field_name)
+        if model_field.is_relation and len(attrs) == 1:
+            # Would be rendered from the related object
+            raise UnsupportedField(field.field_name)
+        if len(attrs) == 2 and isinstance(model_field, MoneyField) and attrs[1] == 'amount':
+            # MoneyField stores its amount in its own column
+            return attrs[0]
+        if len(attrs) > 1 and get_relation_path(self.model, attrs[:-1]) != '__'.join(attrs[:-1]):
+            raise UnsupportedField(field.field_name)
+        return '__'.join(attrs)
+
+    def values(self, queryset, extra_columns=()):
+        """
+        The queryset returning the rows of this plan
+        """
+        columns = self.columns + [c for c in extra_columns if c not in self.columns]
+        return (queryset
+                .select_related(None)
+                .prefetch_related(None)
+                .values(*columns))
+
+    def render(self, rows, request=None, format=None):
+        """
+        Return the representation of rows as a list,
+        nested rows are loaded with one query per nested field
+        """
+        rows = list(rows)
+        children = {}
+        if rows and self.nested:
+            ids = [row[self.pk] for row in rows]
+            for name, (fk, plan) in self.nested.items():
+                queryset = plan.model._default_manager.filter(**{f'{fk}__in': ids})
+                grouped = {}
+                child_rows = list(plan.values(queryset))
+                for row, data in zip(child_rows, plan.render(child_rows, request, format)):
+                    grouped.setdefault(row[fk], []).append(data)
+                children[name] = grouped
+
+        fields = self.fields
+        result = []
+        for row in rows:
+            ret = OrderedDict()
+            for name, kind, column, field in fields:
+                if kind == 'nested':
+                    ret[name] = children[name].get(row[self.pk], [])
+                    continue
+
+                value = row[column]
+                if value is None:
+                    ret[name] = None
+                elif kind == 'value':
+                    ret[name] = field.to_representation(value)
+                elif kind == 'url':
+                    ret[name] = build_url(field.view_name, value, request=request, format=format)
+                else:
+                    ret[name] = value
+            result.append(ret)
+        return result
+
+
+def compile_plan(serializer):
+    """
+    Return the ValuesPlan of the serializer
+    or None if it has fields the plan does not support
+    """
+    try:
+        return ValuesPlan(serializer)
+    except UnsupportedField:
+        return None
@@ -1,25 +1,186 @@
-from rest_framework import viewsets
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import serializers, viewsets
 from rest_framework import permissions
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
 
+from ..autocomplete import PRODUCT, TEMPLATE, VALUE, get_autocomplete_index
+from ..signatures import resolve_variant
+from .filters import CatalogFilterBackend, parse_int
+from .mixins import (BulkWriteMixin, CacheResponseMixin, ConditionalGetMixin,
+                     CurrencyMixin, EagerLoadingMixin, ExportMixin, FacetMixin,
+                     SearchMixin, ValuesRepresentationMixin)
+from .pagination import CatalogPagination
 from .serializers import *
 from ..models import *
 
 
-class AttributeViewSet(viewsets.ModelViewSet):
+class AttributeViewSet(CacheResponseMixin, ValuesRepresentationMixin,
+                        EagerLoadingMixin, viewsets.ModelViewSet):
+    """
+    Query budget (list): count + attributes + values = 3
+    keyset pages (?cursor=) skip the count query,
+    cached responses run no query
+    """
     queryset = Attribute.objects.all()
     serializer_class = AttributeSerializer
+    pagination_class = CatalogPagination
+    ordering = ('id',)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CurrencyMixin, CacheResponseMixin, ConditionalGetMixin,
+                     ExportMixin, BulkWriteMixin, SearchMixin, FacetMixin,
+                     ValuesRepresentationMixin, EagerLoadingMixin, viewsets.ModelViewSet):
+    """
+    Query budget (list): version + count + products
+    + product attributes + variants + variant attributes = 6
+    keyset pages (?cursor=) skip the count query,
+    conditional requests answered with 304 only run the version query,
+    cached responses run no query
+
+    export/ streams every product with the same 4 queries
+    (products, product attributes, variants, variant attributes) per chunk
+
+    bulk/ creates (POST) or updates (PUT, PATCH) a list of products,
+    references are validated with one query per field
+
+    ?min_price= ?max_price= (on the lowest variant price) ?active=
+    ?template= (id or slug) filter and ?ordering=price|name|modified
+    (- for descending) orders the list, backed by the model's indexes
+
+    ?attr=<attribute slug>:<value> keeps the products with the value
+    on the product or on one of its variants (+ 1 query), with ?template=
+    the response has the facet counts of the template's attribute values
+    (+ template + values + product ids), both from the attribute index
+
+    search/?q= returns the products matching the words of q ranked
+    by the full-text search table, with highlighted snippets
+
+    {id}/resolve/?value=<attribute value id> (repeatable) returns the
+    variant of the product with exactly the given attribute values
+    with one indexed query
+
+    ?currency=HUF|USD|EUR|GBP shows the prices of the list, detail,
+    export/, search/ and resolve/ (variants included) in the currency,
+    from the cached exchange rates
+    """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = CatalogPagination
+    filter_backends = [CatalogFilterBackend]
+    filter_fields = {'price': 'min_price', 'active': 'active', 'template': 'product_template'}
+    ordering = ('modified', 'id')
+    ordering_fields = {'price': 'min_price', 'name': 'name', 'modified': 'modified'}
+    attribute_filter_fields = [
+        ('id', ConnectedProductAttribute, 'product_id'),
+        ('id', ConnectedVariantAttribute, 'variant__product_id'),
+    ]
+    facet_lookups = ('connectedproductattribute__product', 'connectedvariantattribute__variant__product')
+    attribute_index = True
+    conditional_fields = ('modified', 'variants__modified')
+    price_field = serializers.DecimalField(max_digits=19, decimal_places=4)
+
+    @action(detail=True, methods=['get'])
+    def resolve(self, request, pk=None):
+        product_id = parse_int('pk', pk, 1)
+        values = request.query_params.getlist('value')
+        if not values:
+            raise ValidationError({'value': [_("This field is required.")]})
+        value_ids = [parse_int('value', value, 1) for value in values]
+
+        variant = resolve_variant(product_id, value_ids,
+                                  ['id', 'name', 'slug', 'active', 'price', 'price_currency'])
+        if variant is None:
+            raise NotFound(_("No variant of the product has these attribute values."))
+        price = variant.pop('price')
+        variant['price_amount'] = self.price_field.to_representation(getattr(price, 'amount', price))
+        variant['price_currency'] = variant.pop('price_currency')
+        return Response(variant)
 
 
-class ProductVariantViewSet(viewsets.ModelViewSet):
+class ProductVariantViewSet(CurrencyMixin, CacheResponseMixin, ConditionalGetMixin,
+                            BulkWriteMixin, FacetMixin, ValuesRepresentationMixin, EagerLoadingMixin,
+                            viewsets.ModelViewSet):
+    """
+    Query budget (list): version + count + variants + variant attributes = 4
+    keyset pages (?cursor=) skip the count query,
+    conditional requests answered with 304 only run the version query,
+    cached responses run no query
+
+    bulk/ creates (POST) or updates (PUT, PATCH) a list of variants,
+    references are validated with one query per field
+
+    ?min_price= ?max_price= ?active= ?template= (id or slug of the
+    product's template) filter and ?ordering=price|name|modified
+    (- for descending) orders the list, backed by the model's indexes
+
+    ?attr=<attribute slug>:<value> keeps the variants with the value
+    on the variant or on its product, with ?template= the response
+    has the facet counts of the template's attribute values
+    (+ template + 1 grouped query)
+
+    ?currency=HUF|USD|EUR|GBP shows the prices of the list and detail
+    responses (the expanded product included) in the currency, from
+    the cached exchange rates, write responses keep the stored prices
+    """
     queryset = ProductVariant.objects.all()
     serializer_class = ProductVariantSerializer
+    pagination_class = CatalogPagination
+    filter_backends = [CatalogFilterBackend]
+    filter_fields = {'price': 'price', 'active': 'active', 'template': 'product__product_template'}
+    ordering = ('modified', 'id')
+    ordering_fields = {'price': 'price', 'name': 'name', 'modified': 'modified'}
+    attribute_filter_fields = [
+        ('id', ConnectedVariantAttribute, 'variant_id'),
+        ('product_id', ConnectedProductAttribute, 'product_id'),
+    ]
+    facet_lookups = ('connectedvariantattribute__variant', 'connectedproductattribute__product__variants')
+    conditional_fields = ('modified',)
+    bulk_select_related = ('product',)
 
 
-class ProductTemplateViewSet(viewsets.ModelViewSet):
+class ProductTemplateViewSet(CacheResponseMixin, ValuesRepresentationMixin,
+                             EagerLoadingMixin, viewsets.ModelViewSet):
+    """
+    Query budget (list): count + templates
+    + product attributes + variant attributes = 4
+    keyset pages (?cursor=) skip the count query,
+    cached responses run no query
+    """
     queryset = ProductTemplate.objects.all()
     serializer_class = ProductTemplateSerializer
+    pagination_class = CatalogPagination
+    ordering = ('id',)
+
+
+class AutocompleteViewSet(viewsets.ViewSet):
+    """
+    ?q= returns the most popular product, product template and
+    attribute value names with a word starting with q, from the
+    in-memory prefix index of the process (see products.autocomplete).
+    ?limit= and ?type=product|template|value (repeatable) narrow them.
+
+    Query budget: none once the index of the process is built
+    """
+    kinds = (PRODUCT, TEMPLATE, VALUE)
+    default_limit = 10
+    max_limit = 50
+
+    def list(self, request):
+        params = request.query_params
+        text = params.get('q', '')
+        if not text.strip():
+            raise ValidationError({'q': [_("This field is required.")]})
+        limit = parse_int('limit', params.get('limit', self.default_limit), 1, self.max_limit)
+        kinds = params.getlist('type') or None
+        if kinds and not set(kinds) <= set(self.kinds):
+            raise ValidationError({'type': [
+                _(f"Type is not one of the permitted values: {', '.join(self.kinds)}")
+            ]})
+
+        suggestions = get_autocomplete_index().suggest(text, limit, kinds)
+        return Response({'results': [
+            {'type': kind, 'id': id, 'name': name}
+            for kind, id, name in suggestions
+        ]})
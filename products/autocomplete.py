@@ -0,0 +1,191 @@
+"""
+In-memory prefix index of product, product template and
+attribute value names for autocomplete suggestions.
+
+Every word of a name starts one key (the rest of the name, case and
+diacritics folded), the keys are kept in one sorted list, so the names
+with a word starting with a prefix are one bisect and a scan of the
+neighbouring keys. Suggestions are ordered by popularity: the number
+of variants of a product, of products of a template and of products
+and variants carrying an attribute value.
+
+The index holds at most AUTOCOMPLETE_MAX_KEYS keys (setting), the least
+popular names are left out when it is built, names added after that
+are only indexed while there is room. It is built with one query per
+model on first use in each process and kept up to date from the
+model signals (see products.cache.LocalIndex).
+"""
+import heapq
+import re
+import sys
+import unicodedata
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.models import Count
+
+from .cache import LocalIndex
+
+VERSION_KEY = 'catalog:autocomplete:version'
+MAX_KEYS = 100000
+
+PRODUCT = 'product'
+TEMPLATE = 'template'
+VALUE = 'value'
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+
+
+def get_keys(name):
+    """
+    Return the keys of name, one starting at each word
+    """
+    name = normalize(name or '')
+    return [name[match.start():] for match in re.finditer(r'\w+', name)]
+
+
+class AutocompleteIndex:
+    """
+    Sorted keys with the (kind, id) reference of their name
+    in refs, names and popularity by reference.
+    """
+
+    def __init__(self, max_keys=None):
+        self.max_keys = max_keys or getattr(settings, 'AUTOCOMPLETE_MAX_KEYS', MAX_KEYS)
+        self.keys = []
+        self.refs = []
+        self.names = {}
+        self.popularity = {}
+
+    @classmethod
+    def build(cls, max_keys=None):
+        """
+        Load the names and their popularity with one query per model,
+        the most popular names are indexed first
+        """
+        from .models import AttributeValue, Product, ProductTemplate
+
+        index = cls(max_keys)
+        entries = []
+        for id, name, count in Product.objects.order_by().values_list('id', 'name').annotate(n=Count('variants')):
+            entries.append(((PRODUCT, id), name, count))
+        for id, name, count in ProductTemplate.objects.order_by().values_list('id', 'name').annotate(n=Count('products')):
+            entries.append(((TEMPLATE, id), name, count))
+        values = (AttributeValue.objects
+                  .order_by()
+                  .values_list('id', 'name')
+                  .annotate(n=Count('connectedproductattribute', distinct=True)
+                            + Count('connectedvariantattribute', distinct=True)))
+        for id, name, count in values:
+            entries.append(((VALUE, id), name, count))
+
+        entries.sort(key=lambda entry: -entry[2])
+        rows = []
+        for ref, name, count in entries:
+            keys = get_keys(name)
+            if len(rows) + len(keys) > index.max_keys:
+                break
+            index.names[ref] = name
+            index.popularity[ref] = count
+            rows.extend((key, ref) for key in keys)
+        rows.sort()
+        index.keys = [key for key, _ref in rows]
+        index.refs = [ref for _key, ref in rows]
+        return index
+
+    def add(self, kind, id, name, popularity=0):
+        """
+        Index the name of (kind, id), replacing its former name
+        """
+        ref = (kind, id)
+        if ref in self.names:
+            popularity = self.popularity[ref]
+            self.remove(kind, id)
+        keys = get_keys(name)
+        if len(self.keys) + len(keys) > self.max_keys:
+            return
+        self.names[ref] = name
+        self.popularity[ref] = popularity
+        for key in keys:
+            position = bisect_left(self.keys, key)
+            self.keys.insert(position, key)
+            self.refs.insert(position, ref)
+
+    def remove(self, kind, id):
+        ref = (kind, id)
+        name = self.names.pop(ref, None)
+        self.popularity.pop(ref, None)
+        if name is None:
+            return
+        for key in get_keys(name):
+            position = bisect_left(self.keys, key)
+            while position < len(self.keys) and self.keys[position] == key:
+                if self.refs[position] == ref:
+                    del self.keys[position]
+                    del self.refs[position]
+                    break
+                position += 1
+
+    def change_popularity(self, kind, id, change):
+        ref = (kind, id)
+        if ref in self.popularity:
+            self.popularity[ref] = max(self.popularity[ref] + change, 0)
+
+    def suggest(self, prefix, limit=10, kinds=None):
+        """
+        Return the most popular names with a word starting with
+        prefix as [(kind, id, name)]
+        """
+        prefix = normalize(prefix.strip())
+        if not prefix:
+            return []
+        refs = set()
+        position = bisect_left(self.keys, prefix)
+        while position < len(self.keys) and self.keys[position].startswith(prefix):
+            ref = self.refs[position]
+            if kinds is None or ref[0] in kinds:
+                refs.add(ref)
+            position += 1
+        best = heapq.nsmallest(limit, refs, key=lambda ref: (-self.popularity[ref], self.names[ref], ref))
+        return [(kind, id, self.names[(kind, id)]) for kind, id in best]
+
+    def memory_size(self):
+        """
+        Return the approximate size of the index in bytes
+        """
+        size = sys.getsizeof(self.keys) + sys.getsizeof(self.refs)
+        size += sum(sys.getsizeof(key) for key in self.keys)
+        for mapping in (self.names, self.popularity):
+            size += sys.getsizeof(mapping)
+            size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in mapping.items())
+        return size
+
+
+autocomplete_index = LocalIndex(VERSION_KEY, AutocompleteIndex.build)
+
+
+def get_autocomplete_index():
+    return autocomplete_index.get()
+
+
+def rebuild_autocomplete_index():
+    return autocomplete_index.rebuild()
+
+
+def update_autocomplete_index(method, *args):
+    """
+    Call method of the index with args when the current
+    transaction commits, eg. ('add', PRODUCT, id, name)
+    """
+    autocomplete_index.update(method, *args)
+
+
+def bump_autocomplete_index():
+    """
+    Make every process rebuild its index after writes
+    which do not send model signals, when the transaction commits
+    """
+    autocomplete_index.invalidate()
@@ -0,0 +1,316 @@
+"""
+In-process inverted index from AttributeValue ids to product ids.
+
+Every value has a bitset of the products carrying it, either through
+a ConnectedProductAttribute or through a ConnectedVariantAttribute of
+one of their variants, so intersecting attribute filters is a bitwise
+AND and a facet count is a popcount.
+
+Bitsets are split into blocks of 65536 ids (see Bitset) and only the
+blocks with a member are stored, as a Python int of at most 8 KiB.
+A set of a few ids costs about a hundred bytes wherever the ids are,
+a dense set costs its bits plus about a hundred bytes per block, and
+AND/OR only visit the blocks of the smaller/both sets. The variant to
+product map is an array indexed by variant id (8 bytes per id up to
+the highest one), which is compact while ids are not sparse.
+
+The index is built from three queries on first use in each process
+and kept up to date from the model signals and the bulk writes of
+the API, applied when the transaction commits. Imports and other
+writes which do not know their changes make every process rebuild
+it (see products.cache.LocalIndex).
+"""
+import sys
+from array import array
+
+from .cache import LocalIndex
+
+VERSION_KEY = 'catalog:attribute-index:version'
+BLOCK_SHIFT = 16
+BLOCK_MASK = (1 << BLOCK_SHIFT) - 1
+
+
+if hasattr(int, 'bit_count'):
+    def popcount(bits):
+        return bits.bit_count()
+else:
+    def popcount(bits):
+        return bin(bits).count('1')
+
+
+class Bitset:
+    """
+    Set of non-negative ids as {block: bits}, block is id >> 16
+    and bit n of its bits is the id (block << 16) + n.
+    Empty blocks are not stored.
+    """
+    __slots__ = ('blocks',)
+
+    def __init__(self, blocks=None):
+        self.blocks = blocks if blocks is not None else {}
+
+    @classmethod
+    def from_ids(cls, ids):
+        bits = cls()
+        for id in ids:
+            bits.add(id)
+        return bits
+
+    def add(self, id):
+        block = id >> BLOCK_SHIFT
+        self.blocks[block] = self.blocks.get(block, 0) | (1 << (id & BLOCK_MASK))
+
+    def discard(self, id):
+        block = id >> BLOCK_SHIFT
+        bits = self.blocks.get(block, 0) & ~(1 << (id & BLOCK_MASK))
+        if bits:
+            self.blocks[block] = bits
+        else:
+            self.blocks.pop(block, None)
+
+    def __contains__(self, id):
+        return bool((self.blocks.get(id >> BLOCK_SHIFT, 0) >> (id & BLOCK_MASK)) & 1)
+
+    def __bool__(self):
+        return bool(self.blocks)
+
+    def __len__(self):
+        return sum(popcount(bits) for bits in self.blocks.values())
+
+    def __eq__(self, other):
+        return isinstance(other, Bitset) and self.blocks == other.blocks
+
+    def __or__(self, other):
+        blocks = dict(self.blocks)
+        for block, bits in other.blocks.items():
+            blocks[block] = blocks.get(block, 0) | bits
+        return Bitset(blocks)
+
+    def __and__(self, other):
+        small, large = sorted((self.blocks, other.blocks), key=len)
+        blocks = {}
+        for block, bits in small.items():
+            common = bits & large.get(block, 0)
+            if common:
+                blocks[block] = common
+        return Bitset(blocks)
+
+    def intersects(self, other):
+        small, large = sorted((self.blocks, other.blocks), key=len)
+        return any(bits & large.get(block, 0) for block, bits in small.items())
+
+    def ids(self):
+        """
+        Return the ids in ascending order
+        """
+        ids = []
+        for block in sorted(self.blocks):
+            base = block << BLOCK_SHIFT
+            bits = self.blocks[block]
+            while bits:
+                low = bits & -bits
+                ids.append(base + low.bit_length() - 1)
+                bits ^= low
+        return ids
+
+    def memory_size(self):
+        return sys.getsizeof(self.blocks) + sum(
+            sys.getsizeof(block) + sys.getsizeof(bits) for block, bits in self.blocks.items()
+        )
+
+
+def ids_to_bits(ids):
+    return Bitset.from_ids(ids)
+
+
+def bits_to_ids(bits):
+    return bits.ids()
+
+
+def add_id(mapping, key, id):
+    bits = mapping.get(key)
+    if bits is None:
+        bits = mapping[key] = Bitset()
+    bits.add(id)
+
+
+def discard_id(mapping, key, id):
+    bits = mapping.get(key)
+    if bits is not None:
+        bits.discard(id)
+        if not bits:
+            del mapping[key]
+
+
+class AttributeBitmapIndex:
+    """
+    Bitsets of product ids per AttributeValue id.
+
+    product_bits and variant_bits store the direct connections of
+    products and variants, value_bits their union projected to
+    product ids, which the lookups read.
+    """
+
+    def __init__(self):
+        # {value id: Bitset of product ids} of ConnectedProductAttributes
+        self.product_bits = {}
+        # {value id: Bitset of variant ids} of ConnectedVariantAttributes
+        self.variant_bits = {}
+        # {value id: Bitset of product ids} with the value on them or a variant
+        self.value_bits = {}
+        # {product id: Bitset of its variant ids}
+        self.product_variants = {}
+        # product id of each variant id, 0 if unknown
+        self.variant_products = array('Q')
+
+    @classmethod
+    def build(cls):
+        """
+        Load the index with one query per model
+        """
+        from .models import ConnectedProductAttribute, ConnectedVariantAttribute, ProductVariant
+
+        index = cls()
+        for variant_id, product_id in ProductVariant.objects.order_by().values_list('id', 'product_id').iterator():
+            index.set_variant_product(variant_id, product_id)
+        for product_id, value_id in ConnectedProductAttribute.objects.order_by().values_list('product_id', 'value_id').iterator():
+            index.add_product_value(product_id, value_id)
+        for variant_id, value_id in ConnectedVariantAttribute.objects.order_by().values_list('variant_id', 'value_id').iterator():
+            index.add_variant_value(variant_id, value_id)
+        return index
+
+    def get_product(self, variant_id):
+        if variant_id < len(self.variant_products):
+            return self.variant_products[variant_id]
+        return 0
+
+    def refresh(self, value_id, product_id):
+        """
+        Recompute the bit of product_id in the bitset of value_id
+        """
+        has = (product_id in self.product_bits.get(value_id, Bitset())
+               or self.variant_bits.get(value_id, Bitset()).intersects(
+                   self.product_variants.get(product_id, Bitset())))
+        if has:
+            add_id(self.value_bits, value_id, product_id)
+        else:
+            discard_id(self.value_bits, value_id, product_id)
+
+    def add_product_value(self, product_id, value_id):
+        add_id(self.product_bits, value_id, product_id)
+        add_id(self.value_bits, value_id, product_id)
+
+    def remove_product_value(self, product_id, value_id):
+        discard_id(self.product_bits, value_id, product_id)
+        self.refresh(value_id, product_id)
+
+    def add_variant_value(self, variant_id, value_id):
+        add_id(self.variant_bits, value_id, variant_id)
+        product_id = self.get_product(variant_id)
+        if product_id:
+            add_id(self.value_bits, value_id, product_id)
+
+    def remove_variant_value(self, variant_id, value_id):
+        discard_id(self.variant_bits, value_id, variant_id)
+        product_id = self.get_product(variant_id)
+        if product_id:
+            self.refresh(value_id, product_id)
+
+    def set_variant_product(self, variant_id, product_id):
+        """
+        Record the product of a variant, moving its values
+        when it belonged to another product
+        """
+        product_id = product_id or 0
+        old = self.get_product(variant_id)
+        if old == product_id:
+            return
+        if variant_id >= len(self.variant_products):
+            self.variant_products.extend([0] * (variant_id + 1 - len(self.variant_products)))
+        self.variant_products[variant_id] = product_id
+
+        if old:
+            discard_id(self.product_variants, old, variant_id)
+        if product_id:
+            add_id(self.product_variants, product_id, variant_id)
+
+        for value_id, bits in list(self.variant_bits.items()):
+            if variant_id in bits:
+                if old:
+                    self.refresh(value_id, old)
+                if product_id:
+                    self.refresh(value_id, product_id)
+
+    def remove_variant(self, variant_id):
+        self.set_variant_product(variant_id, 0)
+
+    def remove_product(self, product_id):
+        for variant_id in self.product_variants.get(product_id, Bitset()).ids():
+            self.set_variant_product(variant_id, 0)
+        for value_id in [v for v, bits in self.value_bits.items() if product_id in bits]:
+            self.remove_product_value(product_id, value_id)
+
+    def match(self, groups):
+        """
+        Return the Bitset of the products which have a value
+        of each group, groups is a list of value id lists
+        """
+        result = None
+        for value_ids in groups:
+            bits = Bitset()
+            for value_id in value_ids:
+                bits = bits | self.value_bits.get(value_id, Bitset())
+            result = bits if result is None else result & bits
+        return result or Bitset()
+
+    def count(self, value_ids, bits):
+        """
+        Return the number of products of bits with each value
+        as {value id: count}
+        """
+        return {value_id: len(self.value_bits.get(value_id, Bitset()) & bits) for value_id in value_ids}
+
+    def memory_size(self):
+        """
+        Return the approximate size of the index in bytes
+        """
+        size = sys.getsizeof(self.variant_products)
+        for mapping in (self.product_bits, self.variant_bits, self.value_bits, self.product_variants):
+            size += sys.getsizeof(mapping)
+            size += sum(sys.getsizeof(k) + v.memory_size() for k, v in mapping.items())
+        return size
+
+
+attribute_index = LocalIndex(VERSION_KEY, AttributeBitmapIndex.build)
+
+
+def get_attribute_index():
+    return attribute_index.get()
+
+
+def rebuild_attribute_index():
+    return attribute_index.rebuild()
+
+
+def update_attribute_index(method, *args):
+    """
+    Call method of the index with args when the current
+    transaction commits, eg. ('add_product_value', product id, value id)
+    """
+    attribute_index.update(method, *args)
+
+
+def update_attribute_index_many(changes):
+    """
+    Apply the (method, args) of changes to the index
+    with one version when the current transaction commits
+    """
+    attribute_index.update_many(changes)
+
+
+def bump_attribute_index():
+    """
+    Make every process rebuild its index after writes
+    which do not send model signals, when the transaction commits
+    """
+    attribute_index.invalidate()
@@ -0,0 +1,185 @@
+"""
+Catalog version used to invalidate cached catalog data.
+
+Every cached entry is keyed with the current version, so bumping
+the version invalidates all of them at once. This works with every
+cache backend, including the local-memory and file based ones which
+can not delete keys by pattern.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+VERSION_KEY = 'catalog:version'
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def new_version():
+    # Never reuse the version of an evicted counter
+    return int(time.time() * 1000000)
+
+
+def get_counter(key):
+    """
+    Return the version counter at key, started when it is missing
+    """
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        version = new_version()
+        cache.add(key, version, timeout=None)
+        version = cache.get(key, version)
+    return version
+
+
+def incr_counter(key):
+    """
+    Increment the version counter at key and return it,
+    None when it was missing and had to be started again
+    """
+    cache = get_cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, new_version(), timeout=None)
+        return None
+
+
+def get_catalog_version():
+    return get_counter(VERSION_KEY)
+
+
+def _bump():
+    incr_counter(VERSION_KEY)
+
+
+def bump_catalog_version():
+    """
+    Invalidate every cached catalog entry.
+
+    Bumped right away and again when the current transaction commits,
+    so data read by other requests before the commit is not kept.
+    """
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def fragment_version_key(model, pk):
+    return f'catalog:fragment-version:{model._meta.label_lower}:{pk}'
+
+
+def get_fragment_versions(model, pks):
+    """
+    Return the version of each instance as {pk: version}.
+    The version covers changes the instance's own timestamp misses,
+    like changes of its nested rows: it is the time (in microseconds,
+    see new_version) of the last such change, or of the first read.
+    """
+    cache = get_cache()
+    keys = {fragment_version_key(model, pk): pk for pk in pks}
+    found = cache.get_many(keys.keys())
+    missing = {key: new_version() for key in keys if key not in found}
+    if missing:
+        for key, version in missing.items():
+            cache.add(key, version, timeout=None)
+        found.update(cache.get_many(missing.keys()))
+    return {pk: found.get(key) for key, pk in keys.items()}
+
+
+def _bump_fragment_versions(model, pks):
+    version = new_version()
+    get_cache().set_many({fragment_version_key(model, pk): version for pk in pks}, timeout=None)
+
+
+def bump_fragment_versions(model, pks):
+    """
+    Invalidate the cached fragments of the given instances,
+    right away and again when the current transaction commits.
+    """
+    pks = [pk for pk in pks if pk is not None]
+    _bump_fragment_versions(model, pks)
+    transaction.on_commit(lambda: _bump_fragment_versions(model, pks))
+
+
+class LocalIndex:
+    """
+    Index of catalog data built in the memory of each process
+    by build() and shared through get().
+
+    Processes share a version counter at key: a process which applies
+    a change to its index (see update) moves the counter and its index
+    to the next version, if the counter moved further (another process
+    or a write which sends no model signals, see invalidate) the index
+    is rebuilt on its next use.
+    """
+
+    def __init__(self, key, build):
+        self.key = key
+        self.build = build
+        self.index = None
+        self.version = None
+        self.lock = threading.RLock()
+
+    def get(self):
+        """
+        Return the index of this process, rebuilt when it is
+        not at the current version
+        """
+        version = get_counter(self.key)
+        with self.lock:
+            if self.index is None or self.version != version:
+                self.index = self.build()
+                self.version = version
+            return self.index
+
+    def rebuild(self):
+        """
+        Rebuild the index of this process and make the
+        other processes rebuild theirs, return the index
+        """
+        with self.lock:
+            incr_counter(self.key)
+            self.index = self.build()
+            self.version = get_counter(self.key)
+            return self.index
+
+    def apply(self, changes):
+        """
+        Call the (method, args) of changes on the index of this
+        process and move it to the next version
+        """
+        version = incr_counter(self.key)
+        with self.lock:
+            if self.index is not None and version is not None and self.version == version - 1:
+                for method, args in changes:
+                    getattr(self.index, method)(*args)
+                self.version = version
+
+    def update(self, method, *args):
+        """
+        Call method of the index with args when the current
+        transaction commits
+        """
+        self.update_many([(method, args)])
+
+    def update_many(self, changes):
+        """
+        Apply the (method, args) of changes as one version
+        when the current transaction commits
+        """
+        changes = list(changes)
+        if changes:
+            transaction.on_commit(lambda: self.apply(changes))
+
+    def invalidate(self):
+        """
+        Make every process rebuild its index
+        when the current transaction commits
+        """
+        transaction.on_commit(lambda: incr_counter(self.key))
@@ -0,0 +1,74 @@
+"""
+Exchange rates for showing prices in another currency.
+
+The rates of the default backend of djmoney.contrib.exchange are
+loaded with one query into a process-local RateTable on first use
+and reloaded when the shared version counter moves, which the model
+signals of the exchange models do when the rates are updated (eg. by
+the update_rates command, see products.cache.LocalIndex).
+Converting a page of prices reads the counter once and no rates.
+"""
+from decimal import Decimal
+
+from .cache import LocalIndex, get_counter
+
+VERSION_KEY = 'catalog:exchange-rates:version'
+
+
+class RateTable:
+    """
+    Rates of the currencies against the base currency of the backend
+    """
+
+    def __init__(self, base=None, rates=None):
+        self.base = base
+        # {currency: units of the currency for one unit of base}
+        self.rates = rates or {}
+
+    @classmethod
+    def build(cls):
+        from djmoney.contrib.exchange.models import Rate, get_default_backend_name
+
+        table = cls()
+        rows = (Rate.objects
+                .filter(backend_id=get_default_backend_name())
+                .values_list('backend__base_currency', 'currency', 'value'))
+        for base, currency, value in rows:
+            table.base = base
+            table.rates[currency] = value
+        if table.base:
+            table.rates.setdefault(table.base, Decimal(1))
+        return table
+
+    def has_currency(self, currency):
+        return currency in self.rates
+
+    def get_rate(self, source, target):
+        """
+        Return the rate from source to target currency,
+        None when one of them has no rate
+        """
+        if source == target:
+            return Decimal(1)
+        if not self.rates.get(source) or target not in self.rates:
+            return None
+        return self.rates[target] / self.rates[source]
+
+
+exchange_rates = LocalIndex(VERSION_KEY, RateTable.build)
+
+
+def get_rate_table():
+    return exchange_rates.get()
+
+
+def get_rates_version():
+    return get_counter(VERSION_KEY)
+
+
+def bump_exchange_rates():
+    """
+    Make every process reload its rates
+    when the current transaction commits
+    """
+    exchange_rates.invalidate()
@@ -0,0 +1,518 @@
+"""
+Bulk catalog import.
+
+A record is a product with its variants and attribute values:
+
+    {"name": "Pale Ale", "slug": "pale-ale", "template": "beer",
+     "description": "...", "min_price": "100", "min_price_currency": "HUF",
+     "active": true, "attributes": {"Brand": "Shipyard"},
+     "variants": [{"name": "Pale Ale 330 ml", "price": "120",
+                   "attributes": {"Bottle Size": "330 ml"}}]}
+
+NDJSON files hold one record per line, CSV files one variant per row
+(see CSV_COLUMNS) and consecutive rows of the same product make up a record.
+
+Records are parsed and validated without touching the database,
+so that step can run in a pool of worker processes. Valid records
+are written in batches, one transaction each: templates, attributes
+and values are resolved with one query per batch and the rows are
+written with bulk_create / bulk_update. Products and variants with
+a known slug are updated, the others are created. A batch which
+would leave a product with two variants of the same attribute values
+is rolled back and written again without the records of the product.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import groupby
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_slug
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from djmoney.money import Money
+
+from webshop_drf.utils import retry_on_slug_collision
+
+from .autocomplete import bump_autocomplete_index
+from .bitmaps import bump_attribute_index
+from .cache import bump_catalog_version, bump_fragment_versions
+from .models import (Attribute, AttributeProduct, AttributeValue, AttributeVariant,
+                     ConnectedProductAttribute, ConnectedVariantAttribute,
+                     Product, ProductTemplate, ProductVariant)
+from .prices import refresh_price_ranges
+from .search import reindex_later
+from .signatures import get_repeated_combinations, refresh_signatures
+
+PRODUCT_ATTRIBUTE_PREFIX = 'product:'
+VARIANT_ATTRIBUTE_PREFIX = 'variant:'
+PRODUCT_COLUMNS = (
+    'name', 'slug', 'template', 'description',
+    'min_price', 'min_price_currency', 'active',
+)
+VARIANT_COLUMNS = ('variant_name', 'variant_slug', 'price', 'price_currency', 'variant_active')
+# Other columns starting with the prefixes above are attribute values
+CSV_COLUMNS = PRODUCT_COLUMNS + VARIANT_COLUMNS
+SLUG_SIZE = 10
+
+
+class RecordError(Exception):
+    pass
+
+
+class CombinationError(Exception):
+    """
+    Products of the batch have variants with the same attribute values
+    """
+
+    def __init__(self, slugs):
+        super().__init__(slugs)
+        self.slugs = slugs
+
+
+def to_decimal(value, name):
+    if value in (None, ''):
+        return Decimal(0)
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise RecordError(f'{name}: {value!r} is not a number')
+    if not number.is_finite() or number < 0:
+        raise RecordError(f'{name}: {value!r} is not a valid price')
+    return number
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def to_currency(value, name, currencies, default_currency):
+    currency = str(value or default_currency).strip().upper()
+    if currency not in currencies:
+        raise RecordError(f'{name}: {currency} is not one of {list(currencies)}')
+    return currency
+
+
+def to_text(value, name, max_length=255, required=True):
+    text = '' if value is None else str(value).strip()
+    if required and not text:
+        raise RecordError(f'{name} is required')
+    if len(text) > max_length:
+        raise RecordError(f'{name} is longer than {max_length} characters')
+    return text
+
+
+def to_slug(value, name):
+    slug = to_text(value, name, max_length=50, required=False)
+    if slug:
+        try:
+            validate_slug(slug)
+        except ValidationError:
+            raise RecordError(f'{name}: {slug!r} is not a valid slug')
+    return slug
+
+
+def to_attributes(value, name):
+    if not value:
+        return {}
+    if not isinstance(value, dict):
+        raise RecordError(f'{name} has to be an object of attribute: value')
+    return {
+        to_text(k, f'{name} name'): to_text(v, f'{name} {k}', max_length=100)
+        for k, v in value.items()
+    }
+
+
+def clean_record(data, currencies, default_currency):
+    """
+    Return the normalized record or raise RecordError
+    """
+    if not isinstance(data, dict):
+        raise RecordError('a record has to be an object')
+    variants = data.get('variants') or []
+    if not isinstance(variants, list) or not all(isinstance(v, dict) for v in variants):
+        raise RecordError('variants has to be a list of objects')
+    return {
+        'name': to_text(data.get('name'), 'name'),
+        'slug': to_slug(data.get('slug'), 'slug'),
+        'template': to_text(data.get('template'), 'template'),
+        'description': to_text(data.get('description'), 'description',
+                               max_length=65535, required=False) or None,
+        'min_price': to_decimal(data.get('min_price'), 'min_price'),
+        'min_price_currency': to_currency(data.get('min_price_currency'), 'min_price_currency',
+                                          currencies, default_currency),
+        'active': to_bool(data.get('active')),
+        'attributes': to_attributes(data.get('attributes'), 'attributes'),
+        'variants': [
+            {
+                'name': to_text(v.get('name'), 'variant name'),
+                'slug': to_slug(v.get('slug'), 'variant slug'),
+                'price': to_decimal(v.get('price'), 'price'),
+                'price_currency': to_currency(v.get('price_currency'), 'price_currency',
+                                              currencies, default_currency),
+                'active': to_bool(v.get('active')),
+                'attributes': to_attributes(v.get('attributes'), 'variant attributes'),
+            }
+            for v in variants
+        ],
+    }
+
+
+def prepare_record(item, currencies, default_currency):
+    """
+    Parse and validate one (line number, raw record) item.
+    Raw records are NDJSON lines or CSV records.
+    Returns (line number, record, error message),
+    it is run by the worker processes so it must not touch the database.
+    """
+    line, raw = item
+    try:
+        if isinstance(raw, str):
+            try:
+                raw = json.loads(raw)
+            except ValueError as e:
+                raise RecordError(f'invalid JSON: {e}')
+        return line, clean_record(raw, currencies, default_currency), None
+    except RecordError as e:
+        return line, None, str(e)
+
+
+def read_ndjson(stream):
+    """
+    Yield (line number, line) of the non-blank lines
+    """
+    for line, text in enumerate(stream, start=1):
+        if text.strip():
+            yield line, text
+
+
+def read_csv(stream):
+    """
+    Yield (line number, record) of consecutive rows of the same product
+    """
+    reader = csv.DictReader(stream)
+
+    def product_key(row):
+        return (row.get('slug') or '').strip() or (row.get('name') or '').strip()
+
+    rows = ((reader.line_num, row) for row in reader)
+    for _key, group in groupby(rows, key=lambda x: product_key(x[1])):
+        group = list(group)
+        line, first = group[0]
+        record = {k: first.get(k) for k in PRODUCT_COLUMNS}
+        record['attributes'] = {
+            k[len(PRODUCT_ATTRIBUTE_PREFIX):]: v
+            for k, v in first.items() if k and k.startswith(PRODUCT_ATTRIBUTE_PREFIX) and v
+        }
+        record['variants'] = [
+            {
+                'name': row.get('variant_name'),
+                'slug': row.get('variant_slug'),
+                'price': row.get('price'),
+                'price_currency': row.get('price_currency'),
+                'active': row.get('variant_active'),
+                'attributes': {
+                    k[len(VARIANT_ATTRIBUTE_PREFIX):]: v
+                    for k, v in row.items() if k and k.startswith(VARIANT_ATTRIBUTE_PREFIX) and v
+                },
+            }
+            for _line, row in group if (row.get('variant_name') or '').strip()
+        ]
+        yield line, record
+
+
+class CatalogImporter:
+    """
+    Writes batches of cleaned records and counts the results in stats
+    """
+
+    def __init__(self):
+        self.stats = dict.fromkeys((
+            'products_created', 'products_updated',
+            'variants_created', 'variants_updated', 'values_created',
+        ), 0)
+        self.errors = []
+
+    @property
+    def rows(self):
+        """
+        Products and variants written
+        """
+        return sum(v for k, v in self.stats.items() if k.startswith(('products_', 'variants_')))
+
+    def error(self, record, message):
+        self.errors.append((record['line'], message))
+
+    def write(self, records):
+        """
+        Write a batch of records (with their 'line')
+        in one transaction, records which can not be resolved
+        are collected in errors, as well as the records of
+        products which would have repeated combinations
+        """
+        stats, errors = dict(self.stats), list(self.errors)
+        try:
+            self.write_batch(records)
+        except CombinationError as e:
+            # Nothing of the batch is kept, write it again without the products
+            self.stats, self.errors = stats, errors
+            valid = []
+            for record in records:
+                if record['slug'] in e.slugs:
+                    self.error(record, 'variants with the same attribute values')
+                else:
+                    valid.append(record)
+            self.write(valid)
+
+    def write_batch(self, records):
+        values_created = self.stats['values_created']
+        products, variants = {}, {}
+        with transaction.atomic():
+            records = self.resolve_templates(records)
+            records = self.resolve_attributes(records)
+            records = self.unique_slugs(records)
+            if records:
+                products = self.write_products(records)
+                variants = self.write_variants(records, products)
+                self.write_connected(records, products, variants)
+                refresh_signatures(variants.values())
+                repeated = get_repeated_combinations(products.values())
+                if repeated:
+                    raise CombinationError({slug for slug, pk in products.items() if pk in repeated})
+                # bulk writes do not send the signals maintaining the price ranges
+                refresh_price_ranges([products[r['slug']] for r in records if r['variants']])
+
+        # Values are created even when none of the records is written
+        if not records and self.stats['values_created'] == values_created:
+            return
+        bump_catalog_version()
+        bump_fragment_versions(Product, products.values())
+        bump_fragment_versions(ProductVariant, variants.values())
+        bump_attribute_index()
+        reindex_later(products.values())
+        bump_autocomplete_index()
+
+    def resolve_templates(self, records):
+        names = {r['template'] for r in records}
+        templates = {}
+        for template in ProductTemplate.objects.filter(Q(slug__in=names) | Q(name__in=names)):
+            templates.setdefault(template.name, template)
+            templates[template.slug] = template
+
+        resolved = []
+        for record in records:
+            template = templates.get(record['template'])
+            if template is None:
+                self.error(record, f"unknown template {record['template']!r}")
+                continue
+            record['template_id'] = template.pk
+            resolved.append(record)
+        return resolved
+
+    def resolve_attributes(self, records):
+        """
+        Set the connection and value ids of the attributes,
+        values which do not exist yet are created
+        """
+        template_ids = {r['template_id'] for r in records}
+        connections = {}
+        for kind, model in (('product', AttributeProduct), ('variant', AttributeVariant)):
+            queryset = (model.objects
+                        .filter(product_template_id__in=template_ids)
+                        .select_related('attribute'))
+            for connection in queryset:
+                attribute = connection.attribute
+                for key in (attribute.name, attribute.slug):
+                    connections[kind, connection.product_template_id, key] = connection
+
+        def lookup(record, kind, attributes):
+            resolved = []
+            for name, value in attributes.items():
+                connection = connections.get((kind, record['template_id'], name))
+                if connection is None:
+                    raise RecordError(f'{name!r} is not a {kind} attribute of the template')
+                resolved.append((connection, value))
+            return resolved
+
+        valid = []
+        for record in records:
+            try:
+                record['attribute_values'] = lookup(record, 'product', record['attributes'])
+                for variant in record['variants']:
+                    variant['attribute_values'] = lookup(record, 'variant', variant['attributes'])
+            except RecordError as e:
+                self.error(record, str(e))
+                continue
+            valid.append(record)
+
+        pairs = {
+            (connection.attribute_id, value)
+            for record in valid
+            for item in [record] + record['variants']
+            for connection, value in item['attribute_values']
+        }
+        values = self.get_values(pairs)
+        missing = pairs - set(values)
+        if missing:
+            AttributeValue.objects.bulk_create([
+                AttributeValue(attribute_id=attribute_id, name=value, value=value)
+                for attribute_id, value in missing
+            ])
+            self.stats['values_created'] += len(missing)
+            values.update(self.get_values(missing))
+            bump_fragment_versions(Attribute, {attribute_id for attribute_id, _value in missing})
+
+        for record in valid:
+            for item in [record] + record['variants']:
+                item['attribute_values'] = [
+                    (connection.pk, values[connection.attribute_id, value])
+                    for connection, value in item['attribute_values']
+                ]
+        return valid
+
+    def get_values(self, pairs):
+        """
+        Return {(attribute id, name): value id} of the existing values
+        """
+        if not pairs:
+            return {}
+        queryset = AttributeValue.objects.filter(
+            attribute_id__in={a for a, _v in pairs},
+            name__in={v for _a, v in pairs},
+        ).order_by('pk').values_list('attribute_id', 'name', 'pk')
+        values = {}
+        for attribute_id, name, pk in queryset:
+            if (attribute_id, name) in pairs:
+                values.setdefault((attribute_id, name), pk)
+        return values
+
+    def unique_slugs(self, records):
+        """
+        Drop records repeating a product or variant slug of the batch
+        """
+        seen_products, seen_variants, unique = set(), set(), []
+        for record in records:
+            slugs = [v['slug'] for v in record['variants'] if v['slug']]
+            repeated = (
+                record['slug'] in seen_products
+                or len(set(slugs)) < len(slugs)
+                or seen_variants.intersection(slugs)
+            )
+            if repeated:
+                self.error(record, 'slug repeated in the batch')
+                continue
+            if record['slug']:
+                seen_products.add(record['slug'])
+            seen_variants.update(slugs)
+            unique.append(record)
+        return unique
+
+    def save_rows(self, model, items, build, fields, stat):
+        """
+        Update the rows of items with a known slug, create the others.
+        build(item, instance) sets the fields of an instance.
+        Returns {slug: pk} and sets the slug of every item.
+        """
+        now = timezone.now()
+        slugs = [item['slug'] for item in items if item['slug']]
+        existing = {obj.slug: obj for obj in model.objects.filter(slug__in=slugs)}
+
+        new = [item for item in items if item['slug'] not in existing]
+
+        updated = []
+        for item in items:
+            obj = existing.get(item['slug'])
+            if obj is not None:
+                build(item, obj)
+                obj.modified = now
+                updated.append(obj)
+        created = []
+        for item in new:
+            obj = model(slug=item['slug'], created=now, modified=now)
+            build(item, obj)
+            created.append(obj)
+
+        model.objects.bulk_update(updated, fields + ['modified'])
+        # Items without a slug are given a generated one
+        retry_on_slug_collision(created, lambda: model.objects.bulk_create(created), SLUG_SIZE)
+        for item, obj in zip(new, created):
+            item['slug'] = obj.slug
+        self.stats[f'{stat}_updated'] += len(updated)
+        self.stats[f'{stat}_created'] += len(created)
+
+        pks = {obj.slug: obj.pk for obj in updated}
+        pks.update(model.objects
+                   .filter(slug__in=[obj.slug for obj in created])
+                   .values_list('slug', 'pk'))
+        return pks
+
+    def write_products(self, records):
+        def build(record, product):
+            product.name = record['name']
+            product.description = record['description']
+            product.product_template_id = record['template_id']
+            product.min_price = Money(record['min_price'], record['min_price_currency'])
+            product.active = record['active']
+
+        return self.save_rows(
+            Product, records, build,
+            ['name', 'description', 'product_template', 'min_price',
+             'min_price_currency', 'active'],
+            'products'
+        )
+
+    def write_variants(self, records, products):
+        variants = []
+        for record in records:
+            for variant in record['variants']:
+                variant['product_id'] = products[record['slug']]
+                variants.append(variant)
+
+        def build(variant, obj):
+            obj.name = variant['name']
+            obj.product_id = variant['product_id']
+            obj.price = Money(variant['price'], variant['price_currency'])
+            obj.active = variant['active']
+
+        return self.save_rows(
+            ProductVariant, variants, build,
+            ['name', 'product', 'price', 'price_currency', 'active'],
+            'variants'
+        )
+
+    def write_connected(self, records, products, variants):
+        product_values = {
+            (products[r['slug']], connection_id): value_id
+            for r in records
+            for connection_id, value_id in r['attribute_values']
+        }
+        variant_values = {
+            (variants[v['slug']], connection_id): value_id
+            for r in records
+            for v in r['variants']
+            for connection_id, value_id in v['attribute_values']
+        }
+        self.save_connected(ConnectedProductAttribute, 'product_id', product_values)
+        self.save_connected(ConnectedVariantAttribute, 'variant_id', variant_values)
+
+    def save_connected(self, model, owner, values):
+        """
+        values: {(owner id, connection id): value id}
+        """
+        if not values:
+            return
+        existing = model.objects.filter(**{f'{owner}__in': {o for o, _c in values}})
+        changed = []
+        for obj in existing:
+            value_id = values.pop((getattr(obj, owner), obj.connection_id), None)
+            if value_id is not None and value_id != obj.value_id:
+                obj.value_id = value_id
+                changed.append(obj)
+        model.objects.bulk_update(changed, ['value'])
+        model.objects.bulk_create([
+            model(**{owner: owner_id, 'connection_id': connection_id, 'value_id': value_id})
+            for (owner_id, connection_id), value_id in values.items()
+        ])
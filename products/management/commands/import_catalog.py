@@ -0,0 +1,92 @@
+import time
+from contextlib import ExitStack
+from functools import partial
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import CatalogImporter, prepare_record, read_csv, read_ndjson
+
+
+class Command(BaseCommand):
+    help = (
+        'Import products with their variants and attribute values '
+        'from a CSV or NDJSON file, see products.importer for the format.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format', choices=('csv', 'ndjson'),
+            help='File format, guessed from the extension by default.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Products written in one transaction.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=0,
+            help='Worker processes parsing and validating records, 0 parses in this process.'
+        )
+
+    def handle(self, path, format=None, batch_size=1000, workers=0, **options):
+        if batch_size < 1:
+            raise CommandError('--batch-size has to be positive.')
+        self.verbosity = options['verbosity']
+        format = format or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        prepare = partial(
+            prepare_record,
+            currencies=[str(x[0]) for x in settings.CURRENCY_CHOICES],
+            default_currency=settings.DEFAULT_CURRENCY,
+        )
+        importer = CatalogImporter()
+        start = time.monotonic()
+
+        with ExitStack() as stack:
+            try:
+                stream = stack.enter_context(open(path, newline='', encoding='utf-8'))
+            except OSError as e:
+                raise CommandError(e)
+            items = read_csv(stream) if format == 'csv' else read_ndjson(stream)
+            if workers > 0:
+                pool = stack.enter_context(Pool(workers))
+                results = pool.imap(prepare, items, chunksize=100)
+            else:
+                results = map(prepare, items)
+
+            batch = []
+            for line, record, error in results:
+                if error:
+                    importer.errors.append((line, error))
+                    continue
+                record['line'] = line
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    self.write(importer, batch, start)
+                    batch = []
+            if batch:
+                self.write(importer, batch, start)
+
+        for line, message in sorted(importer.errors):
+            self.stderr.write(f'line {line}: {message}')
+
+        stats = importer.stats
+        elapsed = time.monotonic() - start
+        rows = importer.rows
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['products_created'] + stats['products_updated']} products "
+            f"({stats['products_created']} created, {stats['products_updated']} updated), "
+            f"{stats['variants_created'] + stats['variants_updated']} variants "
+            f"({stats['variants_created']} created, {stats['variants_updated']} updated) "
+            f"and {stats['values_created']} new attribute values "
+            f"in {elapsed:.2f}s, {rows / max(elapsed, 1e-6):.0f} rows/s"
+        ))
+        if importer.errors:
+            self.stdout.write(self.style.WARNING(f'{len(importer.errors)} records skipped'))
+
+    def write(self, importer, batch, start):
+        importer.write(batch)
+        if self.verbosity > 1:
+            elapsed = time.monotonic() - start
+            self.stdout.write(f'{importer.rows} rows, {importer.rows / max(elapsed, 1e-6):.0f} rows/s')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from products.bitmaps import rebuild_attribute_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the attribute value bitmap index, running processes '
+        'rebuild theirs on next use, see products.bitmaps.'
+    )
+
+    def handle(self, **options):
+        index = rebuild_attribute_index()
+        size = index.memory_size()
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {len(index.value_bits)} attribute values of '
+            f'{len(index.product_variants)} products in {size / 1024:.1f} KiB'
+        ))
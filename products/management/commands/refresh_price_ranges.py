@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.cache import bump_catalog_version
+from products.prices import refresh_price_ranges
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the price range (min_price, max_price) of every product '
+        'from the prices of its active variants, see products.prices.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Products loaded and written at once.'
+        )
+
+    def handle(self, batch_size=1000, **options):
+        if batch_size < 1:
+            raise CommandError('--batch-size has to be positive.')
+        changed = refresh_price_ranges(batch_size=batch_size)
+        if changed:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f'Updated the price range of {changed} products'))
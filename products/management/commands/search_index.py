@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.search import is_enabled, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search table of the products, see products.search.'
+
+    def handle(self, **options):
+        if not is_enabled():
+            self.stdout.write(self.style.WARNING('The database has no full-text search table'))
+            return
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products'))
@@ -1,10 +1,99 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from django.db import models
 
+__all__ = ['ProductManager']
+
+# {(model label, field, value): instance} of the current block or None
+_identity_map = ContextVar('identity_map', default=None)
+
+
+@contextmanager
+def identity_map():
+    """
+    Share the instances loaded by the lookup methods of ProductManager
+    within the block (eg. a request, see IdentityMapMiddleware),
+    so repeated lookups do not query the database again
+    """
+    token = _identity_map.set({})
+    try:
+        yield
+    finally:
+        _identity_map.reset(token)
+
 
 class ProductManager(models.Manager):
+    # Fields besides the pk the instances can be looked up by
+    lookup_fields = ('slug',)
+
+    def get_map_key(self, field, value):
+        return (self.model._meta.label_lower, field, value)
+
+    def remember(self, instance):
+        """
+        Store the (saved) instance in the identity map if there is one,
+        replacing the former instance with the same pk
+        """
+        cache = _identity_map.get()
+        if cache is None:
+            return
+        self.forget(instance)
+        cache[self.get_map_key('pk', instance.pk)] = instance
+        for field in self.lookup_fields:
+            cache[self.get_map_key(field, getattr(instance, field))] = instance
+
+    def forget(self, instance):
+        """
+        Remove the instance with the pk of instance from the identity map
+        """
+        cache = _identity_map.get()
+        if cache is None:
+            return
+        label = self.model._meta.label_lower
+        for key in [k for k, obj in cache.items() if k[0] == label and obj.pk == instance.pk]:
+            del cache[key]
 
     def get_by_id(self, id):
-        qs = self.get_queryset().filter(id=id)
-        if qs.count() == 1:
-            return qs.first()
-        return None
+        """
+        Return the instance with the given id or None
+        """
+        return self.get_many([id]).get(self.model._meta.pk.to_python(id))
+
+    def get_many(self, ids):
+        """
+        Return the existing instances of ids as {id: instance}
+        with one IN query, instances in the identity map are not queried
+        """
+        to_python = self.model._meta.pk.to_python
+        ids = {to_python(id) for id in ids}
+
+        found = {}
+        cache = _identity_map.get()
+        if cache is not None:
+            for id in ids:
+                obj = cache.get(self.get_map_key('pk', id))
+                if obj is not None:
+                    found[id] = obj
+
+        missing = ids - found.keys()
+        if missing:
+            for obj in self.get_queryset().filter(pk__in=missing):
+                self.remember(obj)
+                found[obj.pk] = obj
+        return found
+
+    def get_by_slug(self, slug):
+        """
+        Return the instance with the given slug or None
+        """
+        cache = _identity_map.get()
+        if cache is not None:
+            obj = cache.get(self.get_map_key('slug', slug))
+            if obj is not None:
+                return obj
+
+        obj = self.get_queryset().filter(slug=slug).first()
+        if obj is not None:
+            self.remember(obj)
+        return obj
@@ -0,0 +1,15 @@
+from .managers import identity_map
+
+
+class IdentityMapMiddleware:
+    """
+    Share the instances looked up by the managers
+    within a request, see managers.identity_map
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with identity_map():
+            return self.get_response(request)
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.8 on 2026-10-16 20:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_auto_20200922_1557'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['modified', 'id'], name='products_pr_modifie_a9ffca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['modified', 'id'], name='products_pr_modifie_611bc0_idx'),
+        ),
+    ]
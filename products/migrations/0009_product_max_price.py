@@ -0,0 +1,26 @@
+# Generated by Django 3.0.8 on 2026-10-16 21:30
+
+from decimal import Decimal
+from django.db import migrations
+import djmoney.models.fields
+import djmoney.models.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='max_price',
+            field=djmoney.models.fields.MoneyField(decimal_places=4, default=Decimal('0'), max_digits=19, validators=[djmoney.models.validators.MinMoneyValidator(0)]),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='max_price_currency',
+            field=djmoney.models.fields.CurrencyField(choices=[('HUF', 'HUF Ft'), ('USD', 'USD $'), ('EUR', 'EUR €'), ('GBP', 'GBP £')], default='HUF', editable=False, max_length=3),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.0.8 on 2026-10-16 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_max_price'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['active', 'modified', 'id'], name='products_pr_active_bc1aa6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['active', 'min_price', 'id'], name='products_pr_active_bc9792_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['product_template', 'active', 'min_price', 'id'], name='products_pr_product_ce852c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='products_pr_name_37bd5c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['active', 'modified', 'id'], name='products_pr_active_3b1b8c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['active', 'price', 'id'], name='products_pr_active_dff177_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['product', 'active', 'price', 'id'], name='products_pr_product_b3a8ff_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['name', 'id'], name='products_pr_name_9db06d_idx'),
+        ),
+    ]
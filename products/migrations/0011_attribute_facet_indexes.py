@@ -0,0 +1,21 @@
+# Generated by Django 3.0.8 on 2026-10-16 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_catalog_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='connectedproductattribute',
+            index=models.Index(fields=['value', 'product'], name='products_co_value_i_858670_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='connectedvariantattribute',
+            index=models.Index(fields=['value', 'variant'], name='products_co_value_i_e7d9e7_idx'),
+        ),
+    ]
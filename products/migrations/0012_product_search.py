@@ -0,0 +1,26 @@
+# Generated by Django 3.0.8 on 2026-10-16 23:40
+
+from django.db import migrations
+
+from products import search
+
+
+def create_search_table(apps, schema_editor):
+    search.create_table(schema_editor)
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(search.get_insert_sql(''))
+
+
+def drop_search_table(apps, schema_editor):
+    search.drop_table(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_attribute_facet_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.0.8 on 2026-10-17 00:20
+
+from django.db import migrations, models
+
+
+def fill_signatures(apps, schema_editor):
+    ConnectedVariantAttribute = apps.get_model('products', 'ConnectedVariantAttribute')
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+
+    values = {}
+    for variant_id, value_id in ConnectedVariantAttribute.objects.values_list('variant_id', 'value_id'):
+        values.setdefault(variant_id, set()).add(value_id)
+    ProductVariant.objects.bulk_update(
+        [
+            ProductVariant(id=variant_id, attribute_signature=','.join(str(id) for id in sorted(value_ids)))
+            for variant_id, value_ids in values.items()
+        ],
+        ['attribute_signature'],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='attribute_signature',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['product', 'attribute_signature'], name='products_pr_product_6c9c5f_idx'),
+        ),
+        migrations.RunPython(fill_signatures, migrations.RunPython.noop),
+    ]
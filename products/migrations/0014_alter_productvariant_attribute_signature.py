@@ -0,0 +1,31 @@
+# Generated by Django 3.0.8 on 2026-10-17 02:05
+
+from hashlib import sha1
+
+from django.db import migrations, models
+
+
+def hash_signatures(apps, schema_editor):
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+
+    variants = ProductVariant.objects.exclude(attribute_signature='').only('id', 'attribute_signature')
+    for variant in variants:
+        variant.attribute_signature = sha1(variant.attribute_signature.encode()).hexdigest()
+    ProductVariant.objects.bulk_update(variants, ['attribute_signature'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_productvariant_attribute_signature'),
+    ]
+
+    operations = [
+        # Hash the stored signatures before the column is shortened
+        migrations.RunPython(hash_signatures, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='productvariant',
+            name='attribute_signature',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+    ]
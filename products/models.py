@@ -4,19 +4,27 @@ from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models.signals import pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from djmoney.contrib.exchange.models import ExchangeBackend, Rate
 from djmoney.models.fields import MoneyField
 from djmoney.models.validators import MinMoneyValidator
-from webshop_drf.utils import unique_random_string_generator
-
+from webshop_drf.utils import UniqueSlugMixin
+
+from .autocomplete import PRODUCT, TEMPLATE, VALUE, update_autocomplete_index
+from .bitmaps import bump_attribute_index, update_attribute_index
+from .cache import bump_catalog_version, bump_fragment_versions
+from .exchange import bump_exchange_rates
+from .prices import get_price_state, refresh_price_ranges, update_price_range
+from .search import reindex_later, reindex_values_later
+from .signatures import refresh_signatures
 from .managers import *
 
 
-class ProductTemplate(models.Model):
+class ProductTemplate(UniqueSlugMixin, models.Model):
     """
     Container model for a product template
     which used for grouping together products.
@@ -29,7 +37,7 @@ class ProductTemplate(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(UniqueSlugMixin, models.Model):
     """
     Container model for a product
     which stores information common to all of its variations.
@@ -54,12 +62,35 @@ class Product(models.Model):
             MinMoneyValidator(0),
         ]
     )
+    # Range of the active variants' prices, see prices.py
+    max_price = MoneyField(
+        max_digits=19,
+        decimal_places=4,
+        default=0,
+        default_currency=settings.DEFAULT_CURRENCY,
+        currency_choices=settings.CURRENCY_CHOICES,
+        currency_max_length=settings.DEFAULT_CURRENCY_CODE_LENGTH,
+        validators=[
+            MinMoneyValidator(0),
+        ]
+    )
     active = models.BooleanField(default=False)
     created = models.DateTimeField(editable=False, default=timezone.now)
     modified = models.DateTimeField(default=timezone.now)
 
     objects = ProductManager()
 
+    class Meta:
+        indexes = [
+            # Keyset pagination
+            models.Index(fields=['modified', 'id']),
+            # Filters and ordering of the API, see api/filters.py
+            models.Index(fields=['active', 'modified', 'id']),
+            models.Index(fields=['active', 'min_price', 'id']),
+            models.Index(fields=['product_template', 'active', 'min_price', 'id']),
+            models.Index(fields=['name', 'id']),
+        ]
+
     def save(self, *args, **kwargs):
         """
         Update timestamps.
@@ -73,7 +104,7 @@ class Product(models.Model):
         return self.name
 
 
-class ProductVariant(models.Model):
+class ProductVariant(UniqueSlugMixin, models.Model):
     """
     Container model for a product variant
     which stores information specific to a product variation.
@@ -100,6 +131,38 @@ class ProductVariant(models.Model):
     active = models.BooleanField(default=False)
     created = models.DateTimeField(editable=False, default=timezone.now)
     modified = models.DateTimeField(default=timezone.now)
+    # Digest of the connected attribute values, see signatures.py
+    attribute_signature = models.CharField(max_length=40, blank=True, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination
+            models.Index(fields=['modified', 'id']),
+            # Filters and ordering of the API, see api/filters.py
+            models.Index(fields=['active', 'modified', 'id']),
+            models.Index(fields=['active', 'price', 'id']),
+            models.Index(fields=['product', 'active', 'price', 'id']),
+            models.Index(fields=['name', 'id']),
+            # Variant lookup by attribute values
+            models.Index(fields=['product', 'attribute_signature']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_price_state()
+        return instance
+
+    def remember_price_state(self):
+        """
+        Store the product and price state as saved,
+        used to maintain the price range of the product
+        """
+        deferred = self.get_deferred_fields()
+        if deferred.intersection(['product', 'price', 'price_currency', 'active']):
+            self._saved_price_state = None
+        else:
+            self._saved_price_state = (self.product_id, get_price_state(self))
 
     def save(self, *args, **kwargs):
         """
@@ -174,7 +237,7 @@ class AttributeVariant(models.Model):
         unique_together = ('attribute', 'product_template',)
 
 
-class Attribute(models.Model):
+class Attribute(UniqueSlugMixin, models.Model):
     """
     Container model for an attribute.
     """
@@ -236,6 +299,10 @@ class ConnectedProductAttribute(AbstractConnectedAttribute):
 
     class Meta:
         unique_together = ('product', 'connection',)
+        indexes = [
+            # Attribute filters and facet counts (see api.filters)
+            models.Index(fields=['value', 'product']),
+        ]
 
 
 class ConnectedVariantAttribute(AbstractConnectedAttribute):
@@ -257,18 +324,10 @@ class ConnectedVariantAttribute(AbstractConnectedAttribute):
 
     class Meta:
         unique_together = ('variant', 'connection',)
-
-
-@receiver(pre_save, sender=ProductTemplate)
-@receiver(pre_save, sender=Product)
-@receiver(pre_save, sender=ProductVariant)
-@receiver(pre_save, sender=Attribute)
-def slug_pre_save(sender, instance, *args, **kwargs):
-    """
-    Create a slug
-    """
-    if not instance.slug:
-        instance.slug = unique_random_string_generator(instance, size=10)
+        indexes = [
+            # Attribute filters and facet counts (see api.filters)
+            models.Index(fields=['value', 'variant']),
+        ]
 
 
 @receiver(pre_save, sender=Product)
@@ -285,3 +344,258 @@ def validate_choice_variant(sender, instance, *args, **kwargs):
         raise ValidationError(
             _(f"Currency({c}) is not one of the permitted values: {cc}")
         )
+
+
+@receiver(post_save, sender=ProductTemplate)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_save, sender=Attribute)
+@receiver(post_save, sender=AttributeValue)
+@receiver(post_save, sender=AttributeProduct)
+@receiver(post_save, sender=AttributeVariant)
+@receiver(post_save, sender=ConnectedProductAttribute)
+@receiver(post_save, sender=ConnectedVariantAttribute)
+@receiver(post_delete, sender=ProductTemplate)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_delete, sender=Attribute)
+@receiver(post_delete, sender=AttributeValue)
+@receiver(post_delete, sender=AttributeProduct)
+@receiver(post_delete, sender=AttributeVariant)
+@receiver(post_delete, sender=ConnectedProductAttribute)
+@receiver(post_delete, sender=ConnectedVariantAttribute)
+def invalidate_catalog_cache(sender, instance, *args, **kwargs):
+    """
+    Invalidate cached catalog responses
+    """
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_fragment(sender, instance, *args, **kwargs):
+    bump_fragment_versions(Product, [instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def remember_product(sender, instance, *args, **kwargs):
+    Product.objects.remember(instance)
+
+
+@receiver(post_delete, sender=Product)
+def forget_product(sender, instance, *args, **kwargs):
+    Product.objects.forget(instance)
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def invalidate_variant_fragment(sender, instance, *args, **kwargs):
+    bump_fragment_versions(ProductVariant, [instance.pk])
+    bump_fragment_versions(Product, [instance.product_id])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def reindex_variant_product(sender, instance, *args, **kwargs):
+    # Connected before update_product_price_range, which replaces
+    # the saved state of a variant moved from another product
+    saved = getattr(instance, '_saved_price_state', None)
+    reindex_later([instance.product_id, saved[0] if saved else None])
+
+
+@receiver(post_save, sender=ProductVariant)
+def update_product_price_range(sender, instance, created, *args, **kwargs):
+    """
+    Apply the changed price of the variant to the range of its product
+    """
+    saved = None if created else getattr(instance, '_saved_price_state', None)
+    new = get_price_state(instance)
+    if not created and saved is None:
+        # The former state is not known
+        refresh_price_ranges([instance.product_id])
+    elif saved is not None and saved[0] != instance.product_id:
+        update_price_range(saved[0], saved[1], None)
+        update_price_range(instance.product_id, None, new)
+    else:
+        update_price_range(instance.product_id, saved[1] if saved else None, new)
+    instance.remember_price_state()
+
+
+@receiver(post_delete, sender=ProductVariant)
+def remove_product_price_range(sender, instance, *args, **kwargs):
+    """
+    Remove the price of the deleted variant from the range of its product
+    """
+    saved = getattr(instance, '_saved_price_state', None)
+    if saved is None:
+        refresh_price_ranges([instance.product_id])
+    else:
+        update_price_range(saved[0], saved[1], None)
+
+
+@receiver(post_save, sender=ConnectedProductAttribute)
+@receiver(post_delete, sender=ConnectedProductAttribute)
+def invalidate_connected_product_attribute_fragment(sender, instance, *args, **kwargs):
+    bump_fragment_versions(Product, [instance.product_id])
+
+
+@receiver(post_save, sender=ConnectedVariantAttribute)
+@receiver(post_delete, sender=ConnectedVariantAttribute)
+def invalidate_connected_variant_attribute_fragment(sender, instance, *args, **kwargs):
+    bump_fragment_versions(ProductVariant, [instance.variant_id])
+    # The variant is already gone when it is deleted with its attributes
+    product_id = (ProductVariant.objects
+                  .filter(pk=instance.variant_id)
+                  .values_list('product_id', flat=True)
+                  .first())
+    bump_fragment_versions(Product, [product_id])
+
+
+@receiver(post_save, sender=Attribute)
+@receiver(post_delete, sender=Attribute)
+def invalidate_attribute_fragment(sender, instance, *args, **kwargs):
+    bump_fragment_versions(Attribute, [instance.pk])
+
+
+@receiver(post_save, sender=AttributeValue)
+@receiver(post_delete, sender=AttributeValue)
+def invalidate_attribute_value_fragment(sender, instance, *args, **kwargs):
+    bump_fragment_versions(Attribute, [instance.attribute_id])
+
+
+@receiver(post_save, sender=ProductVariant)
+def index_variant(sender, instance, *args, **kwargs):
+    update_attribute_index('set_variant_product', instance.pk, instance.product_id)
+
+
+@receiver(post_delete, sender=ProductVariant)
+def unindex_variant(sender, instance, *args, **kwargs):
+    update_attribute_index('remove_variant', instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, *args, **kwargs):
+    update_attribute_index('remove_product', instance.pk)
+
+
+@receiver(post_save, sender=ConnectedProductAttribute)
+def index_connected_product_attribute(sender, instance, created, *args, **kwargs):
+    if created:
+        update_attribute_index('add_product_value', instance.product_id, instance.value_id)
+    else:
+        # The former value is not known
+        bump_attribute_index()
+
+
+@receiver(post_delete, sender=ConnectedProductAttribute)
+def unindex_connected_product_attribute(sender, instance, *args, **kwargs):
+    update_attribute_index('remove_product_value', instance.product_id, instance.value_id)
+
+
+@receiver(post_save, sender=ConnectedVariantAttribute)
+def index_connected_variant_attribute(sender, instance, created, *args, **kwargs):
+    if created:
+        update_attribute_index('add_variant_value', instance.variant_id, instance.value_id)
+    else:
+        bump_attribute_index()
+
+
+@receiver(post_delete, sender=ConnectedVariantAttribute)
+def unindex_connected_variant_attribute(sender, instance, *args, **kwargs):
+    update_attribute_index('remove_variant_value', instance.variant_id, instance.value_id)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def reindex_product(sender, instance, *args, **kwargs):
+    reindex_later([instance.pk])
+
+
+@receiver(post_save, sender=ConnectedProductAttribute)
+@receiver(post_delete, sender=ConnectedProductAttribute)
+def reindex_connected_product_attribute(sender, instance, *args, **kwargs):
+    reindex_later([instance.product_id])
+
+
+@receiver(post_save, sender=ConnectedVariantAttribute)
+@receiver(post_delete, sender=ConnectedVariantAttribute)
+def reindex_connected_variant_attribute(sender, instance, *args, **kwargs):
+    reindex_later(ProductVariant.objects.filter(pk=instance.variant_id).values_list('product_id', flat=True))
+
+
+@receiver(post_save, sender=AttributeValue)
+def reindex_attribute_value_products(sender, instance, created, *args, **kwargs):
+    if not created:
+        reindex_values_later([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def suggest_product(sender, instance, created, *args, **kwargs):
+    update_autocomplete_index('add', PRODUCT, instance.pk, instance.name)
+    if created:
+        update_autocomplete_index('change_popularity', TEMPLATE, instance.product_template_id, 1)
+
+
+@receiver(post_delete, sender=Product)
+def unsuggest_product(sender, instance, *args, **kwargs):
+    update_autocomplete_index('remove', PRODUCT, instance.pk)
+    update_autocomplete_index('change_popularity', TEMPLATE, instance.product_template_id, -1)
+
+
+@receiver(post_save, sender=ProductTemplate)
+def suggest_template(sender, instance, *args, **kwargs):
+    update_autocomplete_index('add', TEMPLATE, instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=ProductTemplate)
+def unsuggest_template(sender, instance, *args, **kwargs):
+    update_autocomplete_index('remove', TEMPLATE, instance.pk)
+
+
+@receiver(post_save, sender=AttributeValue)
+def suggest_attribute_value(sender, instance, *args, **kwargs):
+    update_autocomplete_index('add', VALUE, instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=AttributeValue)
+def unsuggest_attribute_value(sender, instance, *args, **kwargs):
+    update_autocomplete_index('remove', VALUE, instance.pk)
+
+
+@receiver(post_save, sender=ProductVariant)
+def count_variant_popularity(sender, instance, created, *args, **kwargs):
+    if created:
+        update_autocomplete_index('change_popularity', PRODUCT, instance.product_id, 1)
+
+
+@receiver(post_delete, sender=ProductVariant)
+def uncount_variant_popularity(sender, instance, *args, **kwargs):
+    update_autocomplete_index('change_popularity', PRODUCT, instance.product_id, -1)
+
+
+@receiver(post_save, sender=ConnectedProductAttribute)
+@receiver(post_save, sender=ConnectedVariantAttribute)
+def count_value_popularity(sender, instance, created, *args, **kwargs):
+    if created:
+        update_autocomplete_index('change_popularity', VALUE, instance.value_id, 1)
+
+
+@receiver(post_delete, sender=ConnectedProductAttribute)
+@receiver(post_delete, sender=ConnectedVariantAttribute)
+def uncount_value_popularity(sender, instance, *args, **kwargs):
+    update_autocomplete_index('change_popularity', VALUE, instance.value_id, -1)
+
+
+@receiver(post_save, sender=ConnectedVariantAttribute)
+@receiver(post_delete, sender=ConnectedVariantAttribute)
+def refresh_variant_signature(sender, instance, *args, **kwargs):
+    variant_field = ConnectedVariantAttribute._meta.get_field('variant')
+    instances = [instance.variant] if variant_field.is_cached(instance) else []
+    refresh_signatures([instance.variant_id], instances)
+
+
+@receiver(post_save, sender=ExchangeBackend)
+@receiver(post_save, sender=Rate)
+@receiver(post_delete, sender=Rate)
+def reload_exchange_rates(sender, instance, *args, **kwargs):
+    bump_exchange_rates()
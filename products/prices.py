@@ -0,0 +1,161 @@
+"""
+Price range (min_price, max_price) of products maintained from
+the prices of their active variants.
+
+Prices in different currencies are not comparable, so the range is
+kept in one currency: the currency of the product's range if an
+active variant is priced in it, otherwise the currency most of its
+active variants are priced in. Products without active variants
+keep the range set on them.
+
+Saving or deleting a single variant adjusts the range of its product
+without aggregating when it can (see update_price_range), bulk writes
+and the repair command recompute the ranges with one grouped query
+(see refresh_price_ranges).
+"""
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+from djmoney.money import Money
+
+from .cache import bump_fragment_versions
+
+RANGE_FIELDS = ['min_price', 'min_price_currency', 'max_price', 'max_price_currency']
+
+
+def get_price_state(variant):
+    """
+    Return what a variant adds to the range of its product
+    as (amount, currency), None when it is not active
+    """
+    if not variant.active or variant.price is None:
+        return None
+    return (variant.price.amount, str(variant.price_currency))
+
+
+def choose_range(product, groups):
+    """
+    Return (currency, min, max) of the range of product,
+    groups is {currency: (min, max, count)} of its active variants
+    """
+    currency = str(product.min_price_currency)
+    if not groups:
+        return currency, product.min_price.amount, product.max_price.amount
+    if currency not in groups:
+        currency = min(groups, key=lambda c: (-groups[c][2], c))
+    low, high, _count = groups[currency]
+    return currency, low, high
+
+
+def get_range_groups(product_ids=None):
+    """
+    Return {product id: {currency: (min, max, count)}}
+    of the active variants, with one grouped query
+    """
+    from .models import ProductVariant
+
+    queryset = ProductVariant.objects.filter(active=True)
+    if product_ids is not None:
+        queryset = queryset.filter(product_id__in=product_ids)
+    rows = (queryset
+            .order_by()
+            .values('product_id', 'price_currency')
+            .annotate(low=Min('price'), high=Max('price'), count=Count('id')))
+
+    groups = {}
+    for row in rows:
+        low, high = (getattr(x, 'amount', x) for x in (row['low'], row['high']))
+        groups.setdefault(row['product_id'], {})[row['price_currency']] = (low, high, row['count'])
+    return groups
+
+
+def set_range(product, currency, low, high):
+    """
+    Set the range of product, return if it changed
+    """
+    current = (str(product.min_price_currency), product.min_price.amount,
+               str(product.max_price_currency), product.max_price.amount)
+    if current == (currency, low, currency, high):
+        return False
+    product.min_price = Money(low, currency)
+    product.max_price = Money(high, currency)
+    return True
+
+
+def refresh_price_ranges(product_ids=None, batch_size=1000, instances=()):
+    """
+    Recompute the range of the given products (every product if None)
+    from their active variants, returns the number of changed products.
+    Runs one grouped query, loads the products and writes the changed
+    ones (and their modified timestamp) in bulk, which does not send
+    model signals. The ranges of instances (in memory) are set as well.
+    """
+    from .models import Product
+
+    groups = get_range_groups(product_ids)
+    products = Product.objects.only('id', *RANGE_FIELDS).order_by()
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+
+    changed = []
+    now = timezone.now()
+    for product in products.iterator(chunk_size=batch_size):
+        currency, low, high = choose_range(product, groups.get(product.id))
+        if set_range(product, currency, low, high):
+            # Moves the ETag and Last-Modified of the product
+            product.modified = now
+            changed.append(product)
+
+    Product.objects.bulk_update(changed, RANGE_FIELDS + ['modified'], batch_size=batch_size)
+    ids = [product.id for product in changed]
+    bump_fragment_versions(Product, ids)
+    for product in changed:
+        Product.objects.forget(product)
+    changed = {product.id: product for product in changed}
+    for instance in instances:
+        product = changed.get(instance.pk)
+        if product is not None:
+            instance.min_price = product.min_price
+            instance.max_price = product.max_price
+            instance.modified = product.modified
+    return len(changed)
+
+
+def update_price_range(product_id, old, new):
+    """
+    Adjust the range of a product after one of its variants changed
+    from old to new (see get_price_state).
+    A variant which can only widen the range is applied without
+    an aggregate, the range is recomputed when the variant may have
+    been its lowest or highest price or the currency may change.
+    """
+    from .models import Product
+
+    if old == new or product_id is None:
+        return
+
+    product = Product.objects.only('id', *RANGE_FIELDS).filter(id=product_id).first()
+    if product is None:
+        # Deleted together with its variants
+        return
+
+    currency = str(product.min_price_currency)
+    low, high = product.min_price.amount, product.max_price.amount
+    # A zero or inconsistent range may not count any variant yet
+    unknown = str(product.max_price_currency) != currency or high < low or high == 0
+    other_currency = any(state is not None and state[1] != currency for state in (old, new))
+    bound = old is not None and old[0] in (low, high)
+
+    if unknown or other_currency or bound:
+        refresh_price_ranges([product_id])
+        return
+    if new is None:
+        return
+
+    if set_range(product, currency, min(low, new[0]), max(high, new[0])):
+        Product.objects.filter(id=product_id).update(
+            min_price=product.min_price.amount,
+            max_price=product.max_price.amount,
+            modified=timezone.now(),
+        )
+        bump_fragment_versions(Product, [product_id])
+        Product.objects.forget(product)
@@ -0,0 +1,193 @@
+"""
+Full-text search over products with an SQLite FTS5 table.
+
+Each product has one row in SEARCH_TABLE (its rowid is the product id)
+with the product's name and description, the names of its variants and
+the names of the attribute values of the product and its variants.
+The rows of a set of products are rewritten with two statements
+(see index_products), the attribute and variant names are collected
+by correlated subqueries inside the database.
+
+Model signals collect the changed products and reindex them once
+when the transaction commits, bulk writes which send no signals
+reindex their products explicitly. The search_index command
+rebuilds the whole table.
+
+Other database backends have no FTS5 table, search_products
+falls back to matching the product names there.
+"""
+import html
+import re
+import threading
+
+from django.db import connection, transaction
+
+SEARCH_TABLE = 'products_search'
+# bm25 weights of the columns: name, description, variants, attributes
+WEIGHTS = (10.0, 2.0, 5.0, 1.0)
+SNIPPET_TOKENS = 12
+# Private use characters marking the matches of snippets until
+# the rest of the text is escaped
+MATCH_START = '\ue000'
+MATCH_END = '\ue001'
+
+_pending = threading.local()
+
+
+def is_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def create_table(schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} '
+            f'USING fts5(name, description, variants, attributes, '
+            f'tokenize="unicode61 remove_diacritics 2")'
+        )
+
+
+def drop_table(schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+def get_insert_sql(where):
+    from .models import (AttributeValue, ConnectedProductAttribute,
+                         ConnectedVariantAttribute, Product, ProductVariant)
+
+    product = Product._meta.db_table
+    variant = ProductVariant._meta.db_table
+    value = AttributeValue._meta.db_table
+    cpa = ConnectedProductAttribute._meta.db_table
+    cva = ConnectedVariantAttribute._meta.db_table
+    return f"""
+        INSERT INTO {SEARCH_TABLE}(rowid, name, description, variants, attributes)
+        SELECT p.id, p.name, COALESCE(p.description, ''),
+            COALESCE((SELECT group_concat(v.name, ' ') FROM {variant} v
+                      WHERE v.product_id = p.id), ''),
+            COALESCE((SELECT group_concat(av.name, ' ') FROM {cpa} c
+                      JOIN {value} av ON av.id = c.value_id
+                      WHERE c.product_id = p.id), '')
+            || ' ' ||
+            COALESCE((SELECT group_concat(av.name, ' ') FROM {cva} c
+                      JOIN {variant} v ON v.id = c.variant_id
+                      JOIN {value} av ON av.id = c.value_id
+                      WHERE v.product_id = p.id), '')
+        FROM {product} p {where}
+    """
+
+
+def index_products(product_ids):
+    """
+    Rewrite the search rows of the given products,
+    deleted products lose their row
+    """
+    ids = sorted({int(id) for id in product_ids if id is not None})
+    if not ids or not is_enabled():
+        return
+    # Stay below the variable limit of older SQLite builds
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', chunk)
+            cursor.execute(get_insert_sql(f'WHERE p.id IN ({placeholders})'), chunk)
+
+
+def rebuild_search_index():
+    """
+    Rewrite every search row, returns the number of indexed products
+    """
+    if not is_enabled():
+        return 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(get_insert_sql(''))
+        cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE}')
+        return cursor.fetchone()[0]
+
+
+def _flush():
+    ids = getattr(_pending, 'ids', None)
+    if ids:
+        _pending.ids = set()
+        index_products(ids)
+
+
+def reindex_later(product_ids):
+    """
+    Reindex the products when the current transaction commits,
+    the products of every callback are indexed by the first one.
+    Products of rolled back transactions are reindexed
+    with the next ones, which does not change their rows.
+    """
+    if not hasattr(_pending, 'ids'):
+        _pending.ids = set()
+    _pending.ids.update(id for id in product_ids if id is not None)
+    transaction.on_commit(_flush)
+
+
+def reindex_values_later(value_ids):
+    """
+    Reindex the products carrying the given attribute values
+    (on the product or a variant) when the transaction commits
+    """
+    from .models import ConnectedProductAttribute, ConnectedVariantAttribute
+
+    reindex_later(ConnectedProductAttribute.objects
+                  .filter(value_id__in=value_ids)
+                  .values_list('product_id', flat=True))
+    reindex_later(ConnectedVariantAttribute.objects
+                  .filter(value_id__in=value_ids)
+                  .values_list('variant__product_id', flat=True))
+
+
+def get_match_query(text):
+    """
+    Turn the words of text into an FTS5 query matching
+    the rows which have every word as a prefix of a term,
+    None when there are no words
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def to_snippet_html(text):
+    """
+    Escape text and turn the match markers into <b> tags
+    """
+    return html.escape(text).replace(MATCH_START, '<b>').replace(MATCH_END, '</b>')
+
+
+def search_products(text, limit=20, offset=0):
+    """
+    Return the best matching products of text as
+    [(product id, rank, snippet)], best first,
+    the snippet is escaped HTML with the matches in <b>
+    """
+    query = get_match_query(text)
+    if query is None:
+        return []
+
+    if not is_enabled():
+        from .models import Product
+
+        rows = (Product.objects
+                .filter(name__icontains=text)
+                .order_by('name', 'id')
+                .values_list('id', 'name')[offset:offset + limit])
+        return [(id, 0.0, html.escape(name)) for id, name in rows]
+
+    weights = ', '.join(str(w) for w in WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, bm25({SEARCH_TABLE}, {weights}) AS rank, "
+            f"snippet({SEARCH_TABLE}, -1, %s, %s, '…', {SNIPPET_TOKENS}) "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+            f"ORDER BY rank, rowid LIMIT %s OFFSET %s",
+            [MATCH_START, MATCH_END, query, limit, offset]
+        )
+        return [(id, -rank, to_snippet_html(snippet)) for id, rank, snippet in cursor.fetchall()]
@@ -0,0 +1,105 @@
+"""
+Attribute signatures of product variants.
+
+The signature of a variant is the sha1 digest of the canonical form
+of the ids of the AttributeValues connected to it (sorted and comma
+separated, empty without attributes), so it has a fixed length with
+any number of attributes. It is stored in
+ProductVariant.attribute_signature and indexed with the product. The variant of a product with a
+combination of values is found with one index lookup (see
+resolve_variant), API writes reject a combination another variant
+of the product already has (see get_conflicts) and the importer
+rejects the products it would leave with repeated combinations (see
+get_repeated_combinations).
+
+Model signals of ConnectedVariantAttribute keep the signatures up to
+date, bulk writes which send no signals refresh them explicitly.
+"""
+from hashlib import sha1
+
+from django.db.models import Count, Q
+
+
+def get_signature(value_ids):
+    ids = ','.join(str(id) for id in sorted({int(id) for id in value_ids}))
+    return sha1(ids.encode()).hexdigest() if ids else ''
+
+
+def refresh_signatures(variant_ids, instances=()):
+    """
+    Recompute the signatures of the given variants from their
+    connected attributes, with one query to read and one to write.
+    The signatures of instances (in memory) are set as well.
+    """
+    from .models import ConnectedVariantAttribute, ProductVariant
+
+    values = {id: [] for id in variant_ids if id is not None}
+    if not values:
+        return
+    rows = (ConnectedVariantAttribute.objects
+            .filter(variant_id__in=values)
+            .values_list('variant_id', 'value_id'))
+    for variant_id, value_id in rows:
+        values[variant_id].append(value_id)
+
+    signatures = {id: get_signature(value_ids) for id, value_ids in values.items()}
+    ProductVariant.objects.bulk_update(
+        [ProductVariant(id=id, attribute_signature=signature) for id, signature in signatures.items()],
+        ['attribute_signature']
+    )
+    for instance in instances:
+        if instance.pk in signatures:
+            instance.attribute_signature = signatures[instance.pk]
+
+
+def get_conflicts(combinations, ignore=()):
+    """
+    Return the (product id, signature) pairs of combinations
+    which a stored variant (besides the ones in ignore) has,
+    with one query
+    """
+    from .models import ProductVariant
+
+    combinations = {(product_id, signature) for product_id, signature in combinations if signature}
+    if not combinations:
+        return set()
+    condition = Q()
+    for product_id, signature in combinations:
+        condition |= Q(product_id=product_id, attribute_signature=signature)
+    rows = (ProductVariant.objects
+            .filter(condition)
+            .exclude(id__in=list(ignore))
+            .values_list('product_id', 'attribute_signature'))
+    return set(rows)
+
+
+def get_repeated_combinations(product_ids):
+    """
+    Return the ids of the products (among product_ids) which have
+    several variants with the same attribute values, with one query
+    """
+    from .models import ProductVariant
+
+    rows = (ProductVariant.objects
+            .filter(product_id__in=list(product_ids))
+            .exclude(attribute_signature='')
+            .order_by()
+            .values('product_id', 'attribute_signature')
+            .annotate(count=Count('id'))
+            .filter(count__gt=1)
+            .values_list('product_id', flat=True))
+    return set(rows)
+
+
+def resolve_variant(product_id, value_ids, fields):
+    """
+    Return the fields of the variant of the product with exactly
+    the given attribute values, None if there is none
+    """
+    from .models import ProductVariant
+
+    return (ProductVariant.objects
+            .filter(product_id=product_id, attribute_signature=get_signature(value_ids))
+            .order_by('id')
+            .values(*fields)
+            .first())
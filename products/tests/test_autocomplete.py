@@ -0,0 +1,87 @@
+from django.test import SimpleTestCase, TransactionTestCase
+
+from ..autocomplete import (PRODUCT, TEMPLATE, VALUE, AutocompleteIndex,
+                            get_autocomplete_index, get_keys)
+from ..cache import get_cache
+from ..models import *
+
+
+class AutocompleteIndexTest(SimpleTestCase):
+    """
+    Test module For the prefix index operations
+    """
+
+    def test_keys(self):
+        self.assertEqual(get_keys("Pálinka Ale"), ["palinka ale", "ale"])
+
+    def test_suggest(self):
+        index = AutocompleteIndex(max_keys=10)
+        index.add(PRODUCT, 1, "Pale Ale", 3)
+        index.add(PRODUCT, 2, "Pálinka", 5)
+        index.add(TEMPLATE, 1, "Ale", 1)
+
+        self.assertEqual(index.suggest("pa"), [(PRODUCT, 2, "Pálinka"), (PRODUCT, 1, "Pale Ale")])
+        self.assertEqual(index.suggest("ALE", kinds=[TEMPLATE]), [(TEMPLATE, 1, "Ale")])
+        self.assertEqual(index.suggest("a", limit=1), [(PRODUCT, 1, "Pale Ale")])
+        self.assertEqual(index.suggest(" "), [])
+
+        # Renamed names keep their popularity
+        index.add(PRODUCT, 1, "Stout")
+        self.assertEqual(index.suggest("st"), [(PRODUCT, 1, "Stout")])
+        self.assertEqual(index.popularity[(PRODUCT, 1)], 3)
+        self.assertEqual(index.suggest("pale"), [])
+
+        index.remove(PRODUCT, 2)
+        self.assertEqual(index.suggest("pa"), [])
+
+    def test_budget(self):
+        index = AutocompleteIndex(max_keys=3)
+        index.add(PRODUCT, 1, "Pale Ale")
+        index.add(PRODUCT, 2, "Brown Ale")
+        self.assertEqual(len(index.keys), 2)
+        self.assertEqual(index.suggest("brown"), [])
+
+
+class AutocompleteSignalTest(TransactionTestCase):
+    """
+    Test module For the prefix index
+    maintained from model signals
+    """
+
+    def setUp(self):
+        get_cache().clear()
+        self.pt = ProductTemplate.objects.create(name="Beer")
+        attribute = Attribute.objects.create(name="Brand")
+        self.value = AttributeValue.objects.create(attribute=attribute, name="Modelo", value="modelo")
+        self.ap = AttributeProduct.objects.create(attribute=attribute, product_template=self.pt)
+        self.ale = Product.objects.create(name="Pale Ale", product_template=self.pt)
+
+    def test_build(self):
+        ProductVariant.objects.create(name="Pale Ale 330 ml", product=self.ale)
+        lager = Product.objects.create(name="Pale Lager", product_template=self.pt)
+        get_cache().clear()
+        index = get_autocomplete_index()
+        # Products with more variants first
+        self.assertEqual(index.suggest("pale"), [(PRODUCT, self.ale.id, "Pale Ale"),
+                                                 (PRODUCT, lager.id, "Pale Lager")])
+        self.assertEqual(index.popularity[(TEMPLATE, self.pt.id)], 2)
+
+    def test_signals(self):
+        index = get_autocomplete_index()
+        stout = Product.objects.create(name="Stout", product_template=self.pt)
+        with self.assertNumQueries(0):
+            self.assertIs(get_autocomplete_index(), index)
+        self.assertEqual(index.suggest("sto"), [(PRODUCT, stout.id, "Stout")])
+
+        ConnectedProductAttribute.objects.create(product=stout, connection=self.ap, value=self.value)
+        self.assertEqual(index.popularity[(VALUE, self.value.id)], 1)
+        self.assertEqual(index.popularity[(TEMPLATE, self.pt.id)], 2)
+
+        self.value.name = "Corona"
+        self.value.save()
+        self.assertEqual(index.suggest("mod"), [])
+        self.assertEqual(index.suggest("cor"), [(VALUE, self.value.id, "Corona")])
+
+        stout.delete()
+        self.assertEqual(index.suggest("sto"), [])
+        self.assertEqual(index.popularity[(TEMPLATE, self.pt.id)], 1)
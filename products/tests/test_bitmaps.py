@@ -0,0 +1,129 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase
+
+from ..api.bulk import write_connected
+from ..bitmaps import (AttributeBitmapIndex, Bitset, bits_to_ids, get_attribute_index,
+                       ids_to_bits)
+from ..cache import get_cache
+from ..models import *
+
+
+class BitsetTest(SimpleTestCase):
+    """
+    Test module For the bitset helpers and index operations
+    """
+
+    def test_bits(self):
+        bits = ids_to_bits([3, 1, 64, 200000])
+        self.assertEqual(bits_to_ids(bits), [1, 3, 64, 200000])
+        self.assertEqual(len(bits), 4)
+        self.assertIn(200000, bits)
+        self.assertEqual(bits_to_ids(Bitset()), [])
+
+        other = ids_to_bits([3, 200000, 300000])
+        self.assertEqual((bits & other).ids(), [3, 200000])
+        self.assertEqual((bits | other).ids(), [1, 3, 64, 200000, 300000])
+        bits.discard(200000)
+        self.assertEqual(list(bits.blocks), [0])
+
+    def test_sparse(self):
+        """
+        A set of one high id only stores its block
+        """
+        bits = ids_to_bits([10 ** 7])
+        self.assertLess(bits.memory_size(), 1024)
+
+    def test_index(self):
+        index = AttributeBitmapIndex()
+        index.set_variant_product(10, 1)
+        index.set_variant_product(11, 2)
+        index.add_product_value(1, 100)
+        index.add_variant_value(10, 200)
+        index.add_variant_value(11, 200)
+
+        self.assertEqual(bits_to_ids(index.match([[100], [200]])), [1])
+        self.assertEqual(bits_to_ids(index.match([[100, 200]])), [1, 2])
+        self.assertEqual(index.count([100, 200], ids_to_bits([2])), {100: 0, 200: 1})
+
+        # Moving the variant moves its values
+        index.set_variant_product(11, 1)
+        self.assertEqual(bits_to_ids(index.match([[200]])), [1])
+
+        # The value is still on the other variant of the product
+        index.remove_variant_value(10, 200)
+        self.assertEqual(bits_to_ids(index.match([[200]])), [1])
+        index.remove_variant(11)
+        self.assertFalse(index.match([[200]]))
+
+        index.remove_product(1)
+        self.assertEqual(index.value_bits, {})
+
+
+class AttributeIndexTest(TransactionTestCase):
+    """
+    Test module For the attribute index
+    maintained from model signals
+    """
+
+    def setUp(self):
+        get_cache().clear()
+        pt = ProductTemplate.objects.create(name="Beer")
+        attribute = Attribute.objects.create(name="Brand")
+        self.modelo = AttributeValue.objects.create(attribute=attribute, name="Modelo", value="Modelo")
+        self.corona = AttributeValue.objects.create(attribute=attribute, name="Corona", value="Corona")
+        self.ap = AttributeProduct.objects.create(attribute=attribute, product_template=pt)
+        self.av = AttributeVariant.objects.create(attribute=attribute, product_template=pt)
+        self.p = Product.objects.create(name="Modelo", product_template=pt)
+        self.v = ProductVariant.objects.create(name="Modelo 330 ml", product=self.p)
+
+    def test_signals(self):
+        index = get_attribute_index()
+        ConnectedProductAttribute.objects.create(product=self.p, connection=self.ap, value=self.modelo)
+        cva = ConnectedVariantAttribute.objects.create(variant=self.v, connection=self.av, value=self.corona)
+
+        # Updated in place
+        with self.assertNumQueries(0):
+            self.assertIs(get_attribute_index(), index)
+        self.assertEqual(bits_to_ids(index.match([[self.modelo.id], [self.corona.id]])), [self.p.id])
+
+        cva.delete()
+        self.assertFalse(get_attribute_index().match([[self.corona.id]]))
+
+        self.p.delete()
+        self.assertEqual(get_attribute_index().value_bits, {})
+
+    def test_write_connected(self):
+        """
+        Bulk writes of the API update the index in place
+        """
+        index = get_attribute_index()
+        write_connected(ConnectedProductAttribute, 'product', {(self.p.id, self.ap.id): self.modelo.id})
+        write_connected(ConnectedProductAttribute, 'product', {(self.p.id, self.ap.id): self.corona.id},
+                        owners=[self.p.id])
+        with self.assertNumQueries(0):
+            self.assertIs(get_attribute_index(), index)
+        self.assertFalse(index.match([[self.modelo.id]]))
+        self.assertEqual(bits_to_ids(index.match([[self.corona.id]])), [self.p.id])
+
+    def test_bulk_write(self):
+        """
+        Writes without signals rebuild the index
+        """
+        index = get_attribute_index()
+        ConnectedProductAttribute.objects.create(product=self.p, connection=self.ap, value=self.modelo)
+        ConnectedProductAttribute.objects.update(value=self.corona)
+        call_command('rebuild_attribute_index', stdout=StringIO())
+
+        rebuilt = get_attribute_index()
+        self.assertIsNot(rebuilt, index)
+        self.assertFalse(rebuilt.match([[self.modelo.id]]))
+        self.assertEqual(bits_to_ids(rebuilt.match([[self.corona.id]])), [self.p.id])
+
+    def test_command(self):
+        ConnectedVariantAttribute.objects.create(variant=self.v, connection=self.av, value=self.corona)
+        out = StringIO()
+        call_command('rebuild_attribute_index', stdout=out)
+        self.assertIn("1 attribute values of 1 products", out.getvalue())
+        self.assertIn("KiB", out.getvalue())
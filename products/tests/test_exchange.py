@@ -0,0 +1,19 @@
+from decimal import Decimal
+
+from django.test import SimpleTestCase
+
+from ..exchange import RateTable
+
+
+class RateTableTest(SimpleTestCase):
+    """
+    Test module For the rates between currencies
+    """
+
+    def test_rates(self):
+        table = RateTable('USD', {'USD': Decimal(1), 'HUF': Decimal(400), 'EUR': Decimal('0.8')})
+        self.assertEqual(table.get_rate('HUF', 'HUF'), 1)
+        self.assertEqual(table.get_rate('USD', 'HUF'), 400)
+        self.assertEqual(table.get_rate('HUF', 'EUR'), Decimal('0.002'))
+        self.assertIsNone(table.get_rate('GBP', 'EUR'))
+        self.assertFalse(table.has_currency('GBP'))
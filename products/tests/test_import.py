@@ -0,0 +1,211 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from djmoney.money import Money
+
+from ..cache import get_catalog_version
+from ..models import *
+
+
+class ImportCatalogTest(TestCase):
+    """
+    Test module for the import_catalog command
+    """
+
+    def setUp(self):
+        self.pt = ProductTemplate.objects.create(name="Beer", slug="beer")
+        self.attr_brand = Attribute.objects.create(name="Brand")
+        self.attr_size = Attribute.objects.create(name="Bottle Size")
+        AttributeProduct.objects.create(attribute=self.attr_brand, product_template=self.pt)
+        AttributeVariant.objects.create(attribute=self.attr_size, product_template=self.pt)
+        self.modelo = AttributeValue.objects.create(
+            attribute=self.attr_brand,
+            name="Modelo",
+            value="Modelo"
+        )
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def record(self, i, **kwargs):
+        record = {
+            'name': f"Product {i}",
+            'slug': f"product-{i}",
+            'template': "beer",
+            'min_price': "100",
+            'active': True,
+            'attributes': {"Brand": "Modelo"},
+            'variants': [
+                {
+                    'name': f"Product {i} - {size}",
+                    'slug': f"product-{i}-{size}",
+                    'price': str(100 + size),
+                    'price_currency': "EUR",
+                    'attributes': {"Bottle Size": f"{size} ml"},
+                }
+                for size in (330, 500)
+            ],
+        }
+        record.update(kwargs)
+        return record
+
+    def write(self, name, content):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def write_ndjson(self, records, name='feed.ndjson'):
+        return self.write(name, ''.join(
+            (r if isinstance(r, str) else json.dumps(r)) + '\n' for r in records
+        ))
+
+    def call(self, path, **options):
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_create(self):
+        out, err = self.call(self.write_ndjson([self.record(i) for i in range(3)]))
+        self.assertIn("3 products (3 created, 0 updated)", out)
+        self.assertIn("6 variants (6 created, 0 updated)", out)
+        self.assertIn("rows/s", out)
+        self.assertEqual(err, '')
+
+        p = Product.objects.get(slug="product-1")
+        self.assertEqual(p.product_template, self.pt)
+        self.assertEqual(p.min_price, Money(100, 'HUF'))
+        self.assertTrue(p.active)
+        self.assertEqual(p.attributes.get().value, self.modelo)
+        v = p.variants.get(slug="product-1-500")
+        self.assertEqual(v.price, Money(600, 'EUR'))
+        self.assertEqual(v.attributes.get().value.name, "500 ml")
+        # New values are created once
+        self.assertEqual(AttributeValue.objects.filter(attribute=self.attr_size).count(), 2)
+
+    def test_update(self):
+        self.call(self.write_ndjson([self.record(i) for i in range(2)]))
+        record = self.record(0, name="Renamed", attributes={"Brand": "Corona"})
+        record['variants'][0]['price'] = "999"
+        out, _err = self.call(self.write_ndjson([record]))
+        self.assertIn("1 products (0 created, 1 updated)", out)
+
+        self.assertEqual(Product.objects.count(), 2)
+        p = Product.objects.get(slug="product-0")
+        self.assertEqual(p.name, "Renamed")
+        self.assertEqual(p.attributes.get().value.name, "Corona")
+        self.assertEqual(p.variants.get(slug="product-0-330").price, Money(999, 'EUR'))
+
+    def test_generated_slugs(self):
+        record = self.record(0, slug="")
+        for variant in record['variants']:
+            variant['slug'] = ""
+        self.call(self.write_ndjson([record, record]))
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(ProductVariant.objects.values('slug').distinct().count(), 4)
+
+    def test_csv(self):
+        path = self.write('feed.csv', (
+            "name,slug,template,min_price,active,product:Brand,"
+            "variant_name,variant_slug,price,price_currency,variant:Bottle Size\n"
+            "Pale Ale,pale-ale,Beer,10,yes,Modelo,Pale Ale 330,pale-ale-330,12,USD,330 ml\n"
+            "Pale Ale,pale-ale,Beer,10,yes,Modelo,Pale Ale 500,pale-ale-500,15,USD,500 ml\n"
+            "Lager,lager,Beer,5,no,,,,,,\n"
+        ))
+        out, _err = self.call(path)
+        self.assertIn("2 products (2 created, 0 updated)", out)
+        p = Product.objects.get(slug="pale-ale")
+        self.assertEqual(p.variants.count(), 2)
+        self.assertEqual(p.variants.get(slug="pale-ale-500").price, Money(15, 'USD'))
+        self.assertFalse(Product.objects.get(slug="lager").variants.exists())
+
+    def test_errors(self):
+        records = [
+            self.record(0),
+            "{not json",
+            self.record(2, template="wine"),
+            self.record(3, min_price_currency="XXX"),
+            self.record(4, attributes={"Color": "Red"}),
+            self.record(5, name=""),
+            self.record(0),
+        ]
+        out, err = self.call(self.write_ndjson(records))
+        self.assertEqual(Product.objects.count(), 1)
+        self.assertIn("6 records skipped", out)
+        for line, message in ((2, "invalid JSON"), (3, "unknown template"),
+                              (4, "XXX"), (5, "'Color'"), (6, "name is required"),
+                              (7, "slug repeated")):
+            self.assertIn(f"line {line}: ", err)
+            self.assertIn(message, err)
+
+    def test_batches(self):
+        """
+        Queries are run per batch, not per row
+        """
+        def count_queries(records):
+            with CaptureQueriesContext(connection) as queries:
+                self.call(self.write_ndjson(records), batch_size=100)
+            return len(queries)
+
+        # Create the attribute values first
+        self.call(self.write_ndjson([self.record(100)]))
+        few = count_queries([self.record(i) for i in range(2)])
+        many = count_queries([self.record(i) for i in range(10, 40)])
+        self.assertEqual(few, many)
+
+    def test_workers(self):
+        out, _err = self.call(self.write_ndjson([self.record(i) for i in range(5)]), workers=2)
+        self.assertIn("5 products (5 created, 0 updated)", out)
+
+    def test_verbosity(self):
+        path = self.write_ndjson([self.record(i) for i in range(3)])
+        out, _err = self.call(path, batch_size=2, verbosity=2)
+        self.assertIn("6 rows,", out)
+        self.assertEqual(out.count("rows/s"), 3)
+
+    def test_repeated_combinations(self):
+        record = self.record(0)
+        record['variants'][1]['attributes'] = {"Bottle Size": "330 ml"}
+        out, err = self.call(self.write_ndjson([record, self.record(1)]))
+        self.assertIn("1 products (1 created, 0 updated)", out)
+        self.assertIn("line 1: variants with the same attribute values", err)
+        self.assertEqual(list(Product.objects.values_list('slug', flat=True)), ["product-1"])
+
+        # The combination of a stored variant
+        record = self.record(1)
+        record['variants'][0]['slug'] = "product-1-new"
+        out, err = self.call(self.write_ndjson([record]))
+        self.assertIn("1 records skipped", out)
+        self.assertEqual(ProductVariant.objects.filter(product__slug="product-1").count(), 2)
+
+    def test_invalidates_cache(self):
+        version = get_catalog_version()
+        self.call(self.write_ndjson([self.record(0)]))
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_invalidates_cache_values_only(self):
+        """
+        Values created for records which are dropped later
+        are new catalog data as well
+        """
+        record = self.record(0, attributes={"Brand": "Corona"})
+        record['variants'] = record['variants'][:1] * 2
+        version = get_catalog_version()
+        self.call(self.write_ndjson([record]))
+        self.assertEqual(Product.objects.count(), 0)
+        self.assertTrue(AttributeValue.objects.filter(value="Corona").exists())
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_invalid_options(self):
+        with self.assertRaises(CommandError):
+            self.call(os.path.join(self.dir.name, 'missing.ndjson'))
+        with self.assertRaises(CommandError):
+            self.call(self.write_ndjson([]), batch_size=0)
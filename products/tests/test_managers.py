@@ -0,0 +1,83 @@
+from django.test import TestCase
+
+from ..api.bulk import prefetch_references
+from ..api.serializers import ProductVariantSerializer
+from ..managers import identity_map
+from ..models import *
+
+
+class ProductManagerTest(TestCase):
+    """
+    Test module For ProductManager lookups
+    """
+
+    def setUp(self):
+        pt = ProductTemplate.objects.create(name="Beer")
+        self.products = [
+            Product.objects.create(name=f"Beer {i}", product_template=pt)
+            for i in range(3)
+        ]
+
+    def test_get_by_id(self):
+        p = self.products[0]
+        with self.assertNumQueries(1):
+            self.assertEqual(Product.objects.get_by_id(p.id), p)
+        self.assertEqual(Product.objects.get_by_id(str(p.id)), p)
+        self.assertIsNone(Product.objects.get_by_id(1000))
+
+    def test_get_many(self):
+        ids = [p.id for p in self.products]
+        with self.assertNumQueries(1):
+            found = Product.objects.get_many(ids + [1000])
+        self.assertEqual(found, {p.id: p for p in self.products})
+
+    def test_get_by_slug(self):
+        p = self.products[1]
+        self.assertEqual(Product.objects.get_by_slug(p.slug), p)
+        self.assertIsNone(Product.objects.get_by_slug("missing"))
+
+    def test_identity_map(self):
+        ids = [p.id for p in self.products]
+        with identity_map():
+            with self.assertNumQueries(1):
+                first = Product.objects.get_many(ids)
+            with self.assertNumQueries(0):
+                self.assertIs(Product.objects.get_by_id(ids[0]), first[ids[0]])
+                self.assertIs(Product.objects.get_by_slug(first[ids[1]].slug), first[ids[1]])
+            with self.assertNumQueries(1):
+                Product.objects.get_many(ids + [1000])
+
+    def test_identity_map_signals(self):
+        p = self.products[0]
+        with identity_map():
+            Product.objects.get_by_id(p.id)
+
+            # Saved instances replace the stored ones
+            renamed = Product.objects.get(id=p.id)
+            renamed.name = "Renamed"
+            renamed.save()
+            with self.assertNumQueries(0):
+                self.assertEqual(Product.objects.get_by_id(p.id).name, "Renamed")
+
+            # Deleted instances are forgotten
+            renamed.delete()
+            self.assertIsNone(Product.objects.get_by_id(p.id))
+
+    def test_identity_map_scope(self):
+        p = self.products[0]
+        with identity_map():
+            Product.objects.get_by_id(p.id)
+        with self.assertNumQueries(1):
+            Product.objects.get_by_id(p.id)
+
+    def test_prefetch_references(self):
+        """
+        Product references of API writes are loaded through the identity map
+        """
+        p = self.products[0]
+        serializer = ProductVariantSerializer()
+        with identity_map():
+            first = Product.objects.get_by_id(p.id)
+            with self.assertNumQueries(0):
+                prefetch_references(serializer, [{'product_id': p.id}])
+        self.assertIs(serializer.fields['product_id'].prefetched[str(p.id)], first)
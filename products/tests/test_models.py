@@ -1,5 +1,7 @@
 from time import sleep
+from unittest import mock
 
+from django.db import IntegrityError, transaction
 from django.test import TestCase
 from django.utils import timezone
 from djmoney.money import Money
@@ -165,6 +167,23 @@ class AttributeTest(TestCase):
         a = Attribute.objects.get(name="ABV")
         self.assertEqual(str(a), "ABV")
 
+    def test_slug_collision(self):
+        """
+        A generated slug which is taken is generated again
+        """
+        taken = Attribute.objects.get(name="ABV").slug
+        with mock.patch('webshop_drf.utils.random_strings', side_effect=[[taken], ["fresh00000"]]):
+            a = Attribute.objects.create(name="Brand")
+        self.assertEqual(a.slug, "fresh00000")
+
+    def test_slug_given(self):
+        """
+        A given slug which is taken is not replaced
+        """
+        taken = Attribute.objects.get(name="ABV").slug
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Attribute.objects.create(name="Brand", slug=taken)
+
 
 class AttributeValueTest(TestCase):
     """
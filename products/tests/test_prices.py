@@ -0,0 +1,111 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from djmoney.money import Money
+
+from ..models import *
+
+
+class PriceRangeTest(TestCase):
+    """
+    Test module For the price range of products
+    maintained from their variants
+    """
+
+    def setUp(self):
+        pt = ProductTemplate.objects.create(name="Beer")
+        self.p = Product.objects.create(
+            name="Pale Ale",
+            product_template=pt,
+            min_price=Money(1000, 'HUF')
+        )
+
+    def add_variant(self, amount, currency='HUF', active=True):
+        return ProductVariant.objects.create(
+            name=f"Pale Ale {amount}",
+            product=self.p,
+            price=Money(amount, currency),
+            active=active
+        )
+
+    def check_range(self, low, high, currency='HUF'):
+        self.p.refresh_from_db()
+        self.assertEqual(self.p.min_price, Money(low, currency))
+        self.assertEqual(self.p.max_price, Money(high, currency))
+
+    def test_no_variants(self):
+        """Products without active variants keep their range"""
+        self.add_variant(300, active=False)
+        self.check_range(1000, 0)
+
+    def test_create(self):
+        self.add_variant(300)
+        self.check_range(300, 300)
+        self.add_variant(100)
+        self.add_variant(500)
+        self.add_variant(200)
+        self.check_range(100, 500)
+
+    def test_price_change(self):
+        self.add_variant(100)
+        v = self.add_variant(300)
+        self.add_variant(200)
+
+        v.price = Money(50, 'HUF')
+        v.save()
+        self.check_range(50, 200)
+
+        v.price = Money(150, 'HUF')
+        v.save()
+        self.check_range(100, 200)
+
+    def test_active_change(self):
+        v = self.add_variant(100)
+        self.add_variant(200)
+
+        v.active = False
+        v.save()
+        self.check_range(200, 200)
+
+        v = ProductVariant.objects.get(id=v.id)
+        v.active = True
+        v.save()
+        self.check_range(100, 200)
+
+    def test_delete(self):
+        self.add_variant(100)
+        v = self.add_variant(300)
+        self.add_variant(200)
+
+        v.delete()
+        self.check_range(100, 200)
+
+    def test_currencies(self):
+        """Prices are compared in one currency"""
+        self.add_variant(10, 'EUR')
+        self.add_variant(20, 'EUR')
+        self.check_range(10, 20, 'EUR')
+
+        # Prices in another currency do not change the range
+        self.add_variant(1, 'USD')
+        self.check_range(10, 20, 'EUR')
+
+        # The currency of most variants is used
+        # when none is priced in the current one
+        ProductVariant.objects.filter(price_currency='EUR').delete()
+        self.add_variant(2, 'USD')
+        self.check_range(1, 2, 'USD')
+
+    def test_repair_command(self):
+        self.add_variant(100)
+        self.add_variant(200)
+        Product.objects.filter(id=self.p.id).update(min_price=7, max_price=8)
+        modified = Product.objects.get(id=self.p.id).modified
+
+        out = StringIO()
+        call_command('refresh_price_ranges', stdout=out)
+        self.assertIn("1 products", out.getvalue())
+        self.check_range(100, 200)
+        # Repaired products are modified for conditional GETs
+        self.assertGreater(self.p.modified, modified)
@@ -0,0 +1,82 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from ..models import *
+from ..search import get_match_query, rebuild_search_index, search_products
+
+
+class SearchIndexTest(TransactionTestCase):
+    """
+    Test module For the full-text search table
+    maintained from model signals
+    """
+
+    def setUp(self):
+        # Rows of former tests are not flushed with the models
+        rebuild_search_index()
+        pt = ProductTemplate.objects.create(name="Beer")
+        attribute = Attribute.objects.create(name="Packaging")
+        self.value = AttributeValue.objects.create(attribute=attribute, name="Glass bottle", value="glass")
+        self.av = AttributeVariant.objects.create(attribute=attribute, product_template=pt)
+        self.ale = Product.objects.create(name="Pale Ale", description="Hoppy béer", product_template=pt)
+        self.stout = Product.objects.create(name="Stout", product_template=pt)
+        self.variant = ProductVariant.objects.create(name="Stout 330 ml", product=self.stout)
+
+    def get_ids(self, text):
+        return [id for id, _rank, _snippet in search_products(text)]
+
+    def test_match_query(self):
+        self.assertEqual(get_match_query('pale "ale'), '"pale"* "ale"*')
+        self.assertIsNone(get_match_query('  -- '))
+
+    def test_search(self):
+        self.assertEqual(self.get_ids("pale"), [self.ale.id])
+        # Prefixes and diacritics
+        self.assertEqual(self.get_ids("Ho beer"), [self.ale.id])
+        self.assertEqual(self.get_ids("330"), [self.stout.id])
+        self.assertEqual(self.get_ids("lager"), [])
+
+        _id, rank, snippet = search_products("hoppy")[0]
+        self.assertGreater(rank, 0)
+        self.assertIn("<b>Hoppy</b>", snippet)
+
+    def test_snippet_escaped(self):
+        self.ale.description = 'Hoppy <script>alert("x")</script>'
+        self.ale.save()
+        _id, _rank, snippet = search_products("hoppy")[0]
+        self.assertIn("<b>Hoppy</b>", snippet)
+        self.assertNotIn("<script>", snippet)
+        self.assertIn("&lt;script&gt;", snippet)
+
+    def test_ranking(self):
+        """Matches in the name rank before the description"""
+        ProductVariant.objects.create(name="Pale Ale can", product=self.ale)
+        Product.objects.create(name="Hoppy Lager", product_template=self.ale.product_template)
+        ids = self.get_ids("hoppy")
+        self.assertEqual(len(ids), 2)
+        self.assertNotEqual(ids[0], self.ale.id)
+
+    def test_signals(self):
+        ConnectedVariantAttribute.objects.create(variant=self.variant, connection=self.av, value=self.value)
+        self.assertEqual(self.get_ids("glass"), [self.stout.id])
+
+        self.value.name = "Can"
+        self.value.save()
+        self.assertEqual(self.get_ids("glass"), [])
+        self.assertEqual(self.get_ids("can"), [self.stout.id])
+
+        self.variant.product = self.ale
+        self.variant.save()
+        self.assertEqual(self.get_ids("330"), [self.ale.id])
+
+        self.ale.delete()
+        self.assertEqual(self.get_ids("330"), [])
+
+    def test_command(self):
+        Product.objects.filter(id=self.ale.id).update(name="Lager")
+        out = StringIO()
+        call_command('search_index', stdout=out)
+        self.assertIn("Indexed 2 products", out.getvalue())
+        self.assertEqual(self.get_ids("lager"), [self.ale.id])
@@ -0,0 +1,65 @@
+from django.test import TestCase
+
+from ..models import *
+from ..signatures import get_conflicts, get_signature, refresh_signatures, resolve_variant
+
+
+class SignatureTest(TestCase):
+    """
+    Test module For the attribute signatures of variants
+    """
+
+    def setUp(self):
+        pt = ProductTemplate.objects.create(name="Beer")
+        size = Attribute.objects.create(name="Bottle Size")
+        color = Attribute.objects.create(name="Color")
+        self.small = AttributeValue.objects.create(attribute=size, name="330 ml", value="330 ml")
+        self.large = AttributeValue.objects.create(attribute=size, name="500 ml", value="500 ml")
+        self.dark = AttributeValue.objects.create(attribute=color, name="Dark", value="Dark")
+        self.size = AttributeVariant.objects.create(attribute=size, product_template=pt)
+        self.color = AttributeVariant.objects.create(attribute=color, product_template=pt)
+        self.p = Product.objects.create(name="Modelo", product_template=pt)
+        self.v = ProductVariant.objects.create(name="Modelo 330 ml", product=self.p)
+
+    def test_signature(self):
+        self.assertEqual(get_signature([12, 3, 12]), get_signature(["3", 12]))
+        self.assertNotEqual(get_signature([3, 12]), get_signature([3]))
+        self.assertEqual(len(get_signature(range(1000))), 40)
+        self.assertEqual(get_signature([]), "")
+
+    def test_signals(self):
+        cva = ConnectedVariantAttribute.objects.create(variant=self.v, connection=self.size, value=self.large)
+        ConnectedVariantAttribute.objects.create(variant=self.v, connection=self.color, value=self.dark)
+        self.v.refresh_from_db()
+        self.assertEqual(self.v.attribute_signature, get_signature([self.large.id, self.dark.id]))
+
+        cva.value = self.small
+        cva.save()
+        self.v.refresh_from_db()
+        self.assertEqual(self.v.attribute_signature, get_signature([self.small.id, self.dark.id]))
+
+        cva.delete()
+        self.v.refresh_from_db()
+        self.assertEqual(self.v.attribute_signature, get_signature([self.dark.id]))
+
+    def test_bulk_write(self):
+        ConnectedVariantAttribute.objects.bulk_create([
+            ConnectedVariantAttribute(variant=self.v, connection=self.size, value=self.small),
+        ])
+        with self.assertNumQueries(2):
+            refresh_signatures([self.v.id], [self.v])
+        self.assertEqual(self.v.attribute_signature, get_signature([self.small.id]))
+
+    def test_lookups(self):
+        ConnectedVariantAttribute.objects.create(variant=self.v, connection=self.size, value=self.small)
+        ConnectedVariantAttribute.objects.create(variant=self.v, connection=self.color, value=self.dark)
+
+        with self.assertNumQueries(1):
+            variant = resolve_variant(self.p.id, [self.dark.id, self.small.id], ['id'])
+        self.assertEqual(variant, {'id': self.v.id})
+        self.assertIsNone(resolve_variant(self.p.id, [self.small.id], ['id']))
+
+        signature = get_signature([self.small.id, self.dark.id])
+        self.assertEqual(get_conflicts([(self.p.id, signature), (self.p.id, get_signature([self.large.id]))]),
+                         {(self.p.id, signature)})
+        self.assertEqual(get_conflicts([(self.p.id, signature)], ignore=[self.v.id]), set())
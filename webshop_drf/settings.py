@@ -64,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'products.middleware.IdentityMapMiddleware',
 ]
 
 ROOT_URLCONF = 'webshop_drf.urls'
@@ -131,6 +132,22 @@ USE_L10N = True
 USE_TZ = True
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache of catalog (/api/product/) GET responses, 0 disables it
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 60 * 15
+# Keys of the in-memory autocomplete index (products.autocomplete)
+AUTOCOMPLETE_MAX_KEYS = 100000
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 